@@ -2,7 +2,11 @@
 import streamlit as st
 import altair as alt
 import pandas as pd
+from datetime import date, datetime, timedelta
+import db
 from db import init_db
+from ingestion import APPLIED, QUEUED, get_match_queue
+import query_stats
 from models import DatabaseManager
 from streamlit_js_eval import streamlit_js_eval
 
@@ -87,6 +91,14 @@ def show_release_notes():
         st.session_state['notes_dismissed'] = True
         st.rerun()
 
+def format_rank_change(change):
+    """Movement arrow for a rank change; None means the player had not played yet."""
+    if change is None:
+        return "new"
+    if change == 0:
+        return "="
+    return f"▲ {change}" if change > 0 else f"▼ {-change}"
+
 def show_leaderboard(l_id, l_name):
     st.subheader("🏆 Leaderboard")
     leaderboard_data = DatabaseManager.get_leaderboard(l_id)
@@ -97,7 +109,9 @@ def show_leaderboard(l_id, l_name):
 
     st.dataframe([
         {
-            "Rank": index + 1,
+            "Rank": player[7],
+            "24h": format_rank_change(player[8]),
+            "7d": format_rank_change(player[9]),
             "Player": player[0],
             "Rating": round(player[1], 1),
             "Matches": player[2],
@@ -107,7 +121,7 @@ def show_leaderboard(l_id, l_name):
             "Win %": (player[3] / player[2] * 100) if player[2] > 0 else 0.0,
             "Trend": player[6] if player[6] else "-"
         }
-        for index, player in enumerate(leaderboard_data)
+        for player in leaderboard_data
     ], hide_index=True, column_config={
         "Win %": st.column_config.NumberColumn(format="%.1f%%"),
         "Rating": st.column_config.NumberColumn(format="%.1f")
@@ -115,7 +129,15 @@ def show_leaderboard(l_id, l_name):
 
 def show_elo_trends(l_id):
     st.subheader("📈 Player Elo Trends")
-    df_history = DatabaseManager.get_elo_history(l_id)
+    col1, col2 = st.columns(2)
+    periods = {"All time": None, "Last year": 365, "Last 90 days": 90, "Last 30 days": 30}
+    period = col1.selectbox("Period", list(periods), key=f"elo_period_{l_id}")
+    resolutions = {"Auto": "auto", "Daily": "daily", "Every match": "full"}
+    resolution = col2.selectbox("Detail", list(resolutions), key=f"elo_detail_{l_id}")
+    since = None
+    if periods[period]:
+        since = datetime.combine(date.today() - timedelta(days=periods[period]), datetime.min.time())
+    df_history = DatabaseManager.get_elo_trend_series(l_id, resolutions[resolution], since)
 
     if df_history.empty:
         st.info("No historical data available.")
@@ -146,7 +168,6 @@ def show_elo_trends(l_id):
 
 def show_match_history(l_id):
     st.subheader("📜 Match History")
-    limit = st.slider("Matches to show", 5, 200, 20, key=f"limit_{l_id}")
     
     all_players_data = DatabaseManager.get_all_players(l_id)
     player_options = ["All Players"] + [p[1] for p in all_players_data]
@@ -155,7 +176,27 @@ def show_match_history(l_id):
     selected_player_name = st.selectbox("Filter by Player", player_options, key=f"hist_filter_{l_id}")
     selected_player_id = player_map.get(selected_player_name)
     
-    history_data = DatabaseManager.get_match_history(limit, player_id=selected_player_id, leaderboard_id=l_id)
+    pages_key = f"hist_pages_{l_id}_{selected_player_id}"
+    history_data = []
+    cursor = None
+    for _ in range(st.session_state.get(pages_key, 1)):
+        page, cursor = DatabaseManager.get_match_history_page(l_id, selected_player_id, cursor)
+        history_data.extend(page)
+        if cursor is None:
+            break
+
+    if selected_player_id:
+        rank = DatabaseManager.get_player_rank(selected_player_id, l_id)
+        if rank:
+            # Positive changes are places gained, so Streamlit's delta arrow points the right way.
+            st.metric("Rank (change in 24h)", f"#{rank[0]}", delta=rank[1], help=f"7 days: {format_rank_change(rank[2])}")
+        rival_options = ["-"] + [name for name in player_map if name != selected_player_name]
+        rival_name = st.selectbox("Head-to-head with", rival_options, key=f"h2h_{l_id}")
+        if rival_name != "-":
+            h2h = DatabaseManager.get_head_to_head(selected_player_id, player_map[rival_name], l_id)
+            col1, col2 = st.columns(2)
+            col1.metric("As partners (W/P)", f"{h2h['together_wins']}/{h2h['together']}")
+            col2.metric(f"Against {rival_name} (W/P)", f"{h2h['against_wins']}/{h2h['against']}")
 
     if not history_data:
         st.info("No matches recorded.")
@@ -189,11 +230,15 @@ def show_match_history(l_id):
 
         st.dataframe(table_rows, hide_index=True, use_container_width=True)
 
+        if cursor is not None and st.button("Load more", key=f"hist_more_{l_id}"):
+            st.session_state[pages_key] = st.session_state.get(pages_key, 1) + 1
+            st.rerun()
+
 def show_calendar(l_id, can_manage):
     st.subheader("📅 Future Matches")
     
     if can_manage:
-        if st.button("Generate Random Schedule"):
+        if st.button("Generate Schedule"):
             with st.spinner("Generating schedule..."):
                 DatabaseManager.generate_calendar(l_id)
             st.success("New schedule generated!")
@@ -238,9 +283,10 @@ def show_matchmaking(l_id):
             available_ids = [player_map[name] for name in available]
             
             with st.spinner("Calculating..."):
-                best = DatabaseManager.get_best_match_for_player(target_id, available_ids, l_id)
+                matches = DatabaseManager.get_best_matches_for_player(target_id, available_ids, l_id)
             
-            if best:
+            if matches:
+                best = matches[0]
                 st.success("Match found!")
                 st.markdown(f"""
                 <div style="text-align: center; border: 1px solid #4CAF50; border-radius: 8px; padding: 15px; background-color: rgba(76, 175, 80, 0.05);">
@@ -251,6 +297,18 @@ def show_matchmaking(l_id):
                 </div>
                 """, unsafe_allow_html=True)
 
+                if len(matches) > 1:
+                    with st.expander("Other good matches"):
+                        st.dataframe([
+                            {
+                                "Team A": " & ".join(m["team_a"]),
+                                "Team B": " & ".join(m["team_b"]),
+                                "Win Prob": f"{m['win_prob']:.1%}",
+                                "Est. Gain": f"+{m['est_delta']:.1f}",
+                            }
+                            for m in matches[1:]
+                        ], hide_index=True, use_container_width=True)
+
 # --- Admin Page Components ---
 
 def show_new_match(l_id):
@@ -277,6 +335,17 @@ def show_new_match(l_id):
         b2 = st.selectbox("Team B - P2", player_options, index=0, key=f"{form_key_prefix}_b2")
         score_b = st.number_input("Team B Goals", min_value=0, value=8, key=f"{form_key_prefix}_sb")
 
+    ticket_key = f"match_queue_ticket_{l_id}"
+    if ticket_key in st.session_state:
+        status = get_match_queue().status(st.session_state[ticket_key])
+        if status is None or status["state"] == APPLIED:
+            st.session_state.pop(ticket_key)
+        elif status["state"] == QUEUED:
+            st.info("The last match is still queued; it will show up once it is saved.")
+        else:
+            st.session_state.pop(ticket_key)
+            st.error(status["error"])
+
     save_btn_placeholder = st.empty()
     save_clicked = save_btn_placeholder.button(
         "Save Match",
@@ -293,7 +362,16 @@ def show_new_match(l_id):
             try:
                 st.session_state[saving_key] = True
                 save_btn_placeholder.button("Saving Match...", disabled=True, use_container_width=True)
-                DatabaseManager.record_match(a1, a2, b1, b2, score_a, score_b, l_id)
+                if db.MATCH_QUEUE:
+                    queue = get_match_queue()
+                    ticket = queue.submit(a1, a2, b1, b2, score_a, score_b, l_id)
+                    status = queue.wait(ticket, timeout=2)
+                    if status["state"] == QUEUED:
+                        st.session_state[ticket_key] = ticket
+                    elif status["state"] != APPLIED:
+                        raise ValueError(status["error"])
+                else:
+                    DatabaseManager.record_match(a1, a2, b1, b2, score_a, score_b, l_id)
                 st.success("Match saved!")
                 st.session_state[form_version_key] = form_version + 1
                 st.session_state.pop(saving_key, None)
@@ -315,11 +393,31 @@ def show_delete_match(l_id):
         if not selected:
             st.warning("Please select at least one match.")
         else:
-            for label in selected:
-                DatabaseManager.delete_match(match_map[label])
+            DatabaseManager.delete_matches([match_map[label] for label in selected])
             st.success("Selected matches deleted!")
             st.rerun()
 
+def show_query_stats():
+    st.subheader("📈 Query Stats")
+    pool = db.pool_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Connections in use", f"{pool['checked_out']} / {pool['size']}", f"+{pool['overflow']} overflow", delta_color="off")
+    col2.metric("Checkouts", pool["checkouts"], f"{pool['connects']} connections opened", delta_color="off")
+    col3.metric("Avg / max wait", f"{pool['wait_avg_ms']:.1f} / {pool['wait_max_ms']:.0f} ms")
+    col4.metric("Pool timeouts", pool["timeouts"])
+
+    if not db.QUERY_STATS:
+        st.info("Set QUERY_STATS=1 and restart the app to time queries per method and leaderboard.")
+        return
+    report = query_stats.snapshot()
+    if not report:
+        st.info("No queries recorded yet.")
+    else:
+        st.dataframe(pd.DataFrame(report).round(2), hide_index=True, use_container_width=True)
+    if st.button("Reset Stats"):
+        query_stats.reset()
+        st.rerun()
+
 def show_manage_players(l_id, l_name):
     st.subheader("👥 Manage Players")
     with st.expander("➕ Add New Player"):
@@ -431,6 +529,9 @@ def run_web_app():
     selected_l_id = leaderboard_options[selected_l_name]
 
     # Helper for permissions
+    def is_admin():
+        return isinstance(st.session_state['user'], dict) and st.session_state['user']['role'] == 'admin'
+
     def can_manage():
         if st.session_state['user'] == "guest" or st.session_state['user'] is None:
             return False
@@ -459,6 +560,10 @@ def run_web_app():
             if st.button("🗑️ Delete Match", use_container_width=True):
                 st.session_state['current_page'] = "Delete Match"
                 st.rerun()
+        if is_admin():
+            if st.button("📈 Query Stats", use_container_width=True):
+                st.session_state['current_page'] = "Query Stats"
+                st.rerun()
 
         st.divider()
         st.subheader("Account")
@@ -495,6 +600,8 @@ def run_web_app():
         show_manage_players(selected_l_id, selected_l_name)
     elif current_page == "Delete Match":
         show_delete_match(selected_l_id)
+    elif current_page == "Query Stats" and is_admin():
+        show_query_stats()
     else:
         # Standard Views (Home / History / Trends / etc)
         if is_mobile:
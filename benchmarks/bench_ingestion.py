@@ -0,0 +1,62 @@
+"""Compares live match ingestion through concurrent record_match calls with the MatchQueue.
+
+Run against a scratch Postgres; everything is written to its own schema, dropped afterwards:
+
+    DATABASE_URL=postgresql://localhost/calcio_bench python benchmarks/bench_ingestion.py --kiosks 16 --matches 400
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import new_leaderboard, scratch_engine, unique_matches
+
+import ingestion
+import models
+
+SCHEMA = "calcio_bench_ingestion"
+
+
+def run_direct(engine, matches, kiosks):
+    l_id = new_leaderboard(engine, "direct")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(kiosks) as pool:
+        for future in [pool.submit(models.DatabaseManager.record_match, *match, l_id) for match in matches]:
+            future.result()
+    return time.perf_counter() - started
+
+
+def run_queue(engine, matches, kiosks):
+    l_id = new_leaderboard(engine, "queue")
+    queue = ingestion.MatchQueue()
+    started = time.perf_counter()
+
+    def kiosk(match):
+        return queue.wait(queue.submit(*match, l_id))["state"]
+
+    with ThreadPoolExecutor(kiosks) as pool:
+        states = list(pool.map(kiosk, matches))
+    elapsed = time.perf_counter() - started
+    queue.close()
+    assert states == [ingestion.APPLIED] * len(matches), set(states)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kiosks", type=int, default=16, help="concurrent submitters")
+    parser.add_argument("--matches", type=int, default=400)
+    parser.add_argument("--players", type=int, default=24)
+    args = parser.parse_args()
+
+    names = [f"p{i}" for i in range(args.players)]
+    matches = unique_matches(names, args.matches, seed=20)
+    with scratch_engine(SCHEMA, pool_size=args.kiosks) as engine:
+        results = {"direct": run_direct(engine, matches, args.kiosks), "queue": run_queue(engine, matches, args.kiosks)}
+
+    for path, elapsed in results.items():
+        print(f"{path:>6}: {args.matches / elapsed:8.1f} matches/s ({elapsed:.2f}s)")
+    print(f"speedup: {results['direct'] / results['queue']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Times the hot paths on synthetic leaderboards and compares the results with a baseline.
+
+Run against a scratch Postgres; each size gets its own schema, dropped afterwards unless --keep:
+
+    DATABASE_URL=postgresql://localhost/calcio_bench python benchmarks/bench_suite.py --output results.json
+    DATABASE_URL=postgresql://localhost/calcio_bench python benchmarks/bench_suite.py --baseline results.json
+
+An SQLite URL (sqlite:///bench.db) runs without a server, with one database file per size;
+compare its results only with baselines from the same database.
+
+With --baseline the run exits with status 1 when a benchmark's median is more than
+--tolerance times its baseline median.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import text
+
+from common import scratch_engine, unique_matches
+
+import db
+import models
+import scoring
+
+# (players, matches) of the synthetic leaderboards.
+SIZES = ((10, 1_000), (100, 100_000), (1_000, 1_000_000))
+QUICK_SIZES = ((10, 1_000), (100, 10_000))
+# Matchmaking scores every partner against every opposing pair, so time grows with the
+# cube of the available players; larger leaderboards are benchmarked with this many.
+MATCHMAKING_POOL = 200
+# Matches after the one deleted (and re-recorded back-dated) by the suffix replay benchmarks.
+SUFFIX_DEPTH = 100
+SCORING_CALLS_PER_SAMPLE = 1000
+# (players, matches) of the match logs replayed in memory by scoring.replay_matches in
+# both rating storages. Rebuilds run in float32, the REAL column storage; on a 1-CPU
+# 2026 x86-64 VM the medians are 0.55-0.65 s in float64 and 0.6-0.75 s in float32, for
+# 100 and 1,000 players alike.
+REPLAY_SIZES = ((100, 100_000), (1_000, 100_000))
+
+# Random but reproducible (setseed) matches between distinct players, one minute apart up to now.
+SYNTHETIC_DATA = """
+SELECT setseed(0.42);
+
+INSERT INTO players (name) SELECT :prefix || i FROM generate_series(1, :players) i;
+
+INSERT INTO player_stats (player_id, leaderboard_id)
+SELECT id, :l_id FROM players WHERE name LIKE :prefix || '%';
+
+WITH pool AS (
+    SELECT array_agg(id ORDER BY id) AS ids FROM players WHERE name LIKE :prefix || '%'
+), drawn AS (
+    -- k * step stays distinct mod players for k = 0..3 while 3 * step < players.
+    SELECT i,
+           floor(random() * :players)::INTEGER AS base,
+           1 + floor(random() * ((:players - 1) / 3))::INTEGER AS step,
+           random() < 0.5 AS a_wins,
+           floor(random() * 9)::INTEGER AS loser_goals
+    FROM generate_series(1, :matches) i
+)
+INSERT INTO matches (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id)
+SELECT LOCALTIMESTAMP - (:matches - i) * INTERVAL '1 minute',
+       ids[1 + base], ids[1 + (base + step) % :players],
+       ids[1 + (base + 2 * step) % :players], ids[1 + (base + 3 * step) % :players],
+       CASE WHEN a_wins THEN 10 ELSE loser_goals END, CASE WHEN a_wins THEN loser_goals ELSE 10 END,
+       :l_id
+FROM drawn, pool
+ORDER BY i;
+"""
+
+
+def insert_synthetic_data_sqlite(conn, prefix, players, matches, l_id):
+    """SYNTHETIC_DATA for SQLite, drawn in Python with the same construction (but not the same numbers)."""
+    conn.execute(text("INSERT INTO players (name) VALUES (:name)"), [{"name": f"{prefix}{i}"} for i in range(1, players + 1)])
+    ids = conn.execute(text("SELECT id FROM players WHERE name LIKE :prefix || '%' ORDER BY id"), {"prefix": prefix}).scalars().all()
+    conn.execute(text("INSERT INTO player_stats (player_id, leaderboard_id) VALUES (:pid, :l_id)"), [
+        {"pid": pid, "l_id": l_id} for pid in ids
+    ])
+    rng = random.Random(0.42)
+    now = datetime.now()
+    rows = []
+    for i in range(1, matches + 1):
+        base = int(rng.random() * players)
+        step = 1 + int(rng.random() * ((players - 1) // 3))
+        a_wins, loser_goals = rng.random() < 0.5, int(rng.random() * 9)
+        quad = [ids[(base + k * step) % players] for k in range(4)]
+        rows.append({
+            "d": now - timedelta(minutes=matches - i), "a1": quad[0], "a2": quad[1], "b1": quad[2], "b2": quad[3],
+            "ga": 10 if a_wins else loser_goals, "gb": loser_goals if a_wins else 10, "l_id": l_id,
+        })
+    conn.execute(text("""
+        INSERT INTO matches (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id)
+        VALUES (:d, :a1, :a2, :b1, :b2, :ga, :gb, :l_id)
+    """), rows)
+
+
+def build_leaderboard(engine, players, matches):
+    """Returns the id of the synthetic leaderboard, creating and replaying it unless a kept one exists."""
+    code = f"bench-{players}-{matches}"
+    with engine.connect() as conn:
+        l_id = conn.execute(text("SELECT id FROM leaderboards WHERE code = :code"), {"code": code}).scalar()
+    if l_id is not None:
+        return l_id
+
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        l_id = conn.execute(
+            text("INSERT INTO leaderboards (name, code) VALUES (:code, :code) RETURNING id"), {"code": code}
+        ).scalar()
+        sqlite = db.is_sqlite(conn)
+        if sqlite:
+            insert_synthetic_data_sqlite(conn, f"{code}-p", players, matches, l_id)
+        else:
+            conn.execute(text(SYNTHETIC_DATA), {"prefix": f"{code}-p", "players": players, "matches": matches, "l_id": l_id})
+        participants = db.insert_match_participants_sql("matches", "WHERE m.leaderboard_id = :l_id", sqlite=sqlite)
+        conn.execute(text(participants), {"l_id": l_id})
+    models.DatabaseManager.rebuild_leaderboard(l_id)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("ANALYZE"))
+    print(f"built {players} players / {matches} matches in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return l_id
+
+
+def summarize(name, samples, players=None, matches=None, **params):
+    ms = sorted(s * 1000 for s in samples)
+    return {
+        "benchmark": name,
+        "players": players,
+        "matches": matches,
+        "repeat": len(ms),
+        "median_ms": statistics.median(ms),
+        "mean_ms": statistics.fmean(ms),
+        "p95_ms": ms[min(len(ms) - 1, int(0.95 * len(ms)))],
+        "min_ms": ms[0],
+        "max_ms": ms[-1],
+        "params": params,
+    }
+
+
+def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_scoring(repeat):
+    players = [[i, f"p{i}", 1000.0 + 37 * i, 10 * i, 5 * i, 5 * i, 0, "WLW"] for i in range(4)]
+
+    def batch():
+        for _ in range(SCORING_CALLS_PER_SAMPLE):
+            scoring.calculate_match_updates(players, 10, 6, 150.0)
+
+    samples = [s / SCORING_CALLS_PER_SAMPLE for s in timed(batch, repeat)]
+    return [summarize("scoring.calculate_match_updates", samples, calls_per_sample=SCORING_CALLS_PER_SAMPLE)]
+
+
+def bench_replay(repeat, sizes=REPLAY_SIZES):
+    results = []
+    for players, matches in sizes:
+        rng = np.random.default_rng(0)
+        player_idx = np.argsort(rng.random((matches, players)), axis=1)[:, :4]
+        a_wins = rng.random(matches) < 0.5
+        loser_goals = rng.integers(0, 9, matches)
+        goals_a = np.where(a_wins, 10, loser_goals)
+        goals_b = np.where(a_wins, loser_goals, 10)
+
+        for storage in scoring.RATING_STORAGES:
+            samples = timed(
+                lambda: scoring.replay_matches(player_idx, goals_a, goals_b, rating_storage=storage),
+                max(repeat // 5, 1),
+            )
+            results.append(summarize("scoring.replay_matches", samples, players, matches, rating_storage=storage))
+    return results
+
+
+def bench_leaderboard(engine, players, matches, repeat):
+    DM = models.DatabaseManager
+    l_id = build_leaderboard(engine, players, matches)
+    size = {"players": players, "matches": matches}
+    results = []
+
+    pool = [p[0] for p in DM.get_matchmaking_pool(l_id)]
+    available = pool[:MATCHMAKING_POOL]
+    DM.get_best_match_for_player(available[0], available, l_id)
+    results.append(summarize(
+        "get_best_match_for_player",
+        timed(lambda: DM.get_best_match_for_player(available[0], available, l_id), repeat),
+        available=len(available), **size,
+    ))
+
+    results.append(summarize(
+        "generate_calendar", timed(lambda: DM.generate_calendar(l_id, seed=0), repeat), **size,
+    ))
+
+    names = [r[1] for r in DM.get_all_players(l_id)]
+    submissions = iter(unique_matches(names, repeat, seed=players))
+    results.append(summarize(
+        "record_match", timed(lambda: DM.record_match(*next(submissions), l_id), repeat), **size,
+    ))
+
+    # Deleting the latest match subtracts its deltas; this also removes the matches just recorded.
+    def latest_match_id():
+        with engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT id FROM matches WHERE leaderboard_id = :l_id ORDER BY date DESC, id DESC LIMIT 1
+            """), {"l_id": l_id}).scalar()
+
+    latest = []
+    for _ in range(repeat):
+        match_id = latest_match_id()
+        started = time.perf_counter()
+        DM.delete_match(match_id)
+        latest.append(time.perf_counter() - started)
+    results.append(summarize("delete_match", latest, path="latest", **size))
+
+    # An older match replays its suffix; re-recording it back-dated replays it again and restores the data.
+    deleted, recorded = [], []
+    for _ in range(max(repeat // 4, 1)):
+        with engine.connect() as conn:
+            match = conn.execute(text("""
+                SELECT m.id, m.date, pa1.name, pa2.name, pb1.name, pb2.name, m.goals_a, m.goals_b
+                FROM matches m
+                JOIN players pa1 ON pa1.id = m.a1_id JOIN players pa2 ON pa2.id = m.a2_id
+                JOIN players pb1 ON pb1.id = m.b1_id JOIN players pb2 ON pb2.id = m.b2_id
+                WHERE m.leaderboard_id = :l_id ORDER BY m.date DESC, m.id DESC LIMIT 1 OFFSET :depth
+            """), {"l_id": l_id, "depth": SUFFIX_DEPTH}).fetchone()
+        started = time.perf_counter()
+        DM.delete_match(match[0])
+        deleted.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        DM.record_match(*match[2:], l_id, played_at=match[1])
+        recorded.append(time.perf_counter() - started)
+    results.append(summarize("delete_match", deleted, path="suffix", depth=SUFFIX_DEPTH, **size))
+    results.append(summarize("record_match", recorded, path="back-dated", depth=SUFFIX_DEPTH, **size))
+    return results
+
+
+def result_key(result):
+    return result["benchmark"], result["players"], result["matches"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    """Adds baseline_median_ms, ratio and status (ok / regression / improved / new) to each result.
+
+    Returns the number of regressions.
+    """
+    previous = {result_key(r): r for r in baseline["results"]}
+    regressions = 0
+    for result in results:
+        base = previous.get(result_key(result))
+        if base is None:
+            result["status"] = "new"
+            continue
+        result["baseline_median_ms"] = base["median_ms"]
+        result["ratio"] = result["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        if result["ratio"] > tolerance:
+            result["status"] = "regression"
+            regressions += 1
+        elif result["ratio"] < 1 / tolerance:
+            result["status"] = "improved"
+        else:
+            result["status"] = "ok"
+    return regressions
+
+
+def metadata(engine):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    with engine.connect() as conn:
+        if db.is_sqlite(conn):
+            database = "sqlite " + conn.execute(text("SELECT sqlite_version()")).scalar()
+        else:
+            database = "postgres " + conn.execute(text("SHOW server_version")).scalar()
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "database": database,
+        "machine": platform.machine(),
+    }
+
+
+def parse_sizes(value):
+    return tuple(tuple(int(n) for n in size.split("x")) for size in value.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=parse_sizes, help="comma-separated PLAYERSxMATCHES, e.g. 10x1000,100x100000")
+    parser.add_argument("--quick", action="store_true", help=f"only {QUICK_SIZES}")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="allowed median slowdown against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic data for the next run")
+    args = parser.parse_args()
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+
+    results = bench_scoring(args.repeat) + bench_replay(args.repeat)
+    for players, matches in sizes:
+        with scratch_engine(f"calcio_bench_{players}_{matches}", keep=args.keep) as engine:
+            meta = metadata(engine)
+            results += bench_leaderboard(engine, players, matches, args.repeat)
+
+    report = {"meta": dict(meta, repeat=args.repeat, sizes=sizes), "results": results}
+    regressions = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        report["meta"]["baseline"] = baseline["meta"]
+
+    for r in results:
+        size = f"{r['players']}x{r['matches']}" if r["players"] else "-"
+        params = ",".join(f"{k}={v}" for k, v in r["params"].items())
+        ratio = f"{r['ratio']:.2f}x {r['status']}" if "ratio" in r else r.get("status", "")
+        print(f"{r['benchmark']:<32} {size:>14} {params:<28} {r['median_ms']:10.3f} ms  {ratio}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Shared setup for the benchmark scripts: a scratch schema on DATABASE_URL and synthetic matches."""
+import os
+import random
+import sys
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, make_url, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import models
+
+
+@contextmanager
+def scratch_engine(schema, pool_size=5, keep=False):
+    """Points db and models at their own schema of DATABASE_URL, migrated to the current version.
+
+    The schema is dropped on exit unless keep is set; a kept schema is reused by the next run.
+    With an SQLite DATABASE_URL the schema is a database file named after it, next to the
+    configured file (or in memory for sqlite://).
+    """
+    url = make_url(db.DATABASE_URL)
+    if url.get_backend_name() == "sqlite":
+        path = url.database and os.path.join(os.path.dirname(os.path.abspath(url.database)), f"{schema}.db")
+        if path and not keep:
+            _remove_sqlite_files(path)
+        engine = db.create_db_engine(url.set(database=path).render_as_string(hide_password=False))
+        drop = (lambda: _remove_sqlite_files(path)) if path and not keep else (lambda: None)
+    else:
+        admin = create_engine(db.DATABASE_URL)
+        with admin.begin() as conn:
+            if not keep:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        admin.dispose()
+        engine = create_engine(
+            db.DATABASE_URL,
+            pool_size=pool_size,
+            max_overflow=0,
+            connect_args={"options": f"-csearch_path={schema}"},
+        )
+
+        def drop():
+            if not keep:
+                with admin.begin() as conn:
+                    conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+            admin.dispose()
+
+    previous = db.engine, models.engine
+    db.engine = models.engine = engine
+    try:
+        db.init_db()
+        yield engine
+    finally:
+        db.engine, models.engine = previous
+        engine.dispose()
+        drop()
+
+
+def _remove_sqlite_files(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def unique_matches(names, n, seed):
+    """n random live matches, none of them a duplicate of another."""
+    rng = random.Random(seed)
+    seen = set()
+    matches = []
+    while len(matches) < n:
+        a1, a2, b1, b2 = rng.sample(names, 4)
+        goals = (10, rng.randint(0, 8)) if rng.random() < 0.5 else (rng.randint(0, 8), 10)
+        key = frozenset([(frozenset((a1, a2)), goals[0]), (frozenset((b1, b2)), goals[1])])
+        if key not in seen:
+            seen.add(key)
+            matches.append((a1, a2, b1, b2, *goals))
+    return matches
+
+
+def new_leaderboard(engine, code):
+    with engine.begin() as conn:
+        return conn.execute(
+            text("INSERT INTO leaderboards (name, code) VALUES (:code, :code) RETURNING id"), {"code": code}
+        ).scalar()
@@ -1,139 +1,1008 @@
-from sqlalchemy import create_engine, text
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, make_url, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
 import os
+import sqlite3
+import threading
+import time
 import streamlit as st
+import query_stats
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+# Record matches through the record_match_elo() stored function (one round trip) instead of in Python.
+SERVER_SIDE_ELO = os.environ.get("SERVER_SIDE_ELO", "").lower() in ("1", "true", "yes", "on")
+# Leave inactive players out of the rating spread behind the anti-farming threshold.
+RATING_BOUNDS_ACTIVE_ONLY = os.environ.get("RATING_BOUNDS_ACTIVE_ONLY", "").lower() in ("1", "true", "yes", "on")
+# How writers serialize on a leaderboard: "row" locks the leaderboards row and the players' stats
+# rows (FOR UPDATE, in id order), "advisory" takes a transaction-level advisory lock per leaderboard.
+LOCK_MODES = ("row", "advisory")
+MATCH_LOCK_MODE = os.environ.get("MATCH_LOCK_MODE", "row").lower()
+# Send live match submits from the app through the per-leaderboard ingestion queue (ingestion.py).
+MATCH_QUEUE = os.environ.get("MATCH_QUEUE", "").lower() in ("1", "true", "yes", "on")
+# Time every statement per DatabaseManager method and leaderboard (query_stats.py); off costs nothing.
+QUERY_STATS = os.environ.get("QUERY_STATS", "").lower() in ("1", "true", "yes", "on")
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection.
+
+    The clock starts in connect() and stops in the public "checkout" pool event, so
+    the wait includes opening a new connection and the pre-ping; the "connect" event
+    counts the connections opened.
+    """
+
+    def connect(self):
+        _checkout_started.at = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            _record_checkout(time.perf_counter() - _checkout_started.at, timed_out=True)
+            raise
+
+
+_checkout_lock = threading.Lock()
+_checkout_started = threading.local()
+_checkouts = {"checkouts": 0, "timeouts": 0, "connects": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+
+def _record_checkout(waited, timed_out=False):
+    with _checkout_lock:
+        _checkouts["timeouts" if timed_out else "checkouts"] += 1
+        _checkouts["wait_total"] += waited
+        _checkouts["wait_max"] = max(_checkouts["wait_max"], waited)
+
+
+@event.listens_for(TimedQueuePool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _record_checkout(time.perf_counter() - _checkout_started.at)
+
+
+@event.listens_for(TimedQueuePool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    with _checkout_lock:
+        _checkouts["connects"] += 1
+
+
+def engine_options(url, environ=os.environ):
+    """create_engine() pool arguments from DB_POOL_* / DB_* environment variables.
+
+    DB_POOL_PRE_PING=0 drops the liveness round trip on every checkout and instead
+    replaces connections older than DB_POOL_RECYCLE seconds (300 unless set).
+    DB_PGBOUNCER=1 turns off psycopg 3's automatic prepared statements, which a
+    PgBouncer in transaction mode cannot route. psycopg2, the driver in
+    requirements.txt, interpolates parameters client-side and never prepares, and
+    the app keeps no session state between transactions (advisory locks are
+    transaction-level, replay cursors live inside their transaction), so with
+    psycopg2 the flag changes nothing and transaction pooling works as is.
+    SQLite URLs get no pool settings; an in-memory database keeps one shared connection.
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False, "detect_types": sqlite3.PARSE_DECLTYPES}}
+        if url.database in (None, "", ":memory:"):
+            options["poolclass"] = StaticPool
+        return options
+    pre_ping = environ.get("DB_POOL_PRE_PING", "1").lower() in ("1", "true", "yes", "on")
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", -1 if pre_ping else 300)),
+        "pool_pre_ping": pre_ping,
+    }
+    connect_args = {}
+    if "DB_CONNECT_TIMEOUT" in environ:
+        connect_args["connect_timeout"] = int(environ["DB_CONNECT_TIMEOUT"])
+    pgbouncer = environ.get("DB_PGBOUNCER", "").lower() in ("1", "true", "yes", "on")
+    if pgbouncer and url.get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = None
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+# SQLite stores TIMESTAMP columns as ISO text; read them back as datetimes, as Postgres returns them.
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # match_participants rows go away with their match through ON DELETE CASCADE.
+    cursor.execute("PRAGMA foreign_keys = ON")
+    # Readers keep reading while a writer holds the lock (no effect on :memory:).
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.close()
+
+
+def create_db_engine(url, environ=os.environ):
+    """Creates the engine for a Postgres URL or an SQLite file / in-memory URL (sqlite:///app.db, sqlite://)."""
+    new_engine = create_engine(url, **engine_options(url, environ))
+    if new_engine.dialect.name == "sqlite":
+        event.listen(new_engine, "connect", _configure_sqlite_connection)
+    return new_engine
+
+
+def is_sqlite(conn):
+    """True when conn talks to SQLite; DatabaseManager branches on it where the SQL differs."""
+    return conn.dialect.name == "sqlite"
+
 
 # Create a single engine instance
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True
-)
+engine = create_db_engine(DATABASE_URL)
+if QUERY_STATS:
+    query_stats.install(engine)
+
+
+def pool_stats():
+    """Live usage of the engine's connection pool, plus checkout waits since startup."""
+    pool = engine.pool
+    with _checkout_lock:
+        waits = dict(_checkouts)
+    served = waits["checkouts"] + waits["timeouts"]
+    # The single shared connection of an in-memory SQLite database is never checked in or out.
+    queued = isinstance(pool, QueuePool)
+    return {
+        "size": pool.size() if queued else 1,
+        "checked_out": pool.checkedout() if queued else 0,
+        "checked_in": pool.checkedin() if queued else 1,
+        "overflow": max(pool.overflow(), 0) if queued else 0,
+        "checkouts": waits["checkouts"],
+        "timeouts": waits["timeouts"],
+        "connects": waits["connects"],
+        "wait_avg_ms": 1000 * waits["wait_total"] / served if served else 0.0,
+        "wait_max_ms": 1000 * waits["wait_max"],
+    }
+
 
 def get_connection():
     return engine.connect()
 
+
+# Hourly rating snapshots are kept this far back: the longest rank change compares with 7 days ago.
+RATING_SNAPSHOT_RETENTION = timedelta(days=7)
+
+
+def leaderboard_ranks_sql(where):
+    """INSERT that ranks the active players of the leaderboards matching where into leaderboard_ranks.
+
+    where filters player_stats ps. Ties go to the lower player id, so ranks are unique.
+    """
+    return f"""
+        INSERT INTO leaderboard_ranks (leaderboard_id, player_id, rank)
+        SELECT ps.leaderboard_id, ps.player_id,
+               ROW_NUMBER() OVER (PARTITION BY ps.leaderboard_id ORDER BY ps.rating DESC, ps.player_id)
+        FROM player_stats ps
+        JOIN players p ON p.id = ps.player_id
+        WHERE p.is_active = TRUE AND {where}
+    """
+
+
+def rerank_leaderboards_sql(where):
+    """Upsert that re-ranks the active players of the leaderboards matching where.
+
+    Only rows whose rank changed reach the upsert, since a no-op conflict would still
+    lock the row. It never removes a row, so writes that deactivate players rank anew.
+    """
+    return f"""
+        WITH ranked AS (
+            SELECT ps.leaderboard_id, ps.player_id,
+                   ROW_NUMBER() OVER (PARTITION BY ps.leaderboard_id ORDER BY ps.rating DESC, ps.player_id) AS rank_now
+            FROM player_stats ps
+            JOIN players p ON p.id = ps.player_id
+            WHERE p.is_active = TRUE AND {where}
+        )
+        INSERT INTO leaderboard_ranks (leaderboard_id, player_id, rank)
+        SELECT ranked.leaderboard_id, ranked.player_id, ranked.rank_now
+        FROM ranked
+        WHERE ranked.rank_now <> COALESCE((
+            SELECT r.rank FROM leaderboard_ranks r
+            WHERE r.leaderboard_id = ranked.leaderboard_id AND r.player_id = ranked.player_id
+        ), 0)
+        ON CONFLICT (leaderboard_id, player_id) DO UPDATE SET rank = excluded.rank
+    """
+
+
+def rating_snapshot_sql(leaderboard_id, taken_at):
+    """INSERT of the rating snapshot of a leaderboard at taken_at, both SQL expressions.
+
+    A player's rating then is the pre_rating of their first match from taken_at on, or
+    their current rating when they have not played since; both are unrounded, unlike
+    the history's rating column. Players who had not played before taken_at are left out.
+    """
+    # Only the few matches since taken_at are sorted, and the history row is fetched by match id
+    # rather than joined: a rebuild snapshots ratings before its freshly copied history has statistics.
+    return f"""
+        INSERT INTO leaderboard_rating_snapshots (leaderboard_id, taken_at, player_id, rating)
+        SELECT ps.leaderboard_id, {taken_at}, ps.player_id, COALESCE((
+            SELECT h.pre_rating FROM player_ratings_history h
+            WHERE h.player_id = ps.player_id AND h.match_id = (
+                SELECT mp.match_id FROM match_participants mp
+                WHERE mp.player_id = ps.player_id AND mp.leaderboard_id = ps.leaderboard_id AND mp.date >= {taken_at}
+                ORDER BY mp.date, mp.match_id LIMIT 1
+            )
+        ), ps.rating)
+        FROM player_stats ps
+        WHERE ps.leaderboard_id = {leaderboard_id} AND EXISTS (
+            SELECT 1 FROM match_participants prior
+            WHERE prior.player_id = ps.player_id AND prior.leaderboard_id = ps.leaderboard_id AND prior.date < {taken_at}
+        )
+    """
+
+
+def past_ranks_sql(name, cutoff):
+    """CTE name(player_id, rank) that ranks the active players of leaderboard :l_id by their rating at cutoff.
+
+    The ratings come from the first snapshot taken at or after cutoff, since no match
+    was played in between; without one, no match was played since the cutoff and the
+    current ratings stand in. Players who had not played by then are not ranked.
+    """
+    # MIN rather than EXISTS in both branches: it is planned as one primary key lookup.
+    snapshot = f"(SELECT MIN(taken_at) FROM leaderboard_rating_snapshots WHERE leaderboard_id = :l_id AND taken_at >= {cutoff})"
+    return f"""{name} AS (
+        SELECT rated.player_id, ROW_NUMBER() OVER (ORDER BY rated.rating DESC, rated.player_id) AS rank
+        FROM (
+            SELECT s.player_id, s.rating FROM leaderboard_rating_snapshots s
+            WHERE s.leaderboard_id = :l_id AND s.taken_at = {snapshot}
+            UNION ALL
+            SELECT ps.player_id, ps.rating FROM player_stats ps
+            WHERE ps.leaderboard_id = :l_id AND ps.games > 0 AND {snapshot} IS NULL
+        ) rated
+        JOIN players p ON p.id = rated.player_id
+        WHERE p.is_active = TRUE
+    )"""
+
+# PL/pgSQL port of scoring.calculate_match_updates. Every float operation follows the
+# Python evaluation order in double precision, and ratings are read through their text
+# form like the Python client reads REAL columns, so both paths store identical values.
+SERVER_SIDE_ELO_SQL = """
+CREATE OR REPLACE FUNCTION elo_round1(x DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION
+LANGUAGE plpgsql IMMUTABLE STRICT AS $$
+DECLARE
+    -- x * 10 as the exact sum of two exact products, so ties can be settled like Python's round(x, 1).
+    a DOUBLE PRECISION := x * 8;
+    b DOUBLE PRECISION := x * 2;
+    y DOUBLE PRECISION := a + b;
+    n DOUBLE PRECISION := floor(y);
+    err DOUBLE PRECISION;
+BEGIN
+    IF y - n > 0.5 THEN
+        n := n + 1;
+    ELSIF y - n = 0.5 THEN
+        err := (a - (y - (y - a))) + (b - (y - a));
+        IF err > 0 OR (err = 0 AND mod(n::BIGINT, 2) <> 0) THEN
+            n := n + 1;
+        END IF;
+    END IF;
+    RETURN n / 10;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION elo_k_factor(games INTEGER)
+RETURNS DOUBLE PRECISION
+LANGUAGE sql IMMUTABLE STRICT AS $$
+    SELECT 10::DOUBLE PRECISION + (20::DOUBLE PRECISION / (1::DOUBLE PRECISION + (games::DOUBLE PRECISION / 40::DOUBLE PRECISION)));
+$$;
+
+CREATE OR REPLACE FUNCTION record_match_elo(
+    p_leaderboard_id INTEGER,
+    p_names TEXT[],
+    p_goals_a INTEGER,
+    p_goals_b INTEGER,
+    p_date TIMESTAMP,
+    p_duplicate_window INTERVAL,
+    p_active_only BOOLEAN,
+    p_lock_mode TEXT
+)
+RETURNS INTEGER
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ids INTEGER[] := '{}';
+    v_ratings DOUBLE PRECISION[] := '{}';
+    v_games INTEGER[] := '{}';
+    v_wins INTEGER[] := '{}';
+    v_losses INTEGER[] := '{}';
+    v_goal_diffs INTEGER[] := '{}';
+    v_trends TEXT[] := '{}';
+    v_deltas DOUBLE PRECISION[] := '{}';
+    max_r DOUBLE PRECISION;
+    min_r DOUBLE PRECISION;
+    threshold DOUBLE PRECISION;
+    r_a DOUBLE PRECISION;
+    r_b DOUBLE PRECISION;
+    e_a DOUBLE PRECISION;
+    s_a DOUBLE PRECISION := CASE WHEN p_goals_a > p_goals_b THEN 1 ELSE 0 END;
+    margin INTEGER := abs(p_goals_a - p_goals_b);
+    margin_mult DOUBLE PRECISION;
+    multiplier DOUBLE PRECISION := 1;
+    team_diff DOUBLE PRECISION;
+    is_win BOOLEAN;
+    gd INTEGER;
+    new_match_id INTEGER;
+    v_bucket BIGINT := floor(extract(epoch FROM p_date) / extract(epoch FROM p_duplicate_window));
+    stats RECORD;
+BEGIN
+    -- Same lock as DatabaseManager._lock_leaderboards, taken before anything is read.
+    IF p_lock_mode = 'advisory' THEN
+        PERFORM pg_advisory_xact_lock(hashtext('leaderboard_writes'), p_leaderboard_id);
+    ELSE
+        PERFORM 1 FROM leaderboards WHERE id = p_leaderboard_id FOR UPDATE;
+    END IF;
+
+    INSERT INTO players (name) SELECT unnest(p_names) ON CONFLICT (name) DO NOTHING;
+    INSERT INTO player_stats (player_id, leaderboard_id)
+    SELECT id, p_leaderboard_id FROM players WHERE name = ANY (p_names)
+    ON CONFLICT (player_id, leaderboard_id) DO NOTHING;
+
+    -- Both ends of the (leaderboard_id, rating) index; inactive players are skipped on request.
+    IF p_active_only THEN
+        SELECT
+            (SELECT ps.rating FROM player_stats ps JOIN players p ON p.id = ps.player_id
+             WHERE ps.leaderboard_id = p_leaderboard_id AND p.is_active ORDER BY ps.rating DESC LIMIT 1)::TEXT::DOUBLE PRECISION,
+            (SELECT ps.rating FROM player_stats ps JOIN players p ON p.id = ps.player_id
+             WHERE ps.leaderboard_id = p_leaderboard_id AND p.is_active ORDER BY ps.rating LIMIT 1)::TEXT::DOUBLE PRECISION
+        INTO max_r, min_r;
+    ELSE
+        SELECT MAX(rating)::TEXT::DOUBLE PRECISION, MIN(rating)::TEXT::DOUBLE PRECISION
+        INTO max_r, min_r
+        FROM player_stats WHERE leaderboard_id = p_leaderboard_id;
+    END IF;
+    threshold := (COALESCE(max_r, 1000) - COALESCE(min_r, 1000)) * 0.5::DOUBLE PRECISION;
+
+    FOR i IN 1..4 LOOP
+        SELECT p.id, ps.rating::TEXT::DOUBLE PRECISION AS rating, ps.games, ps.wins, ps.losses,
+               ps.goal_diff, COALESCE(ps.trend, '') AS trend
+        INTO stats
+        FROM players p
+        JOIN player_stats ps ON ps.player_id = p.id
+        WHERE p.name = p_names[i] AND ps.leaderboard_id = p_leaderboard_id
+        FOR UPDATE OF ps;
+        v_ids := v_ids || stats.id;
+        v_ratings := v_ratings || stats.rating;
+        v_games := v_games || stats.games;
+        v_wins := v_wins || stats.wins;
+        v_losses := v_losses || stats.losses;
+        v_goal_diffs := v_goal_diffs || stats.goal_diff;
+        v_trends := v_trends || stats.trend;
+    END LOOP;
+
+    r_a := (v_ratings[1] + v_ratings[2]) / 2::DOUBLE PRECISION;
+    r_b := (v_ratings[3] + v_ratings[4]) / 2::DOUBLE PRECISION;
+    e_a := 1::DOUBLE PRECISION / (1::DOUBLE PRECISION + 10::DOUBLE PRECISION ^ ((r_b - r_a) / 400::DOUBLE PRECISION));
+    margin_mult := CASE
+        WHEN margin <= 2 THEN 1::DOUBLE PRECISION
+        WHEN margin <= 9 THEN 1::DOUBLE PRECISION + (margin - 2)::DOUBLE PRECISION * 0.1::DOUBLE PRECISION
+        ELSE 1.8::DOUBLE PRECISION
+    END;
+
+    team_diff := r_a - r_b;
+    IF abs(team_diff) > threshold THEN
+        IF (team_diff > 0) = (s_a = 1) THEN
+            multiplier := 0.5;
+        ELSE
+            multiplier := 1.5;
+        END IF;
+    END IF;
+
+    FOR i IN 1..4 LOOP
+        IF i <= 2 THEN
+            v_deltas := v_deltas || elo_round1(elo_k_factor(v_games[i]) * margin_mult * multiplier * (s_a - e_a));
+        ELSE
+            v_deltas := v_deltas || elo_round1(elo_k_factor(v_games[i]) * margin_mult * multiplier * ((1 - s_a) - (1 - e_a)));
+        END IF;
+    END LOOP;
+
+    UPDATE leaderboards SET version = version + 1 WHERE id = p_leaderboard_id;
+
+    -- Same teams and score (either side) in the same duplicate window, or in the previous one
+    -- for a resubmit that crossed the window boundary: let the caller reject it.
+    INSERT INTO matches
+    (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, delta_a1, delta_a2, delta_b1, delta_b2, leaderboard_id,
+     duplicate_bucket)
+    SELECT p_date, v_ids[1], v_ids[2], v_ids[3], v_ids[4], p_goals_a, p_goals_b,
+           v_deltas[1], v_deltas[2], v_deltas[3], v_deltas[4], p_leaderboard_id, v_bucket
+    WHERE NOT EXISTS (
+        SELECT 1 FROM matches m
+        WHERE m.leaderboard_id = p_leaderboard_id AND m.duplicate_bucket = v_bucket - 1
+          AND m.fingerprint = CASE
+              WHEN (LEAST(v_ids[1], v_ids[2]), GREATEST(v_ids[1], v_ids[2])) <= (LEAST(v_ids[3], v_ids[4]), GREATEST(v_ids[3], v_ids[4]))
+              THEN LEAST(v_ids[1], v_ids[2])::TEXT || '-' || GREATEST(v_ids[1], v_ids[2])::TEXT || ':'
+                   || LEAST(v_ids[3], v_ids[4])::TEXT || '-' || GREATEST(v_ids[3], v_ids[4])::TEXT || ':'
+                   || p_goals_a::TEXT || '-' || p_goals_b::TEXT
+              ELSE LEAST(v_ids[3], v_ids[4])::TEXT || '-' || GREATEST(v_ids[3], v_ids[4])::TEXT || ':'
+                   || LEAST(v_ids[1], v_ids[2])::TEXT || '-' || GREATEST(v_ids[1], v_ids[2])::TEXT || ':'
+                   || p_goals_b::TEXT || '-' || p_goals_a::TEXT
+          END
+    )
+    ON CONFLICT (leaderboard_id, fingerprint, duplicate_bucket) WHERE duplicate_bucket IS NOT NULL DO NOTHING
+    RETURNING id INTO new_match_id;
+    IF new_match_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    FOR i IN 1..4 LOOP
+        is_win := (i <= 2) = (s_a = 1);
+        gd := CASE WHEN i <= 2 THEN p_goals_a - p_goals_b ELSE p_goals_b - p_goals_a END;
+        UPDATE player_stats
+        SET rating = v_ratings[i] + v_deltas[i],
+            games = v_games[i] + 1,
+            wins = v_wins[i] + CASE WHEN is_win THEN 1 ELSE 0 END,
+            losses = v_losses[i] + CASE WHEN is_win THEN 0 ELSE 1 END,
+            goal_diff = v_goal_diffs[i] + gd,
+            trend = array_to_string(
+                (ARRAY[CASE WHEN is_win THEN 'W' ELSE 'L' END] || string_to_array(NULLIF(v_trends[i], ''), ' '))[1:5], ' '
+            )
+        WHERE player_id = v_ids[i] AND leaderboard_id = p_leaderboard_id;
+
+        INSERT INTO player_ratings_history
+        (player_id, match_id, rating, leaderboard_id, created_at,
+         pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff)
+        VALUES (v_ids[i], new_match_id, trunc(v_ratings[i] + v_deltas[i]), p_leaderboard_id, p_date,
+                v_ratings[i], v_games[i], v_wins[i], v_losses[i], v_goal_diffs[i]);
+
+        INSERT INTO match_participants (match_id, player_id, leaderboard_id, side, date, won)
+        VALUES (new_match_id, v_ids[i], p_leaderboard_id, CASE WHEN i <= 2 THEN 'A' ELSE 'B' END, p_date, is_win);
+    END LOOP;
+
+    PERFORM refresh_leaderboard_ranks(p_leaderboard_id, p_date);
+    RETURN new_match_id;
+END;
+$$;
+""" + f"""
+-- Same statements as DatabaseManager._refresh_leaderboard_ranks for a live match.
+CREATE OR REPLACE FUNCTION refresh_leaderboard_ranks(p_leaderboard_id INTEGER, p_now TIMESTAMP)
+RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_hour TIMESTAMP := date_trunc('hour', p_now);
+BEGIN
+    {rerank_leaderboards_sql("ps.leaderboard_id = p_leaderboard_id")};
+    DELETE FROM leaderboard_rating_snapshots
+    WHERE leaderboard_id = p_leaderboard_id
+    AND (taken_at < v_hour - INTERVAL '{RATING_SNAPSHOT_RETENTION.total_seconds():g} seconds' OR taken_at > p_now);
+    IF NOT EXISTS (
+        SELECT 1 FROM leaderboard_rating_snapshots WHERE leaderboard_id = p_leaderboard_id AND taken_at = v_hour
+    ) THEN
+        {rating_snapshot_sql("p_leaderboard_id", "v_hour")};
+    END IF;
+END;
+$$;
+"""
+
+def insert_match_participants_sql(source, where="", sqlite=False):
+    """INSERT ... SELECT that adds the four match_participants rows of each match in source.
+
+    source is the matches table or a CTE with the same columns. SQLite has no LATERAL,
+    so its variant picks the player of each of the four positions with CASE.
+    """
+    if sqlite:
+        return f"""
+        INSERT INTO match_participants (match_id, player_id, leaderboard_id, side, date, won)
+        SELECT m.id,
+               CASE v.position WHEN 1 THEN m.a1_id WHEN 2 THEN m.a2_id WHEN 3 THEN m.b1_id ELSE m.b2_id END,
+               m.leaderboard_id, CASE WHEN v.position <= 2 THEN 'A' ELSE 'B' END, m.date,
+               CASE WHEN v.position <= 2 THEN m.goals_a > m.goals_b ELSE m.goals_b > m.goals_a END
+        FROM {source} m
+        CROSS JOIN (SELECT 1 AS position UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4) AS v
+        {where}
+    """
+    return f"""
+        INSERT INTO match_participants (match_id, player_id, leaderboard_id, side, date, won)
+        SELECT m.id, v.player_id, m.leaderboard_id, v.side, m.date,
+               CASE WHEN v.side = 'A' THEN m.goals_a > m.goals_b ELSE m.goals_b > m.goals_a END
+        FROM {source} m
+        CROSS JOIN LATERAL (
+            VALUES (m.a1_id, 'A'), (m.a2_id, 'A'), (m.b1_id, 'B'), (m.b2_id, 'B')
+        ) AS v(player_id, side)
+        {where}
+    """
+
+def install_server_side_elo(conn):
+    """Creates (or replaces) the stored functions used by the server-side Elo mode."""
+    conn.execute(text(SERVER_SIDE_ELO_SQL))
+
+# --- Schema migrations ------------------------------------------------------
+# Each step runs once, in order, and is recorded in schema_version. The steps use
+# IF NOT EXISTS / ON CONFLICT so databases created before schema_version existed
+# upgrade cleanly from step 1. Schema changes go in a new step appended to
+# MIGRATIONS; so does any change to SERVER_SIDE_ELO_SQL, which is reinstalled
+# whenever steps are applied. SQLite databases are not migrated: they are created
+# at the current version from SQLITE_SCHEMA, which every new step must also update.
+
+def _migrate_base_schema(conn):
+    # 1. Base Tables
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS players (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        is_active BOOLEAN NOT NULL DEFAULT TRUE
+    );
+    """))
+    conn.execute(text("ALTER TABLE players ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;"))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS leaderboards (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        code TEXT UNIQUE NOT NULL
+    );
+    """))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS player_stats (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER REFERENCES players(id) ON DELETE CASCADE,
+        leaderboard_id INTEGER REFERENCES leaderboards(id) ON DELETE CASCADE,
+        rating REAL NOT NULL DEFAULT 1000,
+        games INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        goal_diff INTEGER NOT NULL DEFAULT 0,
+        trend TEXT DEFAULT '',
+        UNIQUE(player_id, leaderboard_id)
+    );
+    """))
+
+    # 2. Match Tables
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS matches (
+        id SERIAL PRIMARY KEY,
+        date TIMESTAMP NOT NULL,
+        a1_id INTEGER REFERENCES players(id),
+        a2_id INTEGER REFERENCES players(id),
+        b1_id INTEGER REFERENCES players(id),
+        b2_id INTEGER REFERENCES players(id),
+        goals_a INTEGER NOT NULL,
+        goals_b INTEGER NOT NULL,
+        delta_a1 REAL DEFAULT 0,
+        delta_a2 REAL DEFAULT 0,
+        delta_b1 REAL DEFAULT 0,
+        delta_b2 REAL DEFAULT 0,
+        delta_a REAL,
+        delta_b REAL,
+        leaderboard_id INTEGER REFERENCES leaderboards(id)
+    );
+    """))
+    conn.execute(text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS idx_matches_leaderboard_date
+    ON matches (leaderboard_id, date DESC);
+    """))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS future_matches (
+        id SERIAL PRIMARY KEY,
+        date TIMESTAMP NOT NULL,
+        a1_id INTEGER REFERENCES players(id),
+        a2_id INTEGER REFERENCES players(id),
+        b1_id INTEGER REFERENCES players(id),
+        b2_id INTEGER REFERENCES players(id),
+        leaderboard_id INTEGER REFERENCES leaderboards(id)
+    );
+    """))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS player_ratings_history (
+        id SERIAL PRIMARY KEY,
+        player_id INTEGER REFERENCES players(id),
+        match_id INTEGER REFERENCES matches(id),
+        rating REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        leaderboard_id INTEGER REFERENCES leaderboards(id)
+    );
+    """))
+    conn.execute(text("ALTER TABLE player_ratings_history ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
+
+    # 3. Roles & Users
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS roles (
+        id SERIAL PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        leaderboard_id INTEGER REFERENCES leaderboards(id)
+    );
+    """))
+    conn.execute(text("ALTER TABLE roles ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
+
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        role_id INTEGER REFERENCES roles(id)
+    );
+    """))
+
+    # 4. Default Seed Data (Idempotent)
+    # Default Leaderboards
+    res = conn.execute(text("SELECT count(*) FROM leaderboards")).fetchone()
+    if res[0] == 0:
+        conn.execute(text("INSERT INTO leaderboards (name, code) VALUES ('Leaderboard DG', 'dg'), ('Leaderboard UT', 'ut')"))
+
+    # Default Global Roles
+    conn.execute(text("""
+    INSERT INTO roles (name) VALUES ('guest'), ('user'), ('admin')
+    ON CONFLICT (name) DO NOTHING;
+    """))
+
+    # Leaderboard-specific Manager Roles
+    conn.execute(text("""
+    INSERT INTO roles (name, leaderboard_id)
+    SELECT 'Leader Manager ' || code, id FROM leaderboards
+    ON CONFLICT (name) DO NOTHING;
+    """))
+
+
+def _migrate_leaderboard_version(conn):
+    # Bumped by every write to a leaderboard; cached reads revalidate against it.
+    conn.execute(text("ALTER TABLE leaderboards ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;"))
+
+
+def _migrate_history_pre_match_stats(conn):
+    # Stats each player brought into the match; lets deletes and back-dated inserts replay only the suffix.
+    conn.execute(text("""
+    ALTER TABLE player_ratings_history
+        ADD COLUMN IF NOT EXISTS pre_rating REAL,
+        ADD COLUMN IF NOT EXISTS pre_games INTEGER,
+        ADD COLUMN IF NOT EXISTS pre_wins INTEGER,
+        ADD COLUMN IF NOT EXISTS pre_losses INTEGER,
+        ADD COLUMN IF NOT EXISTS pre_goal_diff INTEGER;
+    """))
+
+
+def _migrate_match_participants(conn):
+    # One row per player and match, so per-player queries are index range scans
+    # instead of four-way ORs over matches. Rows go away with their match.
+    participants_exist = conn.execute(text("SELECT to_regclass('match_participants') IS NOT NULL")).scalar()
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS match_participants (
+        match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+        player_id INTEGER NOT NULL REFERENCES players(id),
+        leaderboard_id INTEGER REFERENCES leaderboards(id),
+        side CHAR(1) NOT NULL,
+        date TIMESTAMP NOT NULL,
+        won BOOLEAN NOT NULL,
+        PRIMARY KEY (match_id, player_id)
+    );
+    """))
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS idx_match_participants_player
+    ON match_participants (player_id, leaderboard_id, date DESC);
+    """))
+    if not participants_exist:
+        conn.execute(text(insert_match_participants_sql("matches")))
+
+
+def _migrate_history_deletions(conn):
+    # Bumped whenever rating history rows are deleted; incremental history loaders then reload.
+    conn.execute(text("ALTER TABLE leaderboards ADD COLUMN IF NOT EXISTS history_deletions BIGINT NOT NULL DEFAULT 0;"))
+
+
+def _migrate_hot_query_indexes(conn):
+    # Deletes and suffix replays find history rows by match.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_player_ratings_history_match ON player_ratings_history (match_id);"))
+    # Incremental history loads read a leaderboard's rows above the last seen id.
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS idx_player_ratings_history_leaderboard
+    ON player_ratings_history (leaderboard_id, id);
+    """))
+    # Leaderboard ranking order and the MAX/MIN(rating) of record_match.
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS idx_player_stats_leaderboard_rating
+    ON player_stats (leaderboard_id, rating DESC);
+    """))
+    conn.execute(text("""
+    CREATE INDEX IF NOT EXISTS idx_future_matches_leaderboard_date
+    ON future_matches (leaderboard_id, date);
+    """))
+
+
+def _migrate_match_fingerprints(conn):
+    # Order-independent identity of a match: sorted team pairs, lower pair first, score oriented to match.
+    conn.execute(text("""
+    ALTER TABLE matches ADD COLUMN IF NOT EXISTS fingerprint TEXT GENERATED ALWAYS AS (
+        CASE WHEN (LEAST(a1_id, a2_id), GREATEST(a1_id, a2_id)) <= (LEAST(b1_id, b2_id), GREATEST(b1_id, b2_id))
+        THEN LEAST(a1_id, a2_id)::TEXT || '-' || GREATEST(a1_id, a2_id)::TEXT || ':'
+             || LEAST(b1_id, b2_id)::TEXT || '-' || GREATEST(b1_id, b2_id)::TEXT || ':'
+             || goals_a::TEXT || '-' || goals_b::TEXT
+        ELSE LEAST(b1_id, b2_id)::TEXT || '-' || GREATEST(b1_id, b2_id)::TEXT || ':'
+             || LEAST(a1_id, a2_id)::TEXT || '-' || GREATEST(a1_id, a2_id)::TEXT || ':'
+             || goals_b::TEXT || '-' || goals_a::TEXT
+        END
+    ) STORED;
+    """))
+    # Set only by live submits (imports and back-dated matches leave it NULL), so only
+    # they are rejected when the same match lands twice in one duplicate window.
+    conn.execute(text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS duplicate_bucket BIGINT;"))
+    conn.execute(text("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_fingerprint_bucket
+    ON matches (leaderboard_id, fingerprint, duplicate_bucket)
+    WHERE duplicate_bucket IS NOT NULL;
+    """))
+
+
+def _migrate_record_match_elo_active_only(conn):
+    # record_match_elo() gained p_active_only; drop the old overload before the new one is installed.
+    conn.execute(text("DROP FUNCTION IF EXISTS record_match_elo(INTEGER, TEXT[], INTEGER, INTEGER, TIMESTAMP, INTERVAL);"))
+
+
+def _migrate_record_match_elo_lock_mode(conn):
+    # record_match_elo() gained p_lock_mode; drop the old overload before the new one is installed.
+    conn.execute(text(
+        "DROP FUNCTION IF EXISTS record_match_elo(INTEGER, TEXT[], INTEGER, INTEGER, TIMESTAMP, INTERVAL, BOOLEAN);"
+    ))
+
+
+def _migrate_leaderboard_ranks(conn):
+    # Materialized ranking of each leaderboard's active players, rewritten by every write that
+    # moves ratings or changes who is active; reads and a player's rank are indexed fetches.
+    ranks_exist = conn.execute(text("SELECT to_regclass('leaderboard_ranks') IS NOT NULL")).scalar()
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS leaderboard_ranks (
+        leaderboard_id INTEGER NOT NULL REFERENCES leaderboards(id) ON DELETE CASCADE,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        rank INTEGER NOT NULL,
+        rank_change_24h INTEGER,
+        rank_change_7d INTEGER,
+        PRIMARY KEY (leaderboard_id, player_id)
+    );
+    """))
+    # Not unique: a re-rank moves players past each other one row at a time.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_leaderboard_ranks_rank ON leaderboard_ranks (leaderboard_id, rank);"))
+    # When the past ranks of the leaderboard were last recomputed from the rating history.
+    conn.execute(text("ALTER TABLE leaderboards ADD COLUMN IF NOT EXISTS ranks_refreshed_at TIMESTAMP;"))
+    if not ranks_exist:
+        conn.execute(text(leaderboard_ranks_sql("ps.leaderboard_id IS NOT NULL")))
+
+
+def _migrate_record_match_elo_previous_bucket(conn):
+    # record_match_elo() also rejects a resubmit found in the previous duplicate window;
+    # nothing to change in the schema, applying the step reinstalls the function.
+    pass
+
+
+def _migrate_rating_snapshots(conn):
+    # Rank changes are computed on read from exact hourly rating snapshots, which writes keep
+    # in line with the history, instead of past ranks stored per player and carried forward.
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS leaderboard_rating_snapshots (
+        leaderboard_id INTEGER NOT NULL REFERENCES leaderboards(id) ON DELETE CASCADE,
+        taken_at TIMESTAMP NOT NULL,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        rating DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (leaderboard_id, taken_at, player_id)
+    );
+    """))
+    conn.execute(text("ALTER TABLE leaderboard_ranks DROP COLUMN IF EXISTS rank_change_24h, DROP COLUMN IF EXISTS rank_change_7d;"))
+    conn.execute(text("ALTER TABLE leaderboards DROP COLUMN IF EXISTS ranks_refreshed_at;"))
+    taken = conn.execute(text("SELECT DISTINCT leaderboard_id, taken_at FROM leaderboard_rating_snapshots")).fetchall()
+    since = datetime.now().replace(minute=0, second=0, microsecond=0) - RATING_SNAPSHOT_RETENTION
+    hours = conn.execute(text("""
+        SELECT DISTINCT leaderboard_id, date_trunc('hour', date) FROM matches WHERE date >= :since
+    """), {"since": since}).fetchall()
+    missing = sorted(set(map(tuple, hours)) - set(map(tuple, taken)))
+    if missing:
+        conn.execute(
+            text(rating_snapshot_sql(":l_id", ":taken_at")),
+            [{"l_id": l_id, "taken_at": taken_at} for l_id, taken_at in missing],
+        )
+
+
+MIGRATIONS = [
+    (1, "base schema", _migrate_base_schema),
+    (2, "leaderboard cache version", _migrate_leaderboard_version),
+    (3, "pre-match stats in rating history", _migrate_history_pre_match_stats),
+    (4, "match participants", _migrate_match_participants),
+    (5, "rating history deletion counter", _migrate_history_deletions),
+    (6, "hot query indexes", _migrate_hot_query_indexes),
+    (7, "match fingerprints", _migrate_match_fingerprints),
+    (8, "active-only rating bounds in record_match_elo", _migrate_record_match_elo_active_only),
+    (9, "lock mode in record_match_elo", _migrate_record_match_elo_lock_mode),
+    (10, "materialized leaderboard ranks", _migrate_leaderboard_ranks),
+    (11, "previous duplicate window in record_match_elo", _migrate_record_match_elo_previous_bucket),
+    (12, "hourly rating snapshots for rank changes", _migrate_rating_snapshots),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# The schema of SCHEMA_VERSION for SQLite, for local runs, tests and benchmarks without a
+# server: AUTOINCREMENT keeps ids increasing after deletes like SERIAL, and the fingerprint
+# is computed with min()/max() in place of LEAST/GREATEST.
+SQLITE_SCHEMA = """
+CREATE TABLE players (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE
+);
+CREATE TABLE leaderboards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    code TEXT UNIQUE NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    history_deletions BIGINT NOT NULL DEFAULT 0
+);
+CREATE TABLE player_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    player_id INTEGER REFERENCES players(id) ON DELETE CASCADE,
+    leaderboard_id INTEGER REFERENCES leaderboards(id) ON DELETE CASCADE,
+    rating REAL NOT NULL DEFAULT 1000,
+    games INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    goal_diff INTEGER NOT NULL DEFAULT 0,
+    trend TEXT DEFAULT '',
+    UNIQUE(player_id, leaderboard_id)
+);
+CREATE INDEX idx_player_stats_leaderboard_rating ON player_stats (leaderboard_id, rating DESC);
+CREATE TABLE matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TIMESTAMP NOT NULL,
+    a1_id INTEGER REFERENCES players(id),
+    a2_id INTEGER REFERENCES players(id),
+    b1_id INTEGER REFERENCES players(id),
+    b2_id INTEGER REFERENCES players(id),
+    goals_a INTEGER NOT NULL,
+    goals_b INTEGER NOT NULL,
+    delta_a1 REAL DEFAULT 0,
+    delta_a2 REAL DEFAULT 0,
+    delta_b1 REAL DEFAULT 0,
+    delta_b2 REAL DEFAULT 0,
+    delta_a REAL,
+    delta_b REAL,
+    leaderboard_id INTEGER REFERENCES leaderboards(id),
+    fingerprint TEXT GENERATED ALWAYS AS (
+        CASE WHEN (min(a1_id, a2_id), max(a1_id, a2_id)) <= (min(b1_id, b2_id), max(b1_id, b2_id))
+        THEN min(a1_id, a2_id) || '-' || max(a1_id, a2_id) || ':'
+             || min(b1_id, b2_id) || '-' || max(b1_id, b2_id) || ':' || goals_a || '-' || goals_b
+        ELSE min(b1_id, b2_id) || '-' || max(b1_id, b2_id) || ':'
+             || min(a1_id, a2_id) || '-' || max(a1_id, a2_id) || ':' || goals_b || '-' || goals_a
+        END
+    ) STORED,
+    duplicate_bucket BIGINT
+);
+CREATE INDEX idx_matches_leaderboard_date ON matches (leaderboard_id, date DESC);
+CREATE UNIQUE INDEX idx_matches_fingerprint_bucket
+ON matches (leaderboard_id, fingerprint, duplicate_bucket)
+WHERE duplicate_bucket IS NOT NULL;
+CREATE TABLE match_participants (
+    match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+    player_id INTEGER NOT NULL REFERENCES players(id),
+    leaderboard_id INTEGER REFERENCES leaderboards(id),
+    side CHAR(1) NOT NULL,
+    date TIMESTAMP NOT NULL,
+    won BOOLEAN NOT NULL,
+    PRIMARY KEY (match_id, player_id)
+);
+CREATE INDEX idx_match_participants_player ON match_participants (player_id, leaderboard_id, date DESC);
+CREATE TABLE future_matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TIMESTAMP NOT NULL,
+    a1_id INTEGER REFERENCES players(id),
+    a2_id INTEGER REFERENCES players(id),
+    b1_id INTEGER REFERENCES players(id),
+    b2_id INTEGER REFERENCES players(id),
+    leaderboard_id INTEGER REFERENCES leaderboards(id)
+);
+CREATE INDEX idx_future_matches_leaderboard_date ON future_matches (leaderboard_id, date);
+CREATE TABLE player_ratings_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    player_id INTEGER REFERENCES players(id),
+    match_id INTEGER REFERENCES matches(id),
+    rating REAL NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    leaderboard_id INTEGER REFERENCES leaderboards(id),
+    pre_rating REAL,
+    pre_games INTEGER,
+    pre_wins INTEGER,
+    pre_losses INTEGER,
+    pre_goal_diff INTEGER
+);
+CREATE INDEX idx_player_ratings_history_match ON player_ratings_history (match_id);
+CREATE INDEX idx_player_ratings_history_leaderboard ON player_ratings_history (leaderboard_id, id);
+CREATE TABLE leaderboard_ranks (
+    leaderboard_id INTEGER NOT NULL REFERENCES leaderboards(id) ON DELETE CASCADE,
+    player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    PRIMARY KEY (leaderboard_id, player_id)
+);
+CREATE INDEX idx_leaderboard_ranks_rank ON leaderboard_ranks (leaderboard_id, rank);
+CREATE TABLE leaderboard_rating_snapshots (
+    leaderboard_id INTEGER NOT NULL REFERENCES leaderboards(id) ON DELETE CASCADE,
+    taken_at TIMESTAMP NOT NULL,
+    player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+    rating DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (leaderboard_id, taken_at, player_id)
+);
+CREATE TABLE roles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL,
+    leaderboard_id INTEGER REFERENCES leaderboards(id)
+);
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    role_id INTEGER REFERENCES roles(id)
+);
+CREATE TABLE schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO leaderboards (name, code) VALUES ('Leaderboard DG', 'dg'), ('Leaderboard UT', 'ut');
+INSERT INTO roles (name) VALUES ('guest'), ('user'), ('admin');
+INSERT INTO roles (name, leaderboard_id) SELECT 'Leader Manager ' || code, id FROM leaderboards ORDER BY id
+"""
+
+
+def create_sqlite_schema(conn):
+    """Creates the current schema in an empty SQLite database and returns the versions it stands for."""
+    for statement in SQLITE_SCHEMA.split(";"):
+        conn.execute(text(statement))
+    conn.execute(
+        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+        [{"version": version, "name": name} for version, name, _ in MIGRATIONS],
+    )
+    return [version for version, _, _ in MIGRATIONS]
+
+
+def migrate(conn):
+    """Applies the missing migration steps and returns the versions applied."""
+    # Serializes concurrent cold starts; the lock is released with the transaction.
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_version'))"))
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+    );
+    """))
+    current = conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step(conn)
+        conn.execute(
+            text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+            {"version": version, "name": name},
+        )
+        applied.append(version)
+    return applied
+
+
 @st.cache_resource
 def init_db():
-    """Initializes the database schema if it doesn't exist."""
+    """Brings the database schema up to date; a current schema costs a single SELECT."""
+    with engine.connect() as conn:
+        sqlite = is_sqlite(conn)
+        try:
+            current, has_elo_function = conn.execute(text(
+                "SELECT MAX(version), 0 FROM schema_version" if sqlite else
+                "SELECT MAX(version), to_regproc('record_match_elo') IS NOT NULL FROM schema_version"
+            )).fetchone()
+        except (ProgrammingError, OperationalError):
+            # No schema_version table yet: a new database or one created before migrations.
+            current, has_elo_function = 0, False
+
+    if sqlite:
+        if SERVER_SIDE_ELO:
+            raise RuntimeError("SERVER_SIDE_ELO needs PostgreSQL; the stored functions do not exist in SQLite.")
+        if current and current != SCHEMA_VERSION:
+            raise RuntimeError(
+                f"This SQLite database is at schema version {current}, not {SCHEMA_VERSION}; "
+                "SQLite databases are not migrated, so delete it to recreate it."
+            )
+        if not current:
+            with engine.begin() as conn:
+                create_sqlite_schema(conn)
+        return
+
+    if current == SCHEMA_VERSION and (has_elo_function or not SERVER_SIDE_ELO):
+        return
     with engine.begin() as conn:
-        # 1. Base Tables
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS players (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            is_active BOOLEAN NOT NULL DEFAULT TRUE
-        );
-        """))
-        conn.execute(text("ALTER TABLE players ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;"))
-
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS leaderboards (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            code TEXT UNIQUE NOT NULL
-        );
-        """))
-
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS player_stats (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER REFERENCES players(id) ON DELETE CASCADE,
-            leaderboard_id INTEGER REFERENCES leaderboards(id) ON DELETE CASCADE,
-            rating REAL NOT NULL DEFAULT 1000,
-            games INTEGER NOT NULL DEFAULT 0,
-            wins INTEGER NOT NULL DEFAULT 0,
-            losses INTEGER NOT NULL DEFAULT 0,
-            goal_diff INTEGER NOT NULL DEFAULT 0,
-            trend TEXT DEFAULT '',
-            UNIQUE(player_id, leaderboard_id)
-        );
-        """))
-
-        # 2. Match Tables
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS matches (
-            id SERIAL PRIMARY KEY,
-            date TIMESTAMP NOT NULL,
-            a1_id INTEGER REFERENCES players(id),
-            a2_id INTEGER REFERENCES players(id),
-            b1_id INTEGER REFERENCES players(id),
-            b2_id INTEGER REFERENCES players(id),
-            goals_a INTEGER NOT NULL,
-            goals_b INTEGER NOT NULL,
-            delta_a1 REAL DEFAULT 0,
-            delta_a2 REAL DEFAULT 0,
-            delta_b1 REAL DEFAULT 0,
-            delta_b2 REAL DEFAULT 0,
-            delta_a REAL,
-            delta_b REAL,
-            leaderboard_id INTEGER REFERENCES leaderboards(id)
-        );
-        """))
-        conn.execute(text("ALTER TABLE matches ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
-        conn.execute(text("""
-        CREATE INDEX IF NOT EXISTS idx_matches_leaderboard_date
-        ON matches (leaderboard_id, date DESC);
-        """))
-
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS future_matches (
-            id SERIAL PRIMARY KEY,
-            date TIMESTAMP NOT NULL,
-            a1_id INTEGER REFERENCES players(id),
-            a2_id INTEGER REFERENCES players(id),
-            b1_id INTEGER REFERENCES players(id),
-            b2_id INTEGER REFERENCES players(id),
-            leaderboard_id INTEGER REFERENCES leaderboards(id)
-        );
-        """))
-
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS player_ratings_history (
-            id SERIAL PRIMARY KEY,
-            player_id INTEGER REFERENCES players(id),
-            match_id INTEGER REFERENCES matches(id),
-            rating REAL NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW(),
-            leaderboard_id INTEGER REFERENCES leaderboards(id)
-        );
-        """))
-        conn.execute(text("ALTER TABLE player_ratings_history ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
-
-        # 3. Roles & Users
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS roles (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE NOT NULL,
-            leaderboard_id INTEGER REFERENCES leaderboards(id)
-        );
-        """))
-        conn.execute(text("ALTER TABLE roles ADD COLUMN IF NOT EXISTS leaderboard_id INTEGER REFERENCES leaderboards(id);"))
-
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role_id INTEGER REFERENCES roles(id)
-        );
-        """))
-
-        # 4. Default Seed Data (Idempotent)
-        # Default Leaderboards
-        res = conn.execute(text("SELECT count(*) FROM leaderboards")).fetchone()
-        if res[0] == 0:
-            conn.execute(text("INSERT INTO leaderboards (name, code) VALUES ('Leaderboard DG', 'dg'), ('Leaderboard UT', 'ut')"))
-
-        # Default Global Roles
-        conn.execute(text("""
-        INSERT INTO roles (name) VALUES ('guest'), ('user'), ('admin')
-        ON CONFLICT (name) DO NOTHING;
-        """))
-
-        # Leaderboard-specific Manager Roles
-        conn.execute(text("""
-        INSERT INTO roles (name, leaderboard_id)
-        SELECT 'Leader Manager ' || code, id FROM leaderboards
-        ON CONFLICT (name) DO NOTHING;
-        """))
+        applied = migrate(conn)
+        if SERVER_SIDE_ELO and (applied or not has_elo_function):
+            install_server_side_elo(conn)
@@ -0,0 +1,128 @@
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+import streamlit as st
+
+from models import DatabaseManager
+
+# Most submissions one leaderboard worker applies in a single transaction.
+QUEUE_MAX_BATCH = 50
+# Finished tickets kept for status lookups before the oldest are forgotten.
+QUEUE_STATUS_RETENTION = 10_000
+
+QUEUED, APPLIED, REJECTED, FAILED = "queued", "applied", "rejected", "failed"
+
+
+class MatchQueue:
+    """Single-writer ingestion of live match submissions, one worker thread per leaderboard.
+
+    Submissions are validated up front, then applied in arrival order: each worker
+    drains whatever queued up while the previous batch was being written and
+    records it with DatabaseManager.record_matches, so a burst of submits costs
+    one transaction instead of one per match. Workers of different processes
+    still serialize on the leaderboard lock taken by record_matches.
+    """
+
+    def __init__(self, max_batch=QUEUE_MAX_BATCH):
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._workers = {}
+        self._statuses = OrderedDict()
+        self._closed = False
+
+    def submit(self, a1_name, a2_name, b1_name, b2_name, goals_a, goals_b, leaderboard_id):
+        """Queues a live match and returns its ticket; raises ValueError for an invalid one."""
+        if len({a1_name, a2_name, b1_name, b2_name}) < 4:
+            raise ValueError("Duplicate players!")
+        DatabaseManager._validate_score(goals_a, goals_b)
+
+        ticket = uuid.uuid4().hex
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The match queue is closed.")
+            self._statuses[ticket] = {"state": QUEUED, "match_id": None, "error": None}
+            self._trim_statuses()
+            self._pending.setdefault(leaderboard_id, deque()).append(
+                (ticket, (a1_name, a2_name, b1_name, b2_name, goals_a, goals_b))
+            )
+            if leaderboard_id not in self._workers:
+                worker = threading.Thread(
+                    target=self._run, args=(leaderboard_id,), name=f"match-queue-{leaderboard_id}", daemon=True
+                )
+                self._workers[leaderboard_id] = worker
+                worker.start()
+            self._cond.notify_all()
+        return ticket
+
+    def status(self, ticket):
+        """Returns {"state", "match_id", "error"} for a ticket, or None once it is forgotten."""
+        with self._cond:
+            status = self._statuses.get(ticket)
+            return dict(status) if status else None
+
+    def wait(self, ticket, timeout=None):
+        """Blocks until the ticket leaves the queue or timeout seconds pass; returns its status."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._statuses.get(ticket, {}).get("state") != QUEUED, timeout)
+            status = self._statuses.get(ticket)
+            return dict(status) if status else None
+
+    def close(self, timeout=None):
+        """Applies what is already queued, then stops the workers."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            workers = list(self._workers.values())
+        for worker in workers:
+            worker.join(timeout)
+
+    def _trim_statuses(self):
+        excess = len(self._statuses) - QUEUE_STATUS_RETENTION
+        if excess > 0:
+            for ticket in [t for t, s in self._statuses.items() if s["state"] != QUEUED][:excess]:
+                del self._statuses[ticket]
+
+    def _run(self, leaderboard_id):
+        pending = self._pending[leaderboard_id]
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: pending or self._closed)
+                if not pending:
+                    del self._workers[leaderboard_id]
+                    return
+                batch = [pending.popleft() for _ in range(min(len(pending), self.max_batch))]
+            self._apply(leaderboard_id, batch)
+
+    def _apply(self, leaderboard_id, batch):
+        try:
+            results = [(match_id, None) for match_id in DatabaseManager.record_matches(
+                leaderboard_id, [submission for _, submission in batch]
+            )]
+        except Exception as e:
+            if len(batch) == 1:
+                results = [(None, f"The match could not be saved: {e}")]
+            else:
+                # Apply one by one so a single bad submission does not fail the rest.
+                for item in batch:
+                    self._apply(leaderboard_id, [item])
+                return
+
+        with self._cond:
+            for (ticket, _), (match_id, error) in zip(batch, results):
+                if error:
+                    update = {"state": FAILED, "error": error}
+                elif match_id is None:
+                    update = {"state": REJECTED, "error": DatabaseManager.DUPLICATE_MATCH_MESSAGE}
+                else:
+                    update = {"state": APPLIED, "match_id": match_id}
+                if ticket in self._statuses:
+                    self._statuses[ticket].update(update)
+            self._trim_statuses()
+            self._cond.notify_all()
+
+
+@st.cache_resource
+def get_match_queue():
+    return MatchQueue()
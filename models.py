@@ -1,16 +1,115 @@
+import csv
+import functools
 import hashlib
+import inspect
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-import random
 import itertools
+import os
+import random
+import threading
+import time
+import numpy as np
 import pandas as pd
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import DBAPIError
 import streamlit as st
+import db
 from db import get_connection, engine
 import scoring
 
+# Cached reads that depend on a leaderboard also take its leaderboards.version as an
+# argument. Writes bump the version in their own transaction, so after one primary-key
+# lookup every app process treats the old entries as misses while other leaderboards
+# stay cached. Stale entries age out through max_entries.
+LEADERBOARD_CACHE_MAX_ENTRIES = 512
+# Matches from this far back count as repeats when generating a calendar.
+CALENDAR_HISTORY_DAYS = 28
+# serialization_failure and deadlock_detected: the transaction can simply run again.
+RETRYABLE_SQLSTATES = ("40001", "40P01")
+WRITE_RETRY_ATTEMPTS = 5
+
+
+def _leaderboard_version(leaderboard_id):
+    """Returns the cache version of a leaderboard; cross-leaderboard reads (None) use the sum."""
+    with get_connection() as conn:
+        if leaderboard_id is None:
+            return conn.execute(text("SELECT CAST(COALESCE(SUM(version), 0) AS BIGINT) FROM leaderboards")).scalar()
+        return conn.execute(
+            text("SELECT version FROM leaderboards WHERE id = :l_id"), {"l_id": leaderboard_id}
+        ).scalar()
+
+
+def leaderboard_cache(func):
+    """st.cache_data for reads scoped by the function's leaderboard_id argument."""
+    signature = inspect.signature(func)
+
+    def cached(version, *args):
+        return func(*args)
+    # Streamlit keys each cache on module and qualname, so every read keeps its own cache.
+    cached.__module__, cached.__qualname__ = func.__module__, func.__qualname__
+    cached = st.cache_data(cached, max_entries=LEADERBOARD_CACHE_MAX_ENTRIES)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return cached(_leaderboard_version(bound.arguments.get("leaderboard_id")), *bound.args)
+    return wrapper
+
+
+def _text_in(conn, sql, *names):
+    """text(sql) whose named parameters, bound to tuples, fill IN lists.
+
+    psycopg2 adapts a tuple to a parenthesized list by itself; SQLite only binds
+    scalars, so there the parameters are expanded into one placeholder per item.
+    """
+    query = text(sql)
+    if db.is_sqlite(conn):
+        query = query.bindparams(*(bindparam(name, expanding=True) for name in names))
+    return query
+
+
+# In-process copies of each leaderboard's rating history: {leaderboard_id: (history_deletions, last_id, frame)}.
+_elo_history_frames = {}
+_elo_history_lock = threading.Lock()
+
+
+def _hour(moment):
+    """The start of the hour of a datetime, when rating snapshots are taken."""
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def retry_on_conflict(func):
+    """Re-runs a write transaction that Postgres aborted as a serialization failure or deadlock."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except DBAPIError as e:
+                if getattr(e.orig, "pgcode", None) not in RETRYABLE_SQLSTATES or attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    raise
+                # Jittered backoff so the colliding writers do not collide again.
+                time.sleep(random.uniform(0, 0.02 * 2 ** attempt))
+    return wrapper
+
+
 class DatabaseManager:
     """Manages all database interactions and business logic for the application."""
     RECENT_DUPLICATE_MATCH_WINDOW_SECONDS = scoring.RECENT_DUPLICATE_MATCH_WINDOW_SECONDS
+    DUPLICATE_MATCH_MESSAGE = "This match was saved a few seconds ago. Wait before saving the same match again."
+    # Matches fetched per round trip when replaying a leaderboard; bounds rebuild memory.
+    REPLAY_CHUNK_SIZE = 50_000
+    # Stored ratings are REAL, so anything below float32 noise is not reported as drift.
+    AUDIT_RATING_TOLERANCE = 0.01
+    # Match history is read in fixed-size keyset pages so cached pages serve any number of "load more" clicks.
+    MATCH_HISTORY_PAGE_SIZE = 25
+    # Points sent to the Elo trends chart, shared among players in proportion to their history.
+    ELO_CHART_MAX_POINTS = 2000
+    ELO_CHART_RESOLUTIONS = ("auto", "daily", "full")
 
     @staticmethod
     def hash_password(password: str) -> str:
@@ -26,23 +125,70 @@ class DatabaseManager:
             return conn.execute(query).fetchall()
 
     @staticmethod
-    @st.cache_data
     def get_leaderboard(leaderboard_id: int):
-        """Fetches active player statistics for a specific leaderboard."""
+        """Fetches active player statistics for a specific leaderboard, in rank order.
+
+        Rows end with the rank and its change since the top of the hour 24 hours and
+        7 days ago (None for players who had not played yet). The ranks are read from
+        the materialized leaderboard_ranks, the changes from the rating snapshots.
+        """
+        return DatabaseManager._read_leaderboard(leaderboard_id, _hour(datetime.now()))
+
+    @staticmethod
+    @leaderboard_cache
+    def _read_leaderboard(leaderboard_id: int, hour: datetime):
+        # The hour is part of the cache key, so cached changes move on with the cutoffs.
         with get_connection() as conn:
-            query = text("""
-                SELECT p.name, ps.rating, ps.games, ps.wins, ps.losses, ps.goal_diff, ps.trend
-                FROM players p
-                JOIN player_stats ps ON p.id = ps.player_id
-                WHERE p.is_active = TRUE AND ps.leaderboard_id = :l_id
-                ORDER BY ps.rating DESC
+            query = text(f"""
+                WITH {db.past_ranks_sql("ranks_24h", ":day_ago")}, {db.past_ranks_sql("ranks_7d", ":week_ago")}
+                SELECT p.name, ps.rating, ps.games, ps.wins, ps.losses, ps.goal_diff, ps.trend,
+                       r.rank, d.rank - r.rank, w.rank - r.rank
+                FROM leaderboard_ranks r
+                JOIN players p ON p.id = r.player_id
+                JOIN player_stats ps ON ps.player_id = r.player_id AND ps.leaderboard_id = r.leaderboard_id
+                LEFT JOIN ranks_24h d ON d.player_id = r.player_id
+                LEFT JOIN ranks_7d w ON w.player_id = r.player_id
+                WHERE p.is_active = TRUE AND r.leaderboard_id = :l_id
+                ORDER BY r.rank
             """)
-            return conn.execute(query, {"l_id": leaderboard_id}).fetchall()
+            return conn.execute(query, DatabaseManager._rank_change_params(leaderboard_id, hour)).fetchall()
 
     @staticmethod
+    def get_player_rank(player_id: int, leaderboard_id: int):
+        """Returns (rank, rank_change_24h, rank_change_7d) of an active player, or None."""
+        return DatabaseManager._read_player_rank(player_id, leaderboard_id, _hour(datetime.now()))
+
+    @staticmethod
+    @leaderboard_cache
+    def _read_player_rank(player_id: int, leaderboard_id: int, hour: datetime):
+        with get_connection() as conn:
+            row = conn.execute(text(f"""
+                WITH {db.past_ranks_sql("ranks_24h", ":day_ago")}, {db.past_ranks_sql("ranks_7d", ":week_ago")}
+                SELECT r.rank, d.rank - r.rank, w.rank - r.rank
+                FROM leaderboard_ranks r
+                LEFT JOIN ranks_24h d ON d.player_id = r.player_id
+                LEFT JOIN ranks_7d w ON w.player_id = r.player_id
+                WHERE r.leaderboard_id = :l_id AND r.player_id = :pid
+            """), {**DatabaseManager._rank_change_params(leaderboard_id, hour), "pid": player_id}).fetchone()
+            return tuple(row) if row else None
+
+    @staticmethod
+    def _rank_change_params(leaderboard_id, hour):
+        return {"l_id": leaderboard_id, "day_ago": hour - timedelta(days=1), "week_ago": hour - timedelta(days=7)}
+
+    @staticmethod
+    @retry_on_conflict
     def add_player(name: str, leaderboard_id: int):
         """Adds a new player and initializes stats for the selected leaderboard."""
         with engine.begin() as conn:
+            # Reactivation shows the player again on every leaderboard they belong to,
+            # so all of them are locked like any other write to their stats.
+            leaderboard_ids = sorted({leaderboard_id, *conn.execute(text("""
+                SELECT ps.leaderboard_id FROM player_stats ps JOIN players p ON p.id = ps.player_id
+                WHERE p.name = :name
+            """), {"name": name}).scalars()})
+            DatabaseManager._lock_leaderboards(conn, leaderboard_ids)
+
             # 1. Ensure player exists globally
             player_id_res = conn.execute(text("""
                 INSERT INTO players (name, is_active)
@@ -58,19 +204,28 @@ class DatabaseManager:
                 VALUES (:pid, :l_id, 1000, 0, 0, 0, 0, '')
                 ON CONFLICT (player_id, leaderboard_id) DO NOTHING
             """), {"pid": player_id, "l_id": leaderboard_id})
-            
-        st.cache_data.clear()
+
+            DatabaseManager._bump_leaderboard_versions(conn, leaderboard_ids)
+            DatabaseManager._refresh_leaderboard_ranks(conn, leaderboard_ids)
 
     @staticmethod
+    @retry_on_conflict
     def toggle_player_status(player_id: int, is_active: bool):
         """Toggles a player's active status."""
         with engine.begin() as conn:
-            query = text("UPDATE players SET is_active = :status WHERE id = :pid")
-            conn.execute(query, {"status": is_active, "pid": player_id})
-        st.cache_data.clear()
+            # The status changes the ranking and rating bounds of every leaderboard of the player.
+            leaderboard_ids = conn.execute(text("""
+                SELECT leaderboard_id FROM player_stats WHERE player_id = :pid ORDER BY leaderboard_id
+            """), {"pid": player_id}).scalars().all()
+            if leaderboard_ids:
+                DatabaseManager._lock_leaderboards(conn, leaderboard_ids)
+            conn.execute(text("UPDATE players SET is_active = :status WHERE id = :pid"), {"status": is_active, "pid": player_id})
+            if leaderboard_ids:
+                DatabaseManager._bump_leaderboard_versions(conn, leaderboard_ids)
+                DatabaseManager._refresh_leaderboard_ranks(conn, leaderboard_ids)
 
     @staticmethod
-    @st.cache_data
+    @leaderboard_cache
     def get_match_history(limit=50, player_id=None, leaderboard_id=None):
         """Fetches the history of played matches, optionally filtered by player_id and leaderboard_id."""
         with get_connection() as conn:
@@ -98,26 +253,87 @@ class DatabaseManager:
             """
             where_clauses = []
             params = {"limit": limit}
+            order_by = "m.date DESC"
             
             if player_id:
-                where_clauses.append("(m.a1_id = :pid OR m.a2_id = :pid OR m.b1_id = :pid OR m.b2_id = :pid)")
+                # Walks the player's match_participants index instead of OR-ing four columns.
+                query_str += " JOIN match_participants mp ON mp.match_id = m.id AND mp.player_id = :pid"
                 params["pid"] = player_id
+                order_by = "mp.date DESC"
             
             if leaderboard_id:
-                where_clauses.append("m.leaderboard_id = :l_id")
+                where_clauses.append("mp.leaderboard_id = :l_id" if player_id else "m.leaderboard_id = :l_id")
                 params["l_id"] = leaderboard_id
                 
             if where_clauses:
                 query_str += " WHERE " + " AND ".join(where_clauses)
                 
-            query_str += " ORDER BY m.date DESC LIMIT :limit"
+            query_str += f" ORDER BY {order_by} LIMIT :limit"
             
             return conn.execute(text(query_str), params).fetchall()
 
     @staticmethod
-    @st.cache_data
+    @leaderboard_cache
+    def get_match_history_page(leaderboard_id: int, player_id=None, before=None):
+        """Fetches one page of match history, newest first, and the cursor of the next page.
+
+        Rows have the same shape as get_match_history. before is the (date, id) cursor
+        returned by the previous page; the next cursor is None on the last page.
+        """
+        page_size = DatabaseManager.MATCH_HISTORY_PAGE_SIZE
+        params = {"l_id": leaderboard_id, "page_size": page_size}
+        if player_id:
+            source = "match_participants mp JOIN matches m ON m.id = mp.match_id"
+            where = "mp.player_id = :pid AND mp.leaderboard_id = :l_id"
+            key = ("mp.date", "mp.match_id")
+            params["pid"] = player_id
+        else:
+            source = "matches m"
+            where = "m.leaderboard_id = :l_id"
+            key = ("m.date", "m.id")
+        if before is not None:
+            # The plain date bound is what the index range scan uses; the row comparison breaks ties.
+            where += f" AND {key[0]} <= :before_date AND ({key[0]}, {key[1]}) < (:before_date, :before_id)"
+            params["before_date"], params["before_id"] = before
+
+        with get_connection() as conn:
+            rows = conn.execute(text(f"""
+                SELECT m.date, m.a1_id, m.a2_id, m.b1_id, m.b2_id, m.goals_a, m.goals_b,
+                       m.delta_a1, m.delta_a2, m.delta_b1, m.delta_b2, m.delta_a, m.delta_b, m.id
+                FROM {source}
+                WHERE {where}
+                ORDER BY {key[0]} DESC, {key[1]} DESC
+                LIMIT :page_size
+            """), params).fetchall()
+
+        names = {p[0]: p[1] for p in DatabaseManager.get_all_players(leaderboard_id)}
+        page = [(r[0], *(names.get(p_id) for p_id in r[1:5]), *r[5:]) for r in rows]
+        next_cursor = (rows[-1][0], rows[-1][13]) if len(rows) == page_size else None
+        return page, next_cursor
+
+    @staticmethod
+    @leaderboard_cache
+    def get_head_to_head(player_id: int, other_player_id: int, leaderboard_id: int):
+        """Returns how two players fared as partners and as opponents in a leaderboard."""
+        with get_connection() as conn:
+            row = conn.execute(text("""
+                SELECT
+                    COUNT(*) FILTER (WHERE a.side = b.side) AS together,
+                    COUNT(*) FILTER (WHERE a.side = b.side AND a.won) AS together_wins,
+                    COUNT(*) FILTER (WHERE a.side <> b.side) AS against,
+                    COUNT(*) FILTER (WHERE a.side <> b.side AND a.won) AS against_wins
+                FROM match_participants a
+                JOIN match_participants b ON b.match_id = a.match_id AND b.player_id = :other
+                WHERE a.player_id = :pid AND a.leaderboard_id = :l_id
+            """), {"pid": player_id, "other": other_player_id, "l_id": leaderboard_id}).fetchone()
+            return dict(row._mapping)
+
+    @staticmethod
+    @leaderboard_cache
     def get_elo_history(leaderboard_id=None):
         """Fetches the full Elo rating history for all players, optionally filtered by leaderboard_id."""
+        if leaderboard_id:
+            return DatabaseManager._load_elo_history(leaderboard_id)[["created_at", "player", "rating"]]
         with get_connection() as conn:
             query = """
                 SELECT
@@ -126,14 +342,77 @@ class DatabaseManager:
                     h.rating
                 FROM player_ratings_history h
                 JOIN players p ON h.player_id = p.id
+                ORDER BY h.created_at
             """
-            params = {}
-            if leaderboard_id:
-                query += " WHERE h.leaderboard_id = :l_id"
-                params["l_id"] = leaderboard_id
-            
-            query += " ORDER BY h.created_at"
-            return pd.read_sql(text(query), conn, params=params)
+            return pd.read_sql(text(query), conn)
+
+    @staticmethod
+    def _load_elo_history(leaderboard_id):
+        """Returns the (id, created_at, player, rating) history of a leaderboard ordered by date.
+
+        The frame is kept in process and extended with the rows whose id is above the
+        last one seen. Writers insert history while holding the leaderboard lock
+        (_lock_leaderboards), so ids commit in order; any deletion bumps
+        leaderboards.history_deletions and forces a full reload.
+        """
+        with get_connection() as conn:
+            deletions = conn.execute(
+                text("SELECT history_deletions FROM leaderboards WHERE id = :l_id"), {"l_id": leaderboard_id}
+            ).scalar()
+            with _elo_history_lock:
+                cached = _elo_history_frames.get(leaderboard_id)
+            if cached is None or cached[0] != deletions:
+                last_id, frame = 0, None
+            else:
+                _, last_id, frame = cached
+            new_rows = pd.read_sql(text("""
+                SELECT h.id, h.created_at, p.name AS player, h.rating
+                FROM player_ratings_history h
+                JOIN players p ON h.player_id = p.id
+                WHERE h.leaderboard_id = :l_id AND h.id > :last_id
+                ORDER BY h.id
+            """), conn, params={"l_id": leaderboard_id, "last_id": last_id})
+
+        if frame is not None and new_rows.empty:
+            return frame
+        frame = new_rows if frame is None else pd.concat([frame, new_rows], ignore_index=True)
+        if not frame["created_at"].is_monotonic_increasing:
+            frame = frame.sort_values(["created_at", "id"], kind="stable", ignore_index=True)
+        if not frame.empty:
+            last_id = int(frame["id"].max())
+        with _elo_history_lock:
+            _elo_history_frames[leaderboard_id] = (deletions, last_id, frame)
+        return frame
+
+    @staticmethod
+    @leaderboard_cache
+    def get_elo_trend_series(leaderboard_id: int, resolution="auto", since=None, max_points=None):
+        """Returns the Elo history of a leaderboard downsampled for charting.
+
+        "daily" keeps each player's last rating per day; "auto" and "daily" then cut
+        every player's series to its share of max_points with LTTB, which keeps the
+        peaks and dips; "full" returns every row. since limits the date range.
+        """
+        if resolution not in DatabaseManager.ELO_CHART_RESOLUTIONS:
+            raise ValueError(f"Unknown chart resolution: {resolution}")
+        max_points = max_points or DatabaseManager.ELO_CHART_MAX_POINTS
+        df = DatabaseManager._load_elo_history(leaderboard_id)
+        if df.empty:
+            return df[["created_at", "player", "rating"]]
+        if since is not None:
+            df = df[df["created_at"] >= since]
+        if resolution == "daily":
+            df = df[~df[["player"]].assign(day=df["created_at"].dt.date).duplicated(keep="last")]
+
+        if resolution != "full" and len(df) > max_points:
+            x = df["created_at"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+            y = df["rating"].to_numpy()
+            keep = []
+            for _, positions in df.groupby("player", sort=False).indices.items():
+                budget = max(3, max_points * len(positions) // len(df))
+                keep.append(positions[scoring.lttb_indices(x[positions], y[positions], budget)])
+            df = df.iloc[np.sort(np.concatenate(keep))]
+        return df[["created_at", "player", "rating"]].reset_index(drop=True)
 
     @staticmethod
     @st.cache_data
@@ -152,7 +431,7 @@ class DatabaseManager:
             }).fetchone()
 
     @staticmethod
-    @st.cache_data
+    @leaderboard_cache
     def get_player_names(leaderboard_id: int):
         """Fetches IDs and names of active players for a specific leaderboard."""
         with get_connection() as conn:
@@ -167,7 +446,7 @@ class DatabaseManager:
         return [(r[0], r[1]) for r in rows]
 
     @staticmethod
-    @st.cache_data
+    @leaderboard_cache
     def get_all_players(leaderboard_id: int):
         """Fetches all players (active and inactive) for a specific leaderboard."""
         with get_connection() as conn:
@@ -205,38 +484,7 @@ class DatabaseManager:
         return scoring.is_same_match(candidate, existing)
 
     @staticmethod
-    def _get_recent_duplicate_match_id(conn, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id):
-        """Returns a recent matching record that likely came from a duplicate submit."""
-        cutoff = scoring.recent_duplicate_cutoff(datetime.now())
-        recent_matches_query = text("""
-            SELECT id, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b
-            FROM matches
-            WHERE leaderboard_id = :l_id
-              AND date >= :cutoff
-            ORDER BY date DESC
-        """)
-        rows = conn.execute(recent_matches_query, {
-            "l_id": leaderboard_id,
-            "cutoff": cutoff,
-        }).fetchall()
-        candidate = {
-            "a1_id": a1_id,
-            "a2_id": a2_id,
-            "b1_id": b1_id,
-            "b2_id": b2_id,
-            "goals_a": goals_a,
-            "goals_b": goals_b,
-        }
-
-        for row in rows:
-            existing = row._mapping if hasattr(row, "_mapping") else row
-            if scoring.is_same_match(candidate, existing):
-                return existing["id"]
-
-        return None
-
-    @staticmethod
-    @st.cache_data
+    @leaderboard_cache
     def get_future_matches(leaderboard_id: int):
         """Fetches scheduled future matches for a specific leaderboard."""
         with get_connection() as conn:
@@ -259,44 +507,61 @@ class DatabaseManager:
             return conn.execute(query, {"l_id": leaderboard_id}).fetchall()
 
     @staticmethod
-    def generate_calendar(leaderboard_id: int, matches_per_day: int = 3, days: int = 7):
-        """Generates a random schedule of matches for the next few days."""
-        players_data = DatabaseManager.get_player_names(leaderboard_id)
-        if len(players_data) < 4:
+    def generate_calendar(leaderboard_id: int, matches_per_day: int = 3, days: int = 7, seed=None):
+        """Generates a balanced schedule of matches for the next few days.
+
+        Appearances are spread evenly, partners and opponents from the last
+        CALENDAR_HISTORY_DAYS are not repeated where avoidable, and teams are
+        kept close in rating (see scoring.schedule_matches).
+        """
+        pool = DatabaseManager.get_matchmaking_pool(leaderboard_id)
+        if len(pool) < 4:
             return False
 
-        player_ids = [p[0] for p in players_data]
-        
-        # We want to minimize repeat pairings. 
-        # A simple approach: track how many times each pair has played together/against.
-        # For a random generator, we can just shuffle and pick.
-        
+        player_ids = [p[0] for p in pool]
+        index = {p_id: i for i, p_id in enumerate(player_ids)}
+        start_date = datetime.now().replace(hour=18, minute=0, second=0, microsecond=0)
+
+        with get_connection() as conn:
+            recent = conn.execute(text("""
+                SELECT a1_id, a2_id, b1_id, b2_id
+                FROM matches
+                WHERE leaderboard_id = :l_id AND date >= :since
+            """), {"l_id": leaderboard_id, "since": start_date - timedelta(days=CALENDAR_HISTORY_DAYS)}).fetchall()
+
+        # Scheduling takes a second or two, so it runs with no connection or lock held.
+        recent = [[index[p] for p in row] for row in recent if all(p in index for p in row)]
+        partner_counts, opponent_counts = scoring.pair_counts(recent, len(player_ids))
+        schedule = scoring.schedule_matches(
+            [p[2] for p in pool], matches_per_day * days, matches_per_day,
+            partner_counts, opponent_counts, seed=seed,
+        )
+
+        future_matches_to_insert = []
+        for slot, quad in enumerate(schedule):
+            d, m = divmod(slot, matches_per_day)
+            match_time = start_date + timedelta(days=d, minutes=30 * m)
+            a1, a2, b1, b2 = (player_ids[p] for p in quad)
+            future_matches_to_insert.append({
+                "date": match_time,
+                "a1": a1, "a2": a2,
+                "b1": b1, "b2": b2,
+                "l_id": leaderboard_id
+            })
+
         with engine.begin() as conn:
+            # Concurrent calendars replace each other whole rather than interleave.
+            DatabaseManager._lock_leaderboards(conn, [leaderboard_id])
+
             # Clear existing future matches for this leaderboard
             conn.execute(text("DELETE FROM future_matches WHERE leaderboard_id = :l_id"), {"l_id": leaderboard_id})
             
-            start_date = datetime.now().replace(hour=18, minute=0, second=0, microsecond=0)
-            
-            future_matches_to_insert = []
-            for d in range(days):
-                current_day = start_date + timedelta(days=d)
-                for m in range(matches_per_day):
-                    match_time = current_day + timedelta(minutes=30 * m)
-                    selected = random.sample(player_ids, 4)
-                    
-                    future_matches_to_insert.append({
-                        "date": match_time,
-                        "a1": selected[0], "a2": selected[1],
-                        "b1": selected[2], "b2": selected[3],
-                        "l_id": leaderboard_id
-                    })
-            
             if future_matches_to_insert:
                 conn.execute(text("""
                     INSERT INTO future_matches (date, a1_id, a2_id, b1_id, b2_id, leaderboard_id)
                     VALUES (:date, :a1, :a2, :b1, :b2, :l_id)
                 """), future_matches_to_insert)
-        st.cache_data.clear()
+            DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
         return True
 
     @staticmethod
@@ -306,209 +571,246 @@ class DatabaseManager:
         'Best match' means a match where target_player is likely to win AND 
         gain points over rivals (players close in rating).
         """
-        
-        # 1. Get all player stats for the leaderboard
+        matches = DatabaseManager.get_best_matches_for_player(
+            target_player_id, available_player_ids, leaderboard_id, top_k=1
+        )
+        return matches[0] if matches else None
+
+    @staticmethod
+    def get_best_matches_for_player(target_player_id: int, available_player_ids: list, leaderboard_id: int, top_k=5):
+        """Returns the top_k matches for target_player_id, best first.
+
+        Every available player is considered; see scoring.rank_matchups for the scoring.
+        """
+        all_stats = DatabaseManager.get_matchmaking_pool(leaderboard_id)
+        index = {s[0]: i for i, s in enumerate(all_stats)}
+        if target_player_id not in index:
+            return []
+
+        pool = [p for p in dict.fromkeys([target_player_id, *available_player_ids]) if p in index]
+        if len(pool) < 4:
+            return []
+
+        ids = np.array([s[0] for s in all_stats])
+        ratings = np.array([s[2] for s in all_stats], dtype=np.float64)
+        games = np.array([s[3] for s in all_stats], dtype=np.int64)
+        target_rating = ratings[index[target_player_id]]
+
+        # Identify rivals: players with rating close to target
+        others = ids != target_player_id
+        rivals = others & (np.abs(ratings - target_rating) < scoring.RIVAL_RATING_WINDOW)
+        if not rivals.any():
+            # If no close rivals, consider everyone a rival for simplicity
+            rivals = others
+
+        positions = np.array([index[p] for p in pool])
+        names = [all_stats[i][1] for i in positions]
+        ranked = scoring.rank_matchups(ratings[positions], games[positions], 0, rivals[positions], top_k)
+        return [
+            {
+                "team_a": (names[0], names[partner]),
+                "team_b": (names[opp_1], names[opp_2]),
+                "win_prob": win_prob,
+                "est_delta": est_delta,
+                "score": score,
+            }
+            for partner, opp_1, opp_2, win_prob, est_delta, score in ranked
+        ]
+
+    @staticmethod
+    @leaderboard_cache
+    def get_matchmaking_pool(leaderboard_id: int):
+        """Fetches (id, name, rating, games) of active players for matchmaking."""
         with get_connection() as conn:
             query = text("""
                 SELECT p.id, p.name, ps.rating, ps.games
                 FROM players p
                 JOIN player_stats ps ON p.id = ps.player_id
                 WHERE p.is_active = TRUE AND ps.leaderboard_id = :l_id
+                ORDER BY p.id
             """)
-            all_stats = conn.execute(query, {"l_id": leaderboard_id}).fetchall()
-            
-        stats_dict = {s.id: {"name": s.name, "rating": s.rating, "games": s.games} for s in all_stats}
-        
-        if target_player_id not in available_player_ids:
-            available_player_ids.append(target_player_id)
-            
-        if len(available_player_ids) < 4:
-            return None
-
-        target_rating = stats_dict[target_player_id]["rating"]
-        
-        # Identify rivals: players with rating close to target (e.g., +/- 100)
-        rivals = [s.id for s in all_stats if s.id != target_player_id and abs(s.rating - target_rating) < 150]
-        if not rivals:
-            # If no close rivals, consider everyone a rival for simplicity
-            rivals = [s.id for s in all_stats if s.id != target_player_id]
-
-        best_score = -9999
-        best_match = None
-        
-        # Use a subset if too many players to avoid combinatorial explosion
-        # Limit to 10 available players + target
-        if len(available_player_ids) > 10:
-             # Keep target, and 9 others (prioritize those with ratings close to target or high rating)
-             available_player_ids = sorted(available_player_ids, key=lambda x: abs(stats_dict[x]["rating"] - target_rating))[:10]
-             if target_player_id not in available_player_ids:
-                 available_player_ids[-1] = target_player_id
-
-        # Iterate over all possible combinations of 4 players including target
-        other_players = [p for p in available_player_ids if p != target_player_id]
-        for combo in itertools.combinations(other_players, 3):
-            match_players = [target_player_id] + list(combo)
-            
-            # For these 4 players, try all possible team splits (3 ways)
-            # 1. (T, P1) vs (P2, P3)
-            # 2. (T, P2) vs (P1, P3)
-            # 3. (T, P3) vs (P1, P2)
-            
-            p1, p2, p3 = combo
-            possible_teams = [
-                ((target_player_id, p1), (p2, p3)),
-                ((target_player_id, p2), (p1, p3)),
-                ((target_player_id, p3), (p1, p2))
-            ]
-            
-            for team_a, team_b in possible_teams:
-                # Calculate expected win probability and potential delta
-                r_a = (stats_dict[team_a[0]]["rating"] + stats_dict[team_a[1]]["rating"]) / 2.0
-                r_b = (stats_dict[team_b[0]]["rating"] + stats_dict[team_b[1]]["rating"]) / 2.0
-                
-                exp_a = DatabaseManager._expected_score(r_a, r_b)
-                
-                # We want: 
-                # 1. High exp_a (likely to win)
-                # 2. Good delta if win (not playing against much weaker players)
-                # 3. Rivals in Team B (to take points from them)
-                
-                # Potential delta for a standard 10-8 win (margin 2)
-                # K-factor for target player
-                k = DatabaseManager._get_k_factor(stats_dict[target_player_id]["games"])
-                delta_if_win = k * 1.0 * (1.0 - exp_a)
-                
-                # Rival penalty/bonus: if a rival is in team B, it's good. 
-                # If a rival is in team A, it might be bad (they gain points too).
-                rival_impact = 0
-                for p_id in team_b:
-                    if p_id in rivals:
-                        rival_impact += 1
-                for p_id in team_a:
-                    if p_id == target_player_id: continue
-                    if p_id in rivals:
-                        rival_impact -= 0.5
-                
-                # Heuristic score
-                # prioritize probability of winning but also the gain
-                # score = (win_prob * 0.7 + normalized_delta * 0.3) + rival_impact
-                match_score = (exp_a * 10) + (delta_if_win * 0.5) + (rival_impact * 5)
-                
-                if match_score > best_score:
-                    best_score = match_score
-                    best_match = {
-                        "team_a": (stats_dict[team_a[0]]["name"], stats_dict[team_a[1]]["name"]),
-                        "team_b": (stats_dict[team_b[0]]["name"], stats_dict[team_b[1]]["name"]),
-                        "win_prob": exp_a,
-                        "est_delta": delta_if_win
-                    }
-                    
-        return best_match
+            return [tuple(row) for row in conn.execute(query, {"l_id": leaderboard_id}).fetchall()]
 
     @staticmethod
+    @retry_on_conflict
     def delete_match(match_id):
-        """Deletes a match and restores player stats efficiently."""
+        """Deletes a match and restores player stats efficiently.
+
+        Deleting the latest match subtracts its stored deltas; deleting an older one
+        replays only the matches played after it.
+        """
         with engine.begin() as conn:
+            if not DatabaseManager._lock_leaderboards(conn, match_ids=[match_id]):
+                return False
+
             # 1. Get match details
             match_query = text("""
                 SELECT a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, 
-                       delta_a1, delta_a2, delta_b1, delta_b2, leaderboard_id
-                FROM matches WHERE id = :mid
+                       delta_a1, delta_a2, delta_b1, delta_b2, leaderboard_id, date,
+                       m.id <> (
+                           SELECT latest.id FROM matches latest
+                           WHERE latest.leaderboard_id = m.leaderboard_id
+                           ORDER BY latest.date DESC, latest.id DESC LIMIT 1
+                       ) AS has_later
+                FROM matches m WHERE id = :mid
             """)
             match = conn.execute(match_query, {"mid": match_id}).fetchone()
             if not match:
                 return False
 
             m = match._asdict() if hasattr(match, "_asdict") else match._mapping
-            player_ids = [m["a1_id"], m["a2_id"], m["b1_id"], m["b2_id"]]
             l_id = m["leaderboard_id"]
 
-            # 2. Fetch all involved players' stats for THIS leaderboard
-            players_res = conn.execute(
-                text("SELECT player_id, rating, games, wins, losses, goal_diff FROM player_stats WHERE player_id IN :ids AND leaderboard_id = :l_id"),
-                {"ids": tuple(player_ids), "l_id": l_id}
-            ).fetchall()
-            players = {p.player_id: list(p) for p in players_res}
-
-            # 3. Calculate restored stats in memory
-            roles = [
-                (m["a1_id"], m["delta_a1"], m["goals_a"] > m["goals_b"], m["goals_a"] - m["goals_b"]),
-                (m["a2_id"], m["delta_a2"], m["goals_a"] > m["goals_b"], m["goals_a"] - m["goals_b"]),
-                (m["b1_id"], m["delta_b1"], m["goals_b"] > m["goals_a"], m["goals_b"] - m["goals_a"]),
-                (m["b2_id"], m["delta_b2"], m["goals_b"] > m["goals_a"], m["goals_b"] - m["goals_a"]),
-            ]
-
-            for pid, delta, is_win, gd_contrib in roles:
-                p = players[pid]
-                p[1] -= delta        # rating
-                p[2] -= 1            # games
-                if is_win:
-                    p[3] -= 1        # wins
-                else:
-                    p[4] -= 1        # losses
-                p[5] -= gd_contrib   # goal_diff
-
-            # 4. Get new trends for all players in THIS leaderboard
-            trend_query = text("""
-                SELECT pid, STRING_AGG(result, ' ' ORDER BY date DESC) as trend
-                FROM (
-                    SELECT 
-                        p.id as pid,
-                        m.date,
-                        CASE 
-                            WHEN (m.a1_id = p.id OR m.a2_id = p.id) AND m.goals_a > m.goals_b THEN 'W'
-                            WHEN (m.b1_id = p.id OR m.b2_id = p.id) AND m.goals_b > m.goals_a THEN 'W'
-                            ELSE 'L'
-                        END as result,
-                        ROW_NUMBER() OVER (PARTITION BY p.id ORDER BY m.date DESC) as rn
-                    FROM players p
-                    JOIN matches m ON m.a1_id = p.id OR m.a2_id = p.id OR m.b1_id = p.id OR m.b2_id = p.id
-                    WHERE p.id IN :ids AND m.id != :mid AND m.leaderboard_id = :l_id
-                ) t 
-                WHERE rn <= 5
-                GROUP BY pid
-            """)
-            trends_res = conn.execute(trend_query, {"ids": tuple(player_ids), "mid": match_id, "l_id": l_id}).fetchall()
-            trends = {t.pid: t.trend for t in trends_res}
+            if m["has_later"]:
+                DatabaseManager._replay_suffix(conn, l_id, m["date"], match_id, [match_id])
+            else:
+                DatabaseManager._delete_latest_match(conn, match_id, m)
+            DatabaseManager._bump_leaderboard_versions(conn, [l_id])
+            DatabaseManager._refresh_leaderboard_ranks(conn, [l_id], since=m["date"])
 
-            # 5. Batch Update Player Stats
-            update_stmt = text("""
-                UPDATE player_stats
-                SET rating=:r, games=:g, wins=:w, losses=:l, goal_diff=:gd, trend=:t
-                WHERE player_id=:pid AND leaderboard_id=:l_id
-            """)
-            conn.execute(update_stmt, [
+        return True
+
+    @staticmethod
+    def _delete_latest_match(conn, match_id, m):
+        """Subtracts the stored deltas of a leaderboard's latest match and deletes it."""
+        player_ids = [m["a1_id"], m["a2_id"], m["b1_id"], m["b2_id"]]
+        l_id = m["leaderboard_id"]
+
+        # 2. Fetch all involved players' stats for THIS leaderboard
+        players_res = conn.execute(
+            _text_in(conn, "SELECT player_id, rating, games, wins, losses, goal_diff FROM player_stats WHERE player_id IN :ids AND leaderboard_id = :l_id", "ids"),
+            {"ids": tuple(player_ids), "l_id": l_id}
+        ).fetchall()
+        players = {p.player_id: list(p) for p in players_res}
+
+        # 3. Calculate restored stats in memory
+        roles = [
+            (m["a1_id"], m["delta_a1"], m["goals_a"] > m["goals_b"], m["goals_a"] - m["goals_b"]),
+            (m["a2_id"], m["delta_a2"], m["goals_a"] > m["goals_b"], m["goals_a"] - m["goals_b"]),
+            (m["b1_id"], m["delta_b1"], m["goals_b"] > m["goals_a"], m["goals_b"] - m["goals_a"]),
+            (m["b2_id"], m["delta_b2"], m["goals_b"] > m["goals_a"], m["goals_b"] - m["goals_a"]),
+        ]
+
+        for pid, delta, is_win, gd_contrib in roles:
+            p = players[pid]
+            p[1] -= delta        # rating
+            p[2] -= 1            # games
+            if is_win:
+                p[3] -= 1        # wins
+            else:
+                p[4] -= 1        # losses
+            p[5] -= gd_contrib   # goal_diff
+
+        # 4. Get new trends for all players in THIS leaderboard
+        trends = DatabaseManager._get_trends(conn, player_ids, l_id, exclude_match_ids=[match_id])
+
+        # 5. Batch Update Player Stats
+        update_stmt = text("""
+            UPDATE player_stats
+            SET rating=:r, games=:g, wins=:w, losses=:l, goal_diff=:gd, trend=:t
+            WHERE player_id=:pid AND leaderboard_id=:l_id
+        """)
+        conn.execute(update_stmt, [
+            {
+                "r": scoring.stored_rating(players[pid][1]),
+                "g": players[pid][2], 
+                "w": players[pid][3], 
+                "l": players[pid][4], 
+                "gd": players[pid][5], 
+                "t": trends.get(pid, ""),
+                "pid": pid,
+                "l_id": l_id
+            }
+            for pid in player_ids
+        ])
+
+        # 6. Delete match and history
+        conn.execute(text("DELETE FROM player_ratings_history WHERE match_id = :mid"), {"mid": match_id})
+        conn.execute(text("DELETE FROM matches WHERE id = :mid"), {"mid": match_id})
+        DatabaseManager._count_history_deletion(conn, l_id)
+
+    @staticmethod
+    def _get_rating_bounds(conn, leaderboard_id):
+        """Returns the (max, min) rating of a leaderboard, read from both ends of its rating index.
+
+        Inactive players are left out when db.RATING_BOUNDS_ACTIVE_ONLY is set.
+        """
+        if db.RATING_BOUNDS_ACTIVE_ONLY:
+            side = """
+                SELECT ps.rating FROM player_stats ps JOIN players p ON p.id = ps.player_id
+                WHERE ps.leaderboard_id = :l_id AND p.is_active ORDER BY ps.rating {order} LIMIT 1
+            """
+            query = f"SELECT ({side.format(order='DESC')}), ({side.format(order='ASC')})"
+        else:
+            query = "SELECT MAX(rating), MIN(rating) FROM player_stats WHERE leaderboard_id = :l_id"
+        range_res = conn.execute(text(query), {"l_id": leaderboard_id}).fetchone()
+        return tuple(range_res) if range_res and range_res[0] is not None else (1000, 1000)
+
+    @staticmethod
+    def _record_match_server_side(a1_name, a2_name, b1_name, b2_name, goals_a, goals_b, leaderboard_id):
+        """Records a match with the record_match_elo() stored function in a single round trip."""
+        with engine.begin() as conn:
+            match_id = conn.execute(
+                text("SELECT record_match_elo(:l_id, :names, :ga, :gb, :d, :window, :active_only, :lock_mode)"),
                 {
-                    "r": players[pid][1], 
-                    "g": players[pid][2], 
-                    "w": players[pid][3], 
-                    "l": players[pid][4], 
-                    "gd": players[pid][5], 
-                    "t": trends.get(pid, ""),
-                    "pid": pid,
-                    "l_id": l_id
-                }
-                for pid in player_ids
-            ])
+                    "l_id": leaderboard_id,
+                    "names": [a1_name, a2_name, b1_name, b2_name],
+                    "ga": goals_a, "gb": goals_b,
+                    "d": datetime.now(),
+                    "window": timedelta(seconds=DatabaseManager.RECENT_DUPLICATE_MATCH_WINDOW_SECONDS),
+                    "active_only": db.RATING_BOUNDS_ACTIVE_ONLY,
+                    "lock_mode": DatabaseManager._lock_mode(),
+                },
+            ).scalar()
+            if match_id is None:
+                raise ValueError(DatabaseManager.DUPLICATE_MATCH_MESSAGE)
 
-            # 6. Delete match and history
-            conn.execute(text("DELETE FROM player_ratings_history WHERE match_id = :mid"), {"mid": match_id})
-            conn.execute(text("DELETE FROM matches WHERE id = :mid"), {"mid": match_id})
+    @staticmethod
+    @retry_on_conflict
+    def delete_matches(match_ids):
+        """Deletes several matches in one transaction and returns how many were removed.
 
-        st.cache_data.clear()
-        return True
+        Each leaderboard is replayed once from its earliest deleted match, so the number
+        of statements does not grow with the selection and caches are cleared once.
+        """
+        if not match_ids:
+            return 0
+        with engine.begin() as conn:
+            DatabaseManager._lock_leaderboards(conn, match_ids=match_ids)
+            rows = conn.execute(_text_in(conn, """
+                SELECT id, leaderboard_id, date
+                FROM matches
+                WHERE id IN :ids
+                ORDER BY leaderboard_id, date, id
+            """, "ids"), {"ids": tuple(match_ids)}).fetchall()
+
+            for l_id, group in itertools.groupby(rows, key=lambda r: r[1]):
+                group = list(group)
+                cut_id, _, cut_date = group[0]
+                DatabaseManager._replay_suffix(conn, l_id, cut_date, cut_id, [r[0] for r in group])
+
+            if rows:
+                DatabaseManager._bump_leaderboard_versions(conn, {r[1] for r in rows})
+                DatabaseManager._refresh_leaderboard_ranks(conn, {r[1] for r in rows}, since=min(r[2] for r in rows))
+        return len(rows)
 
     @staticmethod
-    def record_match(a1_name, a2_name, b1_name, b2_name, goals_a, goals_b, leaderboard_id):
-        """Records a new match, updates player ratings, and saves history."""
-        if goals_a == goals_b:
-            raise ValueError("Draws are not allowed.")
-        margin = abs(goals_a - goals_b)
-        if margin < 2:
-            raise ValueError("Minimum goal difference of 2 required.")
+    @retry_on_conflict
+    def record_match(a1_name, a2_name, b1_name, b2_name, goals_a, goals_b, leaderboard_id, played_at=None):
+        """Records a new match, updates player ratings, and saves history.
+
+        A played_at earlier than the leaderboard's latest match inserts the match in
+        place and replays only the matches after it.
+        """
+        DatabaseManager._validate_score(goals_a, goals_b)
+
+        if db.SERVER_SIDE_ELO and played_at is None:
+            DatabaseManager._record_match_server_side(a1_name, a2_name, b1_name, b2_name, goals_a, goals_b, leaderboard_id)
+            return
 
         with engine.begin() as conn:
             names = [a1_name, a2_name, b1_name, b2_name]
+            DatabaseManager._lock_leaderboards(conn, [leaderboard_id])
             
             # 1. Ensure all players exist globally (Batch)
             conn.execute(text("""
@@ -518,77 +820,941 @@ class DatabaseManager:
             """), {"n1": a1_name, "n2": a2_name, "n3": b1_name, "n4": b2_name})
 
             # 2. Ensure all players have stats entries for this leaderboard (Batch)
-            conn.execute(text("""
+            conn.execute(_text_in(conn, """
                 INSERT INTO player_stats (player_id, leaderboard_id)
                 SELECT id, :l_id FROM players WHERE name IN :names
                 ON CONFLICT (player_id, leaderboard_id) DO NOTHING
-            """), {"names": tuple(names), "l_id": leaderboard_id})
+            """, "names"), {"names": tuple(names), "l_id": leaderboard_id})
 
             # 3. Get rating range for farming threshold (1 call)
-            range_res = conn.execute(text("SELECT MAX(rating), MIN(rating) FROM player_stats WHERE leaderboard_id = :l_id"), {"l_id": leaderboard_id}).fetchone()
-            max_r, min_r = range_res if range_res and range_res[0] is not None else (1000, 1000)
+            max_r, min_r = DatabaseManager._get_rating_bounds(conn, leaderboard_id)
             rating_diff_threshold = (max_r - min_r) * 0.5 
 
             # 4. Fetch existing stats for these players in this leaderboard (1 call)
-            fetch_query = text("""
+            row_lock = " ORDER BY p.id FOR UPDATE OF ps" if db.MATCH_LOCK_MODE == "row" and not db.is_sqlite(conn) else ""
+            fetch_query = _text_in(conn, f"""
                 SELECT p.id, p.name, ps.rating, ps.games, ps.wins, ps.losses, ps.goal_diff, ps.trend
                 FROM players p
                 JOIN player_stats ps ON p.id = ps.player_id
-                WHERE p.name IN :names AND ps.leaderboard_id = :l_id
-            """)
+                WHERE p.name IN :names AND ps.leaderboard_id = :l_id{row_lock}
+            """, "names")
             res = conn.execute(fetch_query, {"names": tuple(names), "l_id": leaderboard_id})
             existing = {r.name: list(r) for r in res.fetchall()}
 
             a1, a2, b1, b2 = [existing[name] for name in names]
 
-            duplicate_match_id = DatabaseManager._get_recent_duplicate_match_id(
-                conn, a1[0], a2[0], b1[0], b2[0], goals_a, goals_b, leaderboard_id
-            )
-            if duplicate_match_id:
-                raise ValueError("This match was saved a few seconds ago. Wait before saving the same match again.")
+            DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
 
-            players, deltas = scoring.calculate_match_updates(
-                [a1, a2, b1, b2], goals_a, goals_b, rating_diff_threshold
-            )
-            a1, a2, b1, b2 = players
-            delta_a1, delta_a2, delta_b1, delta_b2 = deltas
+            live = played_at is None
+            latest = None
+            if not live:
+                # A plain column rather than MAX(date), so SQLite also returns a datetime.
+                latest = conn.execute(
+                    text("SELECT date FROM matches WHERE leaderboard_id = :l_id ORDER BY date DESC LIMIT 1"),
+                    {"l_id": leaderboard_id},
+                ).scalar()
+            played_at = played_at or datetime.now()
+            if latest is not None and played_at < latest:
+                match_id = conn.execute(text("""
+                    INSERT INTO matches
+                    (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id)
+                    VALUES (:d, :a1, :a2, :b1, :b2, :ga, :gb, :l_id)
+                    RETURNING id
+                """), {
+                    "d": played_at,
+                    "a1": a1[0], "a2": a2[0],
+                    "b1": b1[0], "b2": b2[0],
+                    "ga": goals_a, "gb": goals_b,
+                    "l_id": leaderboard_id
+                }).scalar()
+                DatabaseManager._insert_match_participants(conn, [match_id])
+                DatabaseManager._replay_suffix(conn, leaderboard_id, played_at, match_id)
+            else:
+                pre_match = [list(p) for p in (a1, a2, b1, b2)]
+                players, deltas = scoring.calculate_match_updates(
+                    [a1, a2, b1, b2], goals_a, goals_b, rating_diff_threshold
+                )
+                a1, a2, b1, b2 = players
+                delta_a1, delta_a2, delta_b1, delta_b2 = deltas
+
+                # Insert Match record; the fingerprint index rejects a resubmit in the same duplicate window,
+                # and the NOT EXISTS one that crossed into the next window since the first submit
+                match_insert = text("""
+                    INSERT INTO matches
+                    (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, delta_a1, delta_a2, delta_b1, delta_b2, leaderboard_id,
+                     duplicate_bucket)
+                    SELECT :d, :a1, :a2, :b1, :b2, :ga, :gb, :da1, :da2, :db1, :db2, :l_id, :bucket
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM matches
+                        WHERE leaderboard_id = :l_id AND fingerprint = :fingerprint AND duplicate_bucket = :bucket - 1
+                    )
+                    ON CONFLICT (leaderboard_id, fingerprint, duplicate_bucket) WHERE duplicate_bucket IS NOT NULL
+                    DO NOTHING
+                    RETURNING id
+                """)
+                match_id = conn.execute(match_insert, {
+                    "d": played_at,
+                    "a1": a1[0], "a2": a2[0],
+                    "b1": b1[0], "b2": b2[0],
+                    "ga": goals_a, "gb": goals_b,
+                    "da1": delta_a1, "da2": delta_a2,
+                    "db1": delta_b1, "db2": delta_b2,
+                    "l_id": leaderboard_id,
+                    "bucket": scoring.duplicate_bucket(played_at) if live else None,
+                    "fingerprint": scoring.match_fingerprint(a1[0], a2[0], b1[0], b2[0], goals_a, goals_b),
+                }).scalar()
+                if match_id is None:
+                    raise ValueError(DatabaseManager.DUPLICATE_MATCH_MESSAGE)
+                DatabaseManager._insert_match_participants(conn, [match_id])
+
+                # Batch Update Player Stats in DB
+                update_stmt = text("""
+                    UPDATE player_stats
+                    SET rating=:r, games=:g, wins=:w, losses=:l, goal_diff=:gd, trend=:t
+                    WHERE player_id=:pid AND leaderboard_id=:l_id
+                """)
+                conn.execute(update_stmt, [
+                    {
+                        "r": scoring.stored_rating(p[2]), "g": p[3], "w": p[4], "l": p[5], "gd": p[6], "t": p[7],
+                        "pid": p[0], "l_id": leaderboard_id,
+                    }
+                    for p in [a1, a2, b1, b2]
+                ])
+
+                # Batch Save Rating History in DB, with the stats each player brought into the match
+                history_insert = text("""
+                    INSERT INTO player_ratings_history
+                    (player_id, match_id, rating, leaderboard_id, created_at,
+                     pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff)
+                    VALUES (:pid, :mid, :rating, :l_id, :d, :pr, :pg, :pw, :pl, :pgd)
+                """)
+                conn.execute(history_insert, [
+                    {
+                        "pid": p[0], "mid": match_id, "rating": int(p[2]), "l_id": leaderboard_id, "d": played_at,
+                        "pr": pre[2], "pg": pre[3], "pw": pre[4], "pl": pre[5], "pgd": pre[6],
+                    }
+                    for p, pre in zip([a1, a2, b1, b2], pre_match)
+                ])
+            DatabaseManager._refresh_leaderboard_ranks(conn, [leaderboard_id], since=played_at)
+
+    @staticmethod
+    def _validate_score(goals_a, goals_b):
+        if goals_a == goals_b:
+            raise ValueError("Draws are not allowed.")
+        if abs(goals_a - goals_b) < 2:
+            raise ValueError("Minimum goal difference of 2 required.")
+
+    @staticmethod
+    @retry_on_conflict
+    def record_matches(leaderboard_id, submissions):
+        """Records a burst of live matches in one transaction; returns their ids, None for duplicates.
 
-            # Batch Update Player Stats in DB
-            update_stmt = text("""
+        submissions are (a1, a2, b1, b2, goals_a, goals_b) tuples with validated scores.
+        The result is the same as calling record_match for each of them in order, but
+        every table is written with one batched statement.
+        """
+        if not submissions:
+            return []
+        names = sorted({name for submission in submissions for name in submission[:4]})
+        with engine.begin() as conn:
+            DatabaseManager._lock_leaderboards(conn, [leaderboard_id])
+            sqlite = db.is_sqlite(conn)
+            if sqlite:
+                conn.execute(
+                    text("INSERT INTO players (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+                    [{"name": name} for name in names],
+                )
+            else:
+                conn.execute(text("""
+                    INSERT INTO players (name) SELECT unnest(CAST(:names AS TEXT[]))
+                    ON CONFLICT (name) DO NOTHING
+                """), {"names": names})
+            joined = set(conn.execute(_text_in(conn, """
+                INSERT INTO player_stats (player_id, leaderboard_id)
+                SELECT id, :l_id FROM players WHERE name IN :names
+                ON CONFLICT (player_id, leaderboard_id) DO NOTHING
+                RETURNING player_id
+            """, "names"), {"names": tuple(names), "l_id": leaderboard_id}).scalars())
+
+            # The rating bounds move as the burst is applied, so every rated player is needed.
+            row_lock = " FOR UPDATE OF ps" if db.MATCH_LOCK_MODE == "row" and not sqlite else ""
+            rows = conn.execute(text(f"""
+                SELECT p.id, p.name, ps.rating, ps.games, ps.wins, ps.losses, ps.goal_diff, ps.trend, p.is_active
+                FROM player_stats ps
+                JOIN players p ON p.id = ps.player_id
+                WHERE ps.leaderboard_id = :l_id
+                ORDER BY p.id{row_lock}
+            """), {"l_id": leaderboard_id}).fetchall()
+            players = {r[0]: list(r[:8]) for r in rows}
+            ids = {r[1]: r[0] for r in rows}
+            eligible = {r[0] for r in rows if r[8] or not db.RATING_BOUNDS_ACTIVE_ONLY}
+            # Players new to the leaderboard enter the bounds with their first match, as in record_match.
+            bounds = {pid: players[pid][2] for pid in eligible - joined}
+
+            played_at = datetime.now()
+            bucket = scoring.duplicate_bucket(played_at)
+            quads = [[ids[name] for name in submission[:4]] for submission in submissions]
+            fingerprints = [scoring.match_fingerprint(*quad, *submission[4:6]) for quad, submission in zip(quads, submissions)]
+            # The previous window too, for resubmits that crossed into this one.
+            seen = set(conn.execute(_text_in(conn, """
+                SELECT fingerprint FROM matches
+                WHERE leaderboard_id = :l_id AND duplicate_bucket IN (:bucket - 1, :bucket) AND fingerprint IN :fingerprints
+            """, "fingerprints"), {"l_id": leaderboard_id, "bucket": bucket, "fingerprints": tuple(fingerprints)}).scalars())
+
+            accepted = []
+            history = []
+            for n, (quad, fingerprint, submission) in enumerate(zip(quads, fingerprints, submissions)):
+                if fingerprint in seen:
+                    continue
+                seen.add(fingerprint)
+                bounds.update({pid: players[pid][2] for pid in quad if pid in eligible})
+                max_r, min_r = (max(bounds.values()), min(bounds.values())) if bounds else (1000, 1000)
+                pre_match = [players[pid] for pid in quad]
+                updated, deltas = scoring.calculate_match_updates(pre_match, *submission[4:6], (max_r - min_r) * 0.5)
+                accepted.append((n, quad, submission[4:6], deltas))
+                for pre, p in zip(pre_match, updated):
+                    history.append({
+                        "pid": p[0], "rating": int(p[2]), "l_id": leaderboard_id, "d": played_at,
+                        "pr": pre[2], "pg": pre[3], "pw": pre[4], "pl": pre[5], "pgd": pre[6],
+                    })
+                    p[2] = scoring.stored_rating(p[2])
+                    players[p[0]] = p
+                    if p[0] in bounds:
+                        bounds[p[0]] = p[2]
+
+            results = [None] * len(submissions)
+            if not accepted:
+                return results
+            DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
+
+            columns = list(zip(*[(*quad, *goals, *deltas) for _, quad, goals, deltas in accepted]))
+            if sqlite:
+                match_insert = text("""
+                    INSERT INTO matches
+                    (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, delta_a1, delta_a2, delta_b1, delta_b2,
+                     leaderboard_id, duplicate_bucket)
+                    VALUES (:d, :a1, :a2, :b1, :b2, :ga, :gb, :da1, :da2, :db1, :db2, :l_id, :bucket)
+                    RETURNING id
+                """)
+                match_ids = [
+                    conn.execute(match_insert, {
+                        "d": played_at, "l_id": leaderboard_id, "bucket": bucket,
+                        **dict(zip(("a1", "a2", "b1", "b2", "ga", "gb", "da1", "da2", "db1", "db2"), row)),
+                    }).scalar()
+                    for row in zip(*columns)
+                ]
+            else:
+                match_ids = sorted(conn.execute(text("""
+                    INSERT INTO matches
+                    (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, delta_a1, delta_a2, delta_b1, delta_b2,
+                     leaderboard_id, duplicate_bucket)
+                    SELECT :d, a1, a2, b1, b2, ga, gb, da1, da2, db1, db2, :l_id, :bucket
+                    FROM unnest(
+                        CAST(:a1 AS INTEGER[]), CAST(:a2 AS INTEGER[]), CAST(:b1 AS INTEGER[]), CAST(:b2 AS INTEGER[]),
+                        CAST(:ga AS INTEGER[]), CAST(:gb AS INTEGER[]),
+                        CAST(:da1 AS REAL[]), CAST(:da2 AS REAL[]), CAST(:db1 AS REAL[]), CAST(:db2 AS REAL[])
+                    ) WITH ORDINALITY AS t(a1, a2, b1, b2, ga, gb, da1, da2, db1, db2, n)
+                    ORDER BY n
+                    RETURNING id
+                """), {
+                    "d": played_at, "l_id": leaderboard_id, "bucket": bucket,
+                    **{key: list(values) for key, values in zip(
+                        ("a1", "a2", "b1", "b2", "ga", "gb", "da1", "da2", "db1", "db2"), columns
+                    )},
+                }).scalars())
+            DatabaseManager._insert_match_participants(conn, match_ids)
+
+            touched = {pid for _, quad, _, _ in accepted for pid in quad}
+            conn.execute(text("""
                 UPDATE player_stats
                 SET rating=:r, games=:g, wins=:w, losses=:l, goal_diff=:gd, trend=:t
                 WHERE player_id=:pid AND leaderboard_id=:l_id
-            """)
-            conn.execute(update_stmt, [
+            """), [
                 {"r": p[2], "g": p[3], "w": p[4], "l": p[5], "gd": p[6], "t": p[7], "pid": p[0], "l_id": leaderboard_id}
-                for p in [a1, a2, b1, b2]
+                for p in (players[pid] for pid in sorted(touched))
             ])
+            for row, match_id in zip(history, (mid for mid in match_ids for _ in range(4))):
+                row["mid"] = match_id
+            conn.execute(text("""
+                INSERT INTO player_ratings_history
+                (player_id, match_id, rating, leaderboard_id, created_at,
+                 pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff)
+                VALUES (:pid, :mid, :rating, :l_id, :d, :pr, :pg, :pw, :pl, :pgd)
+            """), history)
+            DatabaseManager._refresh_leaderboard_ranks(conn, [leaderboard_id], since=played_at)
 
-            # Insert Match record
-            match_insert = text("""
-                INSERT INTO matches
-                (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, delta_a1, delta_a2, delta_b1, delta_b2, leaderboard_id)
-                VALUES (:d, :a1, :a2, :b1, :b2, :ga, :gb, :da1, :da2, :db1, :db2, :l_id)
-                RETURNING id
-            """)
-            match_id = conn.execute(match_insert, {
-                "d": datetime.now(),
-                "a1": a1[0], "a2": a2[0],
-                "b1": b1[0], "b2": b2[0],
-                "ga": goals_a, "gb": goals_b,
-                "da1": delta_a1, "da2": delta_a2,
-                "db1": delta_b1, "db2": delta_b2,
-                "l_id": leaderboard_id
-            }).scalar()
+        for (n, _, _, _), match_id in zip(accepted, match_ids):
+            results[n] = match_id
+        return results
 
-            # Batch Save Rating History in DB
-            history_insert = text("""
-                INSERT INTO player_ratings_history (player_id, match_id, rating, leaderboard_id)
-                VALUES (:pid, :mid, :rating, :l_id)
-            """)
-            conn.execute(history_insert, [
-                {"pid": p[0], "mid": match_id, "rating": int(p[2]), "l_id": leaderboard_id}
-                for p in [a1, a2, b1, b2]
+    @staticmethod
+    def _read_import_rows(source, fmt):
+        """Parses CSV (with header) or JSONL match records into validated tuples."""
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported import format: {fmt}")
+        if fmt == "csv":
+            records = csv.DictReader(source)
+        else:
+            records = (json.loads(line) for line in source if line.strip())
+
+        rows = []
+        for line, record in enumerate(records, start=1):
+            try:
+                date = record["date"]
+                date = date if isinstance(date, datetime) else datetime.fromisoformat(str(date).strip())
+                names = [str(record[k]).strip() for k in ("a1", "a2", "b1", "b2")]
+                goals_a, goals_b = int(record["goals_a"]), int(record["goals_b"])
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"Record {line}: invalid match ({e}).") from e
+            if len(set(names)) < 4 or "" in names:
+                raise ValueError(f"Record {line}: four different players are required.")
+            if goals_a == goals_b:
+                raise ValueError(f"Record {line}: draws are not allowed.")
+            if abs(goals_a - goals_b) < 2:
+                raise ValueError(f"Record {line}: minimum goal difference of 2 required.")
+            rows.append((line, date.isoformat(sep=" "), *names, goals_a, goals_b))
+        return rows
+
+    @staticmethod
+    def import_matches(source, leaderboard_id: int, fmt: str = None):
+        """Bulk-imports historical matches from a CSV or JSONL file and returns how many were loaded.
+
+        Records need date, a1, a2, b1, b2, goals_a and goals_b (player names). They are
+        COPY-ed into a staging table (inserted on SQLite), unknown players are created,
+        and the leaderboard is replayed once from the earliest imported match.
+        """
+        if isinstance(source, (str, bytes, os.PathLike)):
+            fmt = fmt or os.path.splitext(os.fsdecode(source))[1].lstrip(".").lower()
+            with open(source, newline="", encoding="utf-8") as f:
+                rows = DatabaseManager._read_import_rows(f, fmt)
+        else:
+            rows = DatabaseManager._read_import_rows(source, fmt or "csv")
+        if not rows:
+            return 0
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        with engine.begin() as conn:
+            DatabaseManager._lock_leaderboards(conn, [leaderboard_id])
+            if db.is_sqlite(conn):
+                return DatabaseManager._import_matches_sqlite(conn, leaderboard_id, rows)
+            conn.execute(text("""
+                CREATE TEMP TABLE match_import (
+                    line INTEGER, date TIMESTAMP, a1 TEXT, a2 TEXT, b1 TEXT, b2 TEXT,
+                    goals_a INTEGER, goals_b INTEGER
+                ) ON COMMIT DROP
+            """))
+            with conn.connection.cursor() as cursor:
+                cursor.copy_expert("COPY match_import FROM STDIN WITH (FORMAT csv)", buffer)
+
+            conn.execute(text("""
+                INSERT INTO players (name)
+                SELECT DISTINCT n.name FROM match_import s, unnest(ARRAY[s.a1, s.a2, s.b1, s.b2]) AS n(name)
+                ON CONFLICT (name) DO NOTHING
+            """))
+            conn.execute(text("""
+                INSERT INTO player_stats (player_id, leaderboard_id)
+                SELECT DISTINCT p.id, :l_id
+                FROM match_import s, unnest(ARRAY[s.a1, s.a2, s.b1, s.b2]) AS n(name)
+                JOIN players p ON p.name = n.name
+                ON CONFLICT (player_id, leaderboard_id) DO NOTHING
+            """), {"l_id": leaderboard_id})
+
+            DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
+
+            # Deltas stay NULL here; the suffix replay below fills them in.
+            first_id, first_date, imported = conn.execute(text(f"""
+                WITH inserted AS (
+                    INSERT INTO matches (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id)
+                    SELECT s.date, pa1.id, pa2.id, pb1.id, pb2.id, s.goals_a, s.goals_b, :l_id
+                    FROM match_import s
+                    JOIN players pa1 ON pa1.name = s.a1
+                    JOIN players pa2 ON pa2.name = s.a2
+                    JOIN players pb1 ON pb1.name = s.b1
+                    JOIN players pb2 ON pb2.name = s.b2
+                    ORDER BY s.date, s.line
+                    RETURNING id, date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id
+                ),
+                participants AS ({db.insert_match_participants_sql("inserted")})
+                SELECT id, date, COUNT(*) OVER () FROM inserted ORDER BY date, id LIMIT 1
+            """), {"l_id": leaderboard_id}).fetchone()
+
+            DatabaseManager._replay_suffix(conn, leaderboard_id, first_date, first_id)
+            DatabaseManager._refresh_leaderboard_ranks(conn, [leaderboard_id], since=first_date)
+
+        return imported
+
+    @staticmethod
+    def _import_matches_sqlite(conn, leaderboard_id, rows):
+        """import_matches for SQLite: plain inserts in place of COPY and the data-modifying CTE."""
+        names = sorted({name for row in rows for name in row[2:6]})
+        conn.execute(text("INSERT INTO players (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"), [{"name": n} for n in names])
+        conn.execute(_text_in(conn, """
+            INSERT INTO player_stats (player_id, leaderboard_id)
+            SELECT id, :l_id FROM players WHERE name IN :names
+            ON CONFLICT (player_id, leaderboard_id) DO NOTHING
+        """, "names"), {"names": tuple(names), "l_id": leaderboard_id})
+        ids = dict(conn.execute(_text_in(conn, "SELECT name, id FROM players WHERE name IN :names", "names"), {"names": tuple(names)}).fetchall())
+
+        DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
+
+        # Deltas stay NULL here; the suffix replay below fills them in. Ids follow (date, line)
+        # and only grow (AUTOINCREMENT), so the new matches are the ones above the previous maximum.
+        last_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM matches")).scalar()
+        conn.execute(text("""
+            INSERT INTO matches (date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, leaderboard_id)
+            VALUES (:d, :a1, :a2, :b1, :b2, :ga, :gb, :l_id)
+        """), [
+            {
+                "d": datetime.fromisoformat(date), "a1": ids[a1], "a2": ids[a2], "b1": ids[b1], "b2": ids[b2],
+                "ga": goals_a, "gb": goals_b, "l_id": leaderboard_id,
+            }
+            for _, date, a1, a2, b1, b2, goals_a, goals_b in sorted(rows, key=lambda r: (r[1], r[0]))
+        ])
+        conn.execute(
+            text(db.insert_match_participants_sql("matches", "WHERE m.id > :last_id", sqlite=True)),
+            {"last_id": last_id},
+        )
+        first_id, first_date = conn.execute(text("""
+            SELECT id, date FROM matches WHERE id > :last_id ORDER BY date, id LIMIT 1
+        """), {"last_id": last_id}).fetchone()
+
+        DatabaseManager._replay_suffix(conn, leaderboard_id, first_date, first_id)
+        DatabaseManager._refresh_leaderboard_ranks(conn, [leaderboard_id], since=first_date)
+        return len(rows)
+
+    @staticmethod
+    def _lock_mode():
+        if db.MATCH_LOCK_MODE not in db.LOCK_MODES:
+            raise ValueError(f"Unknown MATCH_LOCK_MODE: {db.MATCH_LOCK_MODE}")
+        return db.MATCH_LOCK_MODE
+
+    @staticmethod
+    def _lock_leaderboards(conn, leaderboard_ids=None, match_ids=None):
+        """Serializes the writers of these leaderboards until the transaction ends; returns their ids.
+
+        Every writer takes this lock before reading anything it will update, and in
+        leaderboard id order, so concurrent writers neither lose updates nor deadlock.
+        It also orders history inserts, so ids commit in order (see _load_elo_history).
+        With match_ids, the leaderboards of those matches are looked up and locked in one statement.
+        SQLite has a single writer, so there a no-op write takes the database write lock up front.
+        """
+        if db.is_sqlite(conn):
+            if match_ids is not None:
+                where, ids = "id IN (SELECT leaderboard_id FROM matches WHERE id IN :ids)", match_ids
+            else:
+                where, ids = "id IN :ids", leaderboard_ids
+            query = _text_in(conn, f"UPDATE leaderboards SET version = version WHERE {where} RETURNING id", "ids")
+            return sorted(conn.execute(query, {"ids": tuple(ids)}).scalars())
+        if match_ids is not None:
+            ids_sql, params = "SELECT DISTINCT leaderboard_id FROM matches WHERE id IN :ids", {"ids": tuple(match_ids)}
+        else:
+            ids_sql, params = "SELECT unnest(CAST(:ids AS INTEGER[]))", {"ids": list(leaderboard_ids)}
+        if DatabaseManager._lock_mode() == "advisory":
+            query = f"""
+                SELECT t.l_id, pg_advisory_xact_lock(hashtext('leaderboard_writes'), t.l_id)
+                FROM ({ids_sql} ORDER BY 1) AS t(l_id)
+            """
+        else:
+            query = f"SELECT id FROM leaderboards WHERE id IN ({ids_sql}) ORDER BY id FOR UPDATE"
+        return [row[0] for row in conn.execute(text(query), params).fetchall()]
+
+    @staticmethod
+    def _bump_leaderboard_versions(conn, leaderboard_ids):
+        """Marks every cached read of these leaderboards stale, for all app processes at once."""
+        conn.execute(
+            _text_in(conn, "UPDATE leaderboards SET version = version + 1 WHERE id IN :ids", "ids"),
+            {"ids": tuple(leaderboard_ids)},
+        )
+
+    @staticmethod
+    def _refresh_leaderboard_ranks(conn, leaderboard_ids, since=None):
+        """Brings leaderboard_ranks and the rating snapshots of these leaderboards in line with player_stats.
+
+        Writers call it last in their transaction, so the ranking always matches the
+        committed stats. since is the earliest date of the matches the write added,
+        removed or replayed: only players who moved are re-ranked, and the snapshots
+        that history feeds are recomputed. Without since the history is unchanged and
+        the players are ranked anew, for writes that change who is active.
+        SERVER_SIDE_ELO does the same for live matches in refresh_leaderboard_ranks().
+        """
+        if not leaderboard_ids:
+            return
+        ids = tuple(leaderboard_ids)
+        if since is None:
+            conn.execute(_text_in(conn, "DELETE FROM leaderboard_ranks WHERE leaderboard_id IN :ids", "ids"), {"ids": ids})
+            conn.execute(_text_in(conn, db.leaderboard_ranks_sql("ps.leaderboard_id IN :ids"), "ids"), {"ids": ids})
+            return
+        conn.execute(_text_in(conn, db.rerank_leaderboards_sql("ps.leaderboard_id IN :ids"), "ids"), {"ids": ids})
+        DatabaseManager._refresh_rating_snapshots(conn, ids, since)
+
+    @staticmethod
+    def _refresh_rating_snapshots(conn, leaderboard_ids, since):
+        """Keeps a rating snapshot at the start of every recent hour in which a match was played.
+
+        A snapshot holds the ratings after the matches played before it, so the rating
+        at any cutoff is in the first snapshot from the cutoff on. Snapshots taken after
+        since no longer hold and are recomputed, the missing ones are added, and those of
+        emptied hours or older than db.RATING_SNAPSHOT_RETENTION are dropped. A live match only adds the
+        snapshot of its hour, when it is the hour's first.
+        """
+        window_start = _hour(datetime.now()) - db.RATING_SNAPSHOT_RETENTION
+        conn.execute(_text_in(conn, """
+            DELETE FROM leaderboard_rating_snapshots
+            WHERE leaderboard_id IN :ids AND (taken_at < :window_start OR taken_at > :since)
+        """, "ids"), {"ids": leaderboard_ids, "window_start": window_start, "since": since})
+        params = {"ids": leaderboard_ids, "first_hour": _hour(max(since, window_start))}
+        taken = set(map(tuple, conn.execute(_text_in(conn, """
+            SELECT DISTINCT leaderboard_id, taken_at FROM leaderboard_rating_snapshots
+            WHERE leaderboard_id IN :ids AND taken_at >= :first_hour
+        """, "ids"), params)))
+        played = {(l_id, _hour(date)) for l_id, date in conn.execute(_text_in(conn, """
+            SELECT DISTINCT leaderboard_id, date FROM matches WHERE leaderboard_id IN :ids AND date >= :first_hour
+        """, "ids"), params)}
+        # A snapshot is left without matches in its hour when the write removed them.
+        emptied = sorted(taken - played)
+        if emptied:
+            conn.execute(text("""
+                DELETE FROM leaderboard_rating_snapshots WHERE leaderboard_id = :l_id AND taken_at = :taken_at
+            """), [{"l_id": l_id, "taken_at": taken_at} for l_id, taken_at in emptied])
+        missing = sorted(played - taken)
+        if missing:
+            conn.execute(
+                text(db.rating_snapshot_sql(":l_id", ":taken_at")),
+                [{"l_id": l_id, "taken_at": taken_at} for l_id, taken_at in missing],
+            )
+
+    @staticmethod
+    def _count_history_deletion(conn, leaderboard_id):
+        """Tells incremental history loaders that rows they may hold are gone."""
+        conn.execute(
+            text("UPDATE leaderboards SET history_deletions = history_deletions + 1 WHERE id = :l_id"),
+            {"l_id": leaderboard_id},
+        )
+
+    @staticmethod
+    def _insert_match_participants(conn, match_ids):
+        """Adds the match_participants rows of freshly inserted matches."""
+        sql = db.insert_match_participants_sql("matches", "WHERE m.id IN :ids", sqlite=db.is_sqlite(conn))
+        conn.execute(_text_in(conn, sql, "ids"), {"ids": tuple(match_ids)})
+
+    @staticmethod
+    def _bulk_update_player_stats(conn, leaderboard_id, rows):
+        """Writes (player_id, rating, games, wins, losses, goal_diff, trend) rows in one statement."""
+        if not rows:
+            return
+        if db.is_sqlite(conn):
+            # SQLite REAL is a double: store what a Postgres REAL column would give back.
+            rows = [(row[0], scoring.stored_rating(row[1]), *row[2:]) for row in rows]
+            conn.execute(text("""
+                UPDATE player_stats
+                SET rating = :rating, games = :games, wins = :wins, losses = :losses, goal_diff = :goal_diff, trend = :trend
+                WHERE player_id = :player_id AND leaderboard_id = :l_id
+            """), [
+                dict(zip(("player_id", "rating", "games", "wins", "losses", "goal_diff", "trend"), row), l_id=leaderboard_id)
+                for row in rows
             ])
-        
-        st.cache_data.clear()
+            return
+        columns = list(zip(*rows))
+        conn.execute(text("""
+            UPDATE player_stats ps
+            SET rating = v.rating, games = v.games, wins = v.wins, losses = v.losses,
+                goal_diff = v.goal_diff, trend = v.trend
+            FROM unnest(
+                CAST(:pids AS INTEGER[]), CAST(:ratings AS REAL[]), CAST(:games AS INTEGER[]),
+                CAST(:wins AS INTEGER[]), CAST(:losses AS INTEGER[]), CAST(:gds AS INTEGER[]),
+                CAST(:trends AS TEXT[])
+            ) AS v(player_id, rating, games, wins, losses, goal_diff, trend)
+            WHERE ps.player_id = v.player_id AND ps.leaderboard_id = :l_id
+        """), {
+            "pids": list(columns[0]), "ratings": list(columns[1]), "games": list(columns[2]),
+            "wins": list(columns[3]), "losses": list(columns[4]), "gds": list(columns[5]),
+            "trends": list(columns[6]), "l_id": leaderboard_id,
+        })
+
+    @staticmethod
+    def _bulk_insert_history(conn, leaderboard_id, match_ids, dates, quads, result):
+        """COPYs the player_ratings_history rows of replayed matches in one round trip (SQLite: executemany).
+
+        Each row keeps the player's stats going into the match so a later suffix
+        replay can restart from it instead of from the first match.
+        """
+        if not len(match_ids):
+            return
+        rows = zip(
+            np.asarray(quads).ravel().tolist(),
+            np.repeat(match_ids, 4).tolist(),
+            result.ratings_after.astype(np.int64).ravel().tolist(),
+            [d for d in dates for _ in range(4)],
+            itertools.repeat(leaderboard_id),
+            result.ratings_before.ravel().tolist(),
+            result.games_before.ravel().tolist(),
+            result.wins_before.ravel().tolist(),
+            result.losses_before.ravel().tolist(),
+            result.goal_diff_before.ravel().tolist(),
+        )
+        if db.is_sqlite(conn):
+            # Positional driver SQL: building SQLAlchemy parameters per row costs more than the inserts.
+            conn.exec_driver_sql("""
+                INSERT INTO player_ratings_history
+                (player_id, match_id, rating, created_at, leaderboard_id,
+                 pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, list(rows))
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert("""
+                COPY player_ratings_history
+                (player_id, match_id, rating, created_at, leaderboard_id,
+                 pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff)
+                FROM STDIN WITH (FORMAT csv)
+            """, buffer)
+
+    @staticmethod
+    def _bulk_update_match_deltas(conn, match_ids, deltas):
+        """Rewrites delta_a1..delta_b2 for the given matches in one statement."""
+        if not match_ids:
+            return
+        if db.is_sqlite(conn):
+            conn.exec_driver_sql(
+                "UPDATE matches SET delta_a1 = ?, delta_a2 = ?, delta_b1 = ?, delta_b2 = ? WHERE id = ?",
+                [(*d, mid) for mid, d in zip(match_ids, deltas)],
+            )
+            return
+        da1, da2, db1, db2 = (list(column) for column in zip(*deltas))
+        conn.execute(text("""
+            UPDATE matches m
+            SET delta_a1 = v.da1, delta_a2 = v.da2, delta_b1 = v.db1, delta_b2 = v.db2
+            FROM unnest(
+                CAST(:mids AS INTEGER[]), CAST(:da1 AS REAL[]), CAST(:da2 AS REAL[]),
+                CAST(:db1 AS REAL[]), CAST(:db2 AS REAL[])
+            ) AS v(id, da1, da2, db1, db2)
+            WHERE m.id = v.id
+        """), {"mids": match_ids, "da1": da1, "da2": da2, "db1": db1, "db2": db2})
+
+    @staticmethod
+    def _get_trends(conn, player_ids, leaderboard_id, exclude_match_ids=()):
+        """Returns {player_id: trend} built from each player's last five matches."""
+        exclude_clause = " AND mp.match_id NOT IN :excluded" if exclude_match_ids else ""
+        if db.is_sqlite(conn):
+            return DatabaseManager._get_trends_sqlite(conn, player_ids, leaderboard_id, exclude_clause, exclude_match_ids)
+        trend_query = text(f"""
+            SELECT p.pid, STRING_AGG(CASE WHEN r.won THEN 'W' ELSE 'L' END, ' ' ORDER BY r.date DESC, r.match_id DESC) AS trend
+            FROM unnest(CAST(:ids AS INTEGER[])) AS p(pid)
+            CROSS JOIN LATERAL (
+                SELECT mp.won, mp.date, mp.match_id
+                FROM match_participants mp
+                WHERE mp.player_id = p.pid AND mp.leaderboard_id = :l_id{exclude_clause}
+                ORDER BY mp.date DESC, mp.match_id DESC
+                LIMIT 5
+            ) r
+            GROUP BY p.pid
+        """)
+        params = {"ids": list(player_ids), "l_id": leaderboard_id}
+        if exclude_match_ids:
+            params["excluded"] = tuple(exclude_match_ids)
+        trends_res = conn.execute(trend_query, params).fetchall()
+        return {t.pid: t.trend for t in trends_res}
+
+    @staticmethod
+    def _get_trends_sqlite(conn, player_ids, leaderboard_id, exclude_clause, exclude_match_ids):
+        """_get_trends without LATERAL or ordered STRING_AGG: numbers the rows, joins them in Python."""
+        params = {"ids": tuple(player_ids), "l_id": leaderboard_id}
+        if exclude_match_ids:
+            params["excluded"] = tuple(exclude_match_ids)
+        rows = conn.execute(_text_in(conn, f"""
+            SELECT pid, won FROM (
+                SELECT mp.player_id AS pid, mp.won,
+                       ROW_NUMBER() OVER (PARTITION BY mp.player_id ORDER BY mp.date DESC, mp.match_id DESC) AS n
+                FROM match_participants mp
+                WHERE mp.player_id IN :ids AND mp.leaderboard_id = :l_id{exclude_clause}
+            )
+            WHERE n <= 5
+            ORDER BY pid, n
+        """, *params.keys() - {"l_id"}), params)
+        results = {}
+        for pid, group in itertools.groupby(rows, key=lambda r: r[0]):
+            results[pid] = " ".join("W" if won else "L" for _, won in group)
+        return results
+
+    @staticmethod
+    def _stream_replay(conn, leaderboard_id, state, player_ids, registered, write, since=None):
+        """Replays a leaderboard's matches chunk by chunk, starting from the given state.
+
+        Only matches at or after the since=(date, id) cut are read when it is given.
+        Returns the updated (state, player_ids), the ids of players who played and the
+        replay counters; with write=True the deltas of changed matches and their history rows are written.
+        """
+        query = """
+            SELECT id, date, a1_id, a2_id, b1_id, b2_id, goals_a, goals_b,
+                   COALESCE(delta_a1, 'NaN'), COALESCE(delta_a2, 'NaN'),
+                   COALESCE(delta_b1, 'NaN'), COALESCE(delta_b2, 'NaN')
+            FROM matches
+            WHERE leaderboard_id = :l_id
+        """
+        params = {"l_id": leaderboard_id}
+        if since is not None:
+            query += " AND (date, id) >= (:cut_date, :cut_id)"
+            params["cut_date"], params["cut_id"] = since
+        query += " ORDER BY date, id"
+
+        # Mirrors _get_rating_bounds: inactive players never enter the rating spread.
+        inactive = set()
+        if db.RATING_BOUNDS_ACTIVE_ONLY:
+            inactive = {r[0] for r in conn.execute(text("""
+                SELECT ps.player_id FROM player_stats ps JOIN players p ON p.id = ps.player_id
+                WHERE ps.leaderboard_id = :l_id AND NOT p.is_active
+            """), {"l_id": leaderboard_id})}
+
+        index = {pid: i for i, pid in enumerate(player_ids)}
+        played = set()
+        matches_replayed = 0
+        mismatched_matches = 0
+        # Server-side cursor: only one chunk of matches is held in memory at a time.
+        match_stream = conn.execute(
+            text(query), params,
+            execution_options={"yield_per": DatabaseManager.REPLAY_CHUNK_SIZE},
+        )
+        # The explicit size matters on SQLite, which has no server-side cursor to take it from.
+        for chunk in match_stream.partitions(DatabaseManager.REPLAY_CHUNK_SIZE):
+            match_ids, dates, a1, a2, b1, b2, goals_a, goals_b, *stored_deltas = zip(*chunk)
+            quads = np.array([a1, a2, b1, b2], dtype=np.int64).T
+            for pid in np.unique(quads).tolist():
+                played.add(pid)
+                if pid not in index:
+                    index[pid] = len(player_ids)
+                    player_ids.append(pid)
+            lookup = np.array(player_ids, dtype=np.int64)
+            order = np.argsort(lookup)
+            player_idx = order[np.searchsorted(lookup, quads, sorter=order)]
+            registered = np.concatenate([registered, np.zeros(len(player_ids) - len(registered), dtype=bool)])
+
+            eligible = [pid not in inactive for pid in player_ids] if inactive else None
+
+            result = scoring.replay_matches(
+                player_idx, goals_a, goals_b,
+                state=state, n_players=len(player_ids), registered=registered,
+                eligible=eligible, rating_storage="float32",
+            )
+            state = result.state
+            registered[player_idx.ravel()] = True
+            matches_replayed += len(match_ids)
+
+            stored = np.array(stored_deltas, dtype=np.float32).T
+            changed = (stored != result.deltas.astype(np.float32)).any(axis=1)
+            mismatched_matches += int(changed.sum())
+
+            if write:
+                changed_rows = np.flatnonzero(changed).tolist()
+                DatabaseManager._bulk_update_match_deltas(
+                    conn,
+                    [match_ids[i] for i in changed_rows],
+                    result.deltas[changed_rows].tolist(),
+                )
+                DatabaseManager._bulk_insert_history(conn, leaderboard_id, match_ids, dates, quads, result)
+
+        return state, player_ids, played, matches_replayed, mismatched_matches
+
+    @staticmethod
+    def _replay_leaderboard(conn, leaderboard_id, write):
+        """Streams a leaderboard's matches through the batch Elo engine.
+
+        Returns the drift report; when write is True, player_stats, match deltas and
+        player_ratings_history are rewritten from the replay in the same transaction.
+        """
+        lock = " FOR UPDATE OF ps" if write and not db.is_sqlite(conn) else ""
+        stored_rows = conn.execute(text(f"""
+            SELECT ps.player_id, p.name, ps.rating, ps.games, ps.wins, ps.losses, ps.goal_diff, ps.trend
+            FROM player_stats ps
+            JOIN players p ON p.id = ps.player_id
+            WHERE ps.leaderboard_id = :l_id
+            ORDER BY ps.player_id{lock}
+        """), {"l_id": leaderboard_id}).fetchall()
+
+        if write:
+            conn.execute(
+                text("DELETE FROM player_ratings_history WHERE leaderboard_id = :l_id"),
+                {"l_id": leaderboard_id},
+            )
+            DatabaseManager._count_history_deletion(conn, leaderboard_id)
+
+        state, player_ids, _, matches_replayed, mismatched_matches = DatabaseManager._stream_replay(
+            conn, leaderboard_id,
+            state=scoring.LeaderboardState.fresh(len(stored_rows)),
+            player_ids=[r[0] for r in stored_rows],
+            # Like the MIN/MAX of record_match, the spread covers every player_stats row.
+            registered=np.ones(len(stored_rows), dtype=bool),
+            write=write,
+        )
+
+        drift = []
+        expected_rows = []
+        for i, row in enumerate(stored_rows):
+            expected = (
+                float(state.ratings[i]), int(state.games[i]), int(state.wins[i]),
+                int(state.losses[i]), int(state.goal_diff[i]), state.trends[i],
+            )
+            expected_rows.append((row[0],) + expected)
+            actual = (row[2], row[3], row[4], row[5], row[6], row[7] or "")
+            if abs(actual[0] - expected[0]) > DatabaseManager.AUDIT_RATING_TOLERANCE or actual[1:] != expected[1:]:
+                drift.append({
+                    "player_id": row[0],
+                    "name": row[1],
+                    "stored": dict(zip(("rating", "games", "wins", "losses", "goal_diff", "trend"), actual)),
+                    "expected": dict(zip(("rating", "games", "wins", "losses", "goal_diff", "trend"), expected)),
+                    "rating_drift": round(actual[0] - expected[0], 1),
+                })
+        drift.sort(key=lambda d: abs(d["rating_drift"]), reverse=True)
+
+        if write:
+            DatabaseManager._bulk_update_player_stats(conn, leaderboard_id, expected_rows)
+
+        return {
+            "leaderboard_id": leaderboard_id,
+            "matches": matches_replayed,
+            "mismatched_matches": mismatched_matches,
+            "drift": drift,
+        }
+
+    @staticmethod
+    def _replay_suffix(conn, leaderboard_id, cut_date, cut_id, removed_match_ids=()):
+        """Deletes removed_match_ids and replays only the matches at or after the cut.
+
+        Every player touched by the suffix restarts from the pre-match stats stored with
+        their first history row at or after the cut; everyone else keeps their current
+        player_stats. Every player_stats row is in the rating spread from the cut on, as
+        in record_match. Falls back to a full rebuild when that history predates the
+        stored pre-match stats.
+        """
+        sqlite = db.is_sqlite(conn)
+        stats_rows = conn.execute(text(f"""
+            SELECT player_id, rating, games, wins, losses, goal_diff
+            FROM player_stats
+            WHERE leaderboard_id = :l_id
+            ORDER BY player_id{"" if sqlite else " FOR UPDATE"}
+        """), {"l_id": leaderboard_id}).fetchall()
+        cut_params = {"l_id": leaderboard_id, "cut_date": cut_date, "cut_id": cut_id}
+        if sqlite:
+            # SQLite has no DISTINCT ON: keep the first row of each player by number.
+            pre_query = """
+                SELECT player_id, pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff FROM (
+                    SELECT h.player_id, h.pre_rating, h.pre_games, h.pre_wins, h.pre_losses, h.pre_goal_diff,
+                           ROW_NUMBER() OVER (PARTITION BY h.player_id ORDER BY m.date, m.id) AS n
+                    FROM player_ratings_history h
+                    JOIN matches m ON m.id = h.match_id
+                    WHERE m.leaderboard_id = :l_id AND (m.date, m.id) >= (:cut_date, :cut_id)
+                )
+                WHERE n = 1
+                ORDER BY player_id
+            """
+        else:
+            pre_query = """
+                SELECT DISTINCT ON (h.player_id)
+                    h.player_id, h.pre_rating, h.pre_games, h.pre_wins, h.pre_losses, h.pre_goal_diff
+                FROM player_ratings_history h
+                JOIN matches m ON m.id = h.match_id
+                WHERE m.leaderboard_id = :l_id AND (m.date, m.id) >= (:cut_date, :cut_id)
+                ORDER BY h.player_id, m.date, m.id
+            """
+        pre_rows = conn.execute(text(pre_query), cut_params).fetchall()
+
+        if removed_match_ids:
+            removed = {"ids": tuple(removed_match_ids)}
+            conn.execute(_text_in(conn, "DELETE FROM player_ratings_history WHERE match_id IN :ids", "ids"), removed)
+            conn.execute(_text_in(conn, "DELETE FROM matches WHERE id IN :ids", "ids"), removed)
+
+        if any(row[1] is None for row in pre_rows):
+            DatabaseManager._replay_leaderboard(conn, leaderboard_id, write=True)
+            return
+
+        if sqlite:
+            delete_query = """
+                DELETE FROM player_ratings_history
+                WHERE match_id IN (
+                    SELECT id FROM matches WHERE leaderboard_id = :l_id AND (date, id) >= (:cut_date, :cut_id)
+                )
+            """
+        else:
+            delete_query = """
+                DELETE FROM player_ratings_history h
+                USING matches m
+                WHERE h.match_id = m.id AND m.leaderboard_id = :l_id AND (m.date, m.id) >= (:cut_date, :cut_id)
+            """
+        deleted = conn.execute(text(delete_query), cut_params)
+        if removed_match_ids or deleted.rowcount:
+            DatabaseManager._count_history_deletion(conn, leaderboard_id)
+
+        player_ids = [r[0] for r in stats_rows]
+        index = {pid: i for i, pid in enumerate(player_ids)}
+        state = scoring.LeaderboardState.fresh(len(player_ids))
+        for row in list(stats_rows) + list(pre_rows):
+            i = index.get(row[0])
+            if i is None:
+                i = index[row[0]] = len(player_ids)
+                player_ids.append(row[0])
+                state = state.copy(len(player_ids))
+            state.ratings[i], state.games[i], state.wins[i], state.losses[i], state.goal_diff[i] = row[1:6]
+
+        state, player_ids, played, _, _ = DatabaseManager._stream_replay(
+            conn, leaderboard_id,
+            state=state,
+            player_ids=player_ids,
+            registered=np.ones(len(player_ids), dtype=bool),
+            write=True,
+            since=(cut_date, cut_id),
+        )
+
+        # Players of removed matches may no longer play in the suffix but still changed.
+        affected = sorted(played | set(r[0] for r in pre_rows))
+        if not affected:
+            return
+        index = {pid: i for i, pid in enumerate(player_ids)}
+        trends = DatabaseManager._get_trends(conn, affected, leaderboard_id)
+        DatabaseManager._bulk_update_player_stats(conn, leaderboard_id, [
+            (pid, float(state.ratings[index[pid]]), int(state.games[index[pid]]), int(state.wins[index[pid]]),
+             int(state.losses[index[pid]]), int(state.goal_diff[index[pid]]), trends.get(pid, ""))
+            for pid in affected
+        ])
+
+    @staticmethod
+    def rebuild_leaderboard(leaderboard_id: int, audit: bool = False):
+        """Recomputes a leaderboard from its full match history.
+
+        With audit=True nothing is written and the report only describes the drift
+        between player_stats and a clean replay of the matches table.
+        """
+        if audit:
+            with get_connection() as conn:
+                return DatabaseManager._replay_leaderboard(conn, leaderboard_id, write=False)
+
+        with engine.begin() as conn:
+            DatabaseManager._lock_leaderboards(conn, [leaderboard_id])
+            report = DatabaseManager._replay_leaderboard(conn, leaderboard_id, write=True)
+            DatabaseManager._bump_leaderboard_versions(conn, [leaderboard_id])
+            # The replay may have rewritten any of the history behind the rating snapshots.
+            first_date = conn.execute(
+                text("SELECT date FROM matches WHERE leaderboard_id = :l_id ORDER BY date LIMIT 1"), {"l_id": leaderboard_id}
+            ).scalar()
+            DatabaseManager._refresh_leaderboard_ranks(conn, [leaderboard_id], since=first_date)
+        return report
+
+    @staticmethod
+    def rebuild_leaderboards(leaderboard_ids=None, audit: bool = False, max_workers=None):
+        """Rebuilds (or audits) several leaderboards in parallel worker processes."""
+        if leaderboard_ids is None:
+            leaderboard_ids = [l[0] for l in DatabaseManager.get_leaderboards()]
+        if max_workers == 1 or len(leaderboard_ids) <= 1:
+            return [DatabaseManager.rebuild_leaderboard(l_id, audit) for l_id in leaderboard_ids]
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker_process) as pool:
+            return list(pool.map(DatabaseManager.rebuild_leaderboard, leaderboard_ids, [audit] * len(leaderboard_ids)))
+
+
+def _init_worker_process():
+    """Drops connections inherited from the parent so each worker opens its own."""
+    engine.dispose(close=False)
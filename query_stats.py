@@ -0,0 +1,108 @@
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from sqlalchemy import event
+
+# Latency samples kept per (method, leaderboard) for the percentiles.
+QUERY_STATS_SAMPLES = 2000
+# Local names that hold the leaderboard a DatabaseManager method works on.
+LEADERBOARD_ARGS = ("leaderboard_id", "l_id")
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def install(engine):
+    """Starts timing every statement the engine runs. Nothing is hooked until this is called.
+
+    The COPY loads of import_matches and _bulk_insert_history run on a raw DBAPI cursor,
+    which bypasses the engine events, so they are not counted.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def uninstall(engine):
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+        event.remove(engine, "handle_error", _handle_error)
+
+
+def _caller():
+    """The outermost DatabaseManager method on the stack and the leaderboard it was called for."""
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "models":
+            frames.append(frame)
+        frame = frame.f_back
+    if not frames:
+        return "(outside models)", None
+
+    # co_qualname needs Python 3.11: a method is a models frame named after a DatabaseManager attribute.
+    manager = vars(frames[0].f_globals.get("DatabaseManager", object))
+    methods = [f for f in frames if f.f_code.co_name in manager]
+    method = (methods[-1] if methods else frames[0]).f_code.co_name
+    for frame in reversed(frames):
+        for name in LEADERBOARD_ARGS:
+            value = frame.f_locals.get(name)
+            if isinstance(value, int):
+                return method, value
+    return method, None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_stats", {})[id(cursor)] = (time.perf_counter(), _caller())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started, key = conn.info["query_stats"].pop(id(cursor))
+    elapsed = time.perf_counter() - started
+    rows = max(cursor.rowcount, 0) if cursor.description is not None else 0
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            entry = _stats[key] = {
+                "statements": 0, "rows": 0, "total": 0.0, "samples": deque(maxlen=QUERY_STATS_SAMPLES),
+            }
+        entry["statements"] += 1
+        entry["rows"] += rows
+        entry["total"] += elapsed
+        entry["samples"].append(elapsed)
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time.
+    if context.connection is not None and context.execution_context is not None:
+        context.connection.info.get("query_stats", {}).pop(id(context.execution_context.cursor), None)
+
+
+def snapshot():
+    """Per (method, leaderboard) statement counts, rows returned and latencies in ms, slowest total first."""
+    with _lock:
+        entries = [(key, dict(entry, samples=np.array(entry["samples"]))) for key, entry in _stats.items()]
+    report = []
+    for (method, leaderboard_id), entry in entries:
+        p50, p95, p99 = (np.percentile(entry["samples"], [50, 95, 99]) * 1000).tolist()
+        report.append({
+            "method": method,
+            "leaderboard_id": leaderboard_id,
+            "statements": entry["statements"],
+            "rows": entry["rows"],
+            "total_ms": entry["total"] * 1000,
+            "p50_ms": p50,
+            "p95_ms": p95,
+            "p99_ms": p99,
+        })
+    return sorted(report, key=lambda r: r["total_ms"], reverse=True)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
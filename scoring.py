@@ -1,6 +1,13 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from heapq import heapify, heappop, heappush, heapreplace
+from itertools import repeat
+from datetime import datetime
+import math
+import random
+
+import numpy as np
 
 
 RECENT_DUPLICATE_MATCH_WINDOW_SECONDS = 15
@@ -102,6 +109,625 @@ def is_same_match(candidate, existing):
     return same_side or swapped_side
 
 
-def recent_duplicate_cutoff(now=None):
-    now = now or datetime.now()
-    return now - timedelta(seconds=RECENT_DUPLICATE_MATCH_WINDOW_SECONDS)
+def match_fingerprint(a1_id, a2_id, b1_id, b2_id, goals_a, goals_b):
+    """Python twin of the matches.fingerprint generated column."""
+    team_a = (min(a1_id, a2_id), max(a1_id, a2_id))
+    team_b = (min(b1_id, b2_id), max(b1_id, b2_id))
+    if team_a > team_b:
+        team_a, team_b, goals_a, goals_b = team_b, team_a, goals_b, goals_a
+    return f"{team_a[0]}-{team_a[1]}:{team_b[0]}-{team_b[1]}:{goals_a}-{goals_b}"
+
+
+def duplicate_bucket(played_at):
+    """Index of the duplicate window containing played_at, as EXTRACT(EPOCH ...) / window in Postgres."""
+    return int((played_at - datetime(1970, 1, 1)).total_seconds() // RECENT_DUPLICATE_MATCH_WINDOW_SECONDS)
+
+
+# --- Batch replay ---------------------------------------------------------
+# Replays a whole match log with the same arithmetic as calculate_match_updates.
+# Everything that does not depend on ratings (K-factors, margins, counters,
+# trends) is computed with NumPy; only the rating recurrence runs as a tight
+# Python loop so the floating point results stay bit-identical to the scalar path.
+
+TREND_LENGTH = 5
+INITIAL_RATING = 1000.0
+
+# "float32" reproduces the REAL rating columns: every stored rating comes back as the
+# shortest decimal that identifies its single-precision value, which for ratings built
+# from 0.1 deltas is simply the value rounded to one decimal.
+RATING_STORAGES = ("float64", "float32")
+
+
+def _as_real(value):
+    return float(str(np.float32(value)))
+
+
+def _grid_tenths(value):
+    """value * 10 as a whole float when value is on the 0.1 grid, NaN otherwise."""
+    tenths = math.floor(value * 10.0 + 0.5)
+    return float(tenths) if tenths / 10.0 == value else math.nan
+
+
+def stored_rating(value):
+    """A rating as read back after a round trip through a REAL column."""
+    rounded = round(value, 1)
+    return rounded if abs(value - rounded) < 1e-6 else _as_real(value)
+
+
+@dataclass
+class LeaderboardState:
+    ratings: np.ndarray
+    games: np.ndarray
+    wins: np.ndarray
+    losses: np.ndarray
+    goal_diff: np.ndarray
+    trends: list
+
+    @classmethod
+    def fresh(cls, n_players, initial_rating=INITIAL_RATING):
+        zeros = np.zeros(n_players, dtype=np.int64)
+        return cls(
+            ratings=np.full(n_players, initial_rating, dtype=np.float64),
+            games=zeros.copy(),
+            wins=zeros.copy(),
+            losses=zeros.copy(),
+            goal_diff=zeros.copy(),
+            trends=[""] * n_players,
+        )
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def copy(self, n_players=None):
+        """Returns an independent copy, padded with fresh players up to n_players."""
+        extra = LeaderboardState.fresh(max(0, (n_players or 0) - len(self)))
+        return LeaderboardState(
+            ratings=np.concatenate([np.asarray(self.ratings, dtype=np.float64), extra.ratings]),
+            games=np.concatenate([np.asarray(self.games, dtype=np.int64), extra.games]),
+            wins=np.concatenate([np.asarray(self.wins, dtype=np.int64), extra.wins]),
+            losses=np.concatenate([np.asarray(self.losses, dtype=np.int64), extra.losses]),
+            goal_diff=np.concatenate([np.asarray(self.goal_diff, dtype=np.int64), extra.goal_diff]),
+            trends=[trend or "" for trend in self.trends] + extra.trends,
+        )
+
+
+@dataclass
+class ReplayResult:
+    state: LeaderboardState
+    # Per-match arrays, aligned with the input rows, columns in a1, a2, b1, b2 order.
+    deltas: np.ndarray
+    ratings_after: np.ndarray
+    thresholds: np.ndarray
+    # Each player's stats going into the match, as stored with the rating history.
+    ratings_before: np.ndarray
+    games_before: np.ndarray
+    wins_before: np.ndarray
+    losses_before: np.ndarray
+    goal_diff_before: np.ndarray
+
+
+def replay_matches(
+    player_idx,
+    goals_a,
+    goals_b,
+    dates=None,
+    state=None,
+    n_players=None,
+    rating_diff_threshold=None,
+    registered=None,
+    eligible=None,
+    rating_storage="float64",
+):
+    """Replays a leaderboard's match log and returns the final state and per-match deltas.
+
+    ``player_idx`` is an (n, 4) array of dense player indices (a1, a2, b1, b2).
+    Matches are replayed in input order, or stably sorted by ``dates`` when given.
+    ``rating_diff_threshold`` may be a scalar, a per-match array, or None to derive
+    it like record_match does: half the rating spread of the registered players.
+    Players join the spread when they first play unless ``registered`` marks them
+    as present from the start (default: every player of a provided ``state``).
+    Players outside ``eligible`` (default: everyone) never join the spread.
+    """
+    player_idx = np.asarray(player_idx, dtype=np.int64).reshape(-1, 4)
+    goals_a = np.asarray(goals_a, dtype=np.int64).reshape(-1)
+    goals_b = np.asarray(goals_b, dtype=np.int64).reshape(-1)
+    n_matches = len(player_idx)
+    if len(goals_a) != n_matches or len(goals_b) != n_matches:
+        raise ValueError("player_idx, goals_a and goals_b must have the same length.")
+    if rating_storage not in RATING_STORAGES:
+        raise ValueError(f"Unknown rating storage: {rating_storage}")
+
+    if n_players is None:
+        n_players = len(state) if state is not None else 0
+        if n_matches:
+            n_players = max(n_players, int(player_idx.max()) + 1)
+    if n_matches and (player_idx.min() < 0 or player_idx.max() >= n_players):
+        raise ValueError("Player indices out of range.")
+    sorted_rows = np.sort(player_idx, axis=1)
+    if n_matches and (sorted_rows[:, 1:] == sorted_rows[:, :-1]).any():
+        raise ValueError("A player cannot appear twice in the same match.")
+
+    start = (state if state is not None else LeaderboardState.fresh(0)).copy(n_players)
+    if registered is None:
+        registered = np.zeros(n_players, dtype=bool)
+        if state is not None:
+            registered[:len(state)] = True
+    registered = np.asarray(registered, dtype=bool)
+    eligible = np.ones(n_players, dtype=bool) if eligible is None else np.asarray(eligible, dtype=bool)
+
+    if dates is not None:
+        order = np.argsort(np.asarray(dates), kind="stable")
+        idx, ga, gb = player_idx[order], goals_a[order], goals_b[order]
+    else:
+        order = slice(None)
+        idx, ga, gb = player_idx, goals_a, goals_b
+    a_won = ga > gb
+    a_won_list = a_won.tolist()
+
+    # Games played before each appearance, hence the K-factor of every slot.
+    flat = idx.ravel()
+    # Stable argsort is a radix sort on 16-bit keys; the order is the same either way.
+    by_player = np.argsort(flat.astype(np.uint16) if n_players <= 1 << 16 else flat, kind="stable")
+    sorted_players = flat[by_player]
+    group_starts = np.flatnonzero(np.diff(sorted_players, prepend=-1))
+    group_sizes = np.diff(np.r_[group_starts, len(flat)])
+
+    def running_totals(increments):
+        """Per-appearance sum of a player's earlier increments, in replay order."""
+        ordered = increments[by_player]
+        totals = np.cumsum(ordered) - ordered
+        totals -= np.repeat(totals[group_starts], group_sizes)
+        out = np.empty_like(totals)
+        out[by_player] = totals
+        return out
+
+    occurrence = np.empty(len(flat), dtype=np.int64)
+    occurrence[by_player] = np.arange(len(flat)) - np.repeat(group_starts, group_sizes)
+    games_before = start.games[flat] + occurrence
+
+    margin = np.abs(ga - gb)
+    m = np.where(margin <= 2, 1.0, np.where(margin <= 9, 1.0 + (margin - 2) * 0.1, 1.8))
+    k = 10.0 + (20.0 / (1.0 + (games_before / 40.0)))
+    km = (k.reshape(-1, 4) * m[:, None]).ravel().tolist()
+
+    if rating_diff_threshold is None:
+        thresholds = None
+    else:
+        thresholds = np.broadcast_to(
+            np.asarray(rating_diff_threshold, dtype=np.float64), (n_matches,)
+        )[order].tolist()
+
+    real_storage = rating_storage == "float32"
+    ratings = start.ratings.tolist()
+    if real_storage:
+        ratings = [_as_real(r) for r in ratings]
+    # Whole tenths of each rating on the 0.1 grid (NaN off it): a REAL rating plus a
+    # rounded delta is stored as (tenths + delta tenths) / 10, which is what
+    # stored_rating would return for the sum.
+    grid = [_grid_tenths(r) for r in ratings] if real_storage else None
+    dynamic = thresholds is None
+    pooled = (registered & eligible).tolist()
+    # Both ends of the rating spread come from lazy heaps of (rating, player) and
+    # (-rating, player). Each pooled player has a live entry in each, low_bound[p] and
+    # high_bound[p], that brackets its rating, so a match only pushes when a rating
+    # leaves its bracket. Superseded entries are dropped, and a loose live entry is
+    # tightened to the rating, once they reach the top. Players outside the spread
+    # have an infinite bracket.
+    low_bound = [r if p else -math.inf for r, p in zip(ratings, pooled)]
+    high_bound = [r if p else math.inf for r, p in zip(ratings, pooled)]
+    lows = [(r, p) for p, r in enumerate(ratings) if pooled[p]]
+    highs = [(-r, p) for r, p in lows]
+    heapify(lows)
+    heapify(highs)
+    heap_limit = 16 * n_players + 4096
+    # Matches where a player enters the rating spread for the first time.
+    joins = ((occurrence == 0) & ~registered[flat] & eligible[flat]).reshape(-1, 4).any(axis=1).tolist()
+
+    near_half = 0.5 - 1e-6
+
+    deltas = []
+    before = []
+    after = []
+    used_thresholds = []
+    players = iter(flat.tolist())
+    k_factors = iter(km)
+    for i1, i2, j1, j2, k1, k2, k3, k4, won, join, threshold in zip(
+        players, players, players, players, k_factors, k_factors, k_factors, k_factors,
+        a_won_list, joins, thresholds or repeat(0.0),
+    ):
+        if dynamic:
+            if join:
+                for p in (i1, i2, j1, j2):
+                    if not pooled[p] and eligible[p]:
+                        pooled[p] = True
+                        low_bound[p] = high_bound[p] = ratings[p]
+                        heappush(lows, (ratings[p], p))
+                        heappush(highs, (-ratings[p], p))
+            if lows:
+                low, p = lows[0]
+                while low != ratings[p]:
+                    if low == low_bound[p]:
+                        low_bound[p] = ratings[p]
+                        heapreplace(lows, (ratings[p], p))
+                    else:
+                        heappop(lows)
+                    low, p = lows[0]
+                high, p = highs[0]
+                while -high != ratings[p]:
+                    if -high == high_bound[p]:
+                        high_bound[p] = ratings[p]
+                        heapreplace(highs, (-ratings[p], p))
+                    else:
+                        heappop(highs)
+                    high, p = highs[0]
+                threshold = (-high - low) * 0.5
+            else:
+                # An empty spread reads as 1000/1000 in record_match.
+                threshold = 0.0
+        used_thresholds.append(threshold)
+
+        r1, r2, r3, r4 = ratings[i1], ratings[i2], ratings[j1], ratings[j2]
+        r_a = (r1 + r2) / 2.0
+        r_b = (r3 + r4) / 2.0
+        e_a = 1.0 / (1.0 + 10 ** ((r_b - r_a) / 400.0))
+        s_a = 1.0 if won else 0.0
+
+        multiplier = 1.0
+        team_diff = r_a - r_b
+        if abs(team_diff) > threshold:
+            multiplier = 0.5 if (team_diff > 0) == won else 1.5
+
+        score_a = s_a - e_a
+        score_b = (1 - s_a) - (1 - e_a)
+        # round(x, 1) as whole tenths n and n / 10, the double nearest to the rounded
+        # decimal. Within float noise of a half tenth round() settles it exactly, and
+        # a zero keeps the sign of x as round() does.
+        t1 = k1 * multiplier * score_a * 10.0
+        t2 = k2 * multiplier * score_a * 10.0
+        t3 = k3 * multiplier * score_b * 10.0
+        t4 = k4 * multiplier * score_b * 10.0
+        n1 = (t1 + 0.5) // 1.0
+        n2 = (t2 + 0.5) // 1.0
+        n3 = (t3 + 0.5) // 1.0
+        n4 = (t4 + 0.5) // 1.0
+        if (abs(t1 - n1) > near_half or abs(t2 - n2) > near_half
+                or abs(t3 - n3) > near_half or abs(t4 - n4) > near_half):
+            d1 = round(k1 * multiplier * score_a, 1)
+            d2 = round(k2 * multiplier * score_a, 1)
+            d3 = round(k3 * multiplier * score_b, 1)
+            d4 = round(k4 * multiplier * score_b, 1)
+            n1, n2, n3, n4 = round(d1 * 10.0), round(d2 * 10.0), round(d3 * 10.0), round(d4 * 10.0)
+        else:
+            d1 = (n1 or t1 * 0.0) / 10.0
+            d2 = (n2 or t2 * 0.0) / 10.0
+            d3 = (n3 or t3 * 0.0) / 10.0
+            d4 = (n4 or t4 * 0.0) / 10.0
+        deltas += (d1, d2, d3, d4)
+
+        before += (r1, r2, r3, r4)
+        new = (r1 + d1, r2 + d2, r3 + d3, r4 + d4)
+        after += new
+        if real_storage:
+            g1, g2, g3, g4 = grid[i1] + n1, grid[i2] + n2, grid[j1] + n3, grid[j2] + n4
+            grid[i1], grid[i2], grid[j1], grid[j2] = g1, g2, g3, g4
+            if g1 + g2 + g3 + g4 == g1 + g2 + g3 + g4:
+                new = (g1 / 10.0, g2 / 10.0, g3 / 10.0, g4 / 10.0)
+            else:
+                new = tuple(stored_rating(value) for value in new)
+                for p, value in zip((i1, i2, j1, j2), new):
+                    grid[p] = _grid_tenths(value)
+        ratings[i1], ratings[i2], ratings[j1], ratings[j2] = new
+
+        if dynamic:
+            v1, v2, v3, v4 = new
+            if not (low_bound[i1] <= v1 <= high_bound[i1] and low_bound[i2] <= v2 <= high_bound[i2]
+                    and low_bound[j1] <= v3 <= high_bound[j1] and low_bound[j2] <= v4 <= high_bound[j2]):
+                for p, value in zip((i1, i2, j1, j2), new):
+                    if value > high_bound[p]:
+                        high_bound[p] = value
+                        heappush(highs, (-value, p))
+                    elif value < low_bound[p]:
+                        low_bound[p] = value
+                        heappush(lows, (value, p))
+                if len(lows) + len(highs) > heap_limit:
+                    low_bound = [r if p else -math.inf for r, p in zip(ratings, pooled)]
+                    high_bound = [r if p else math.inf for r, p in zip(ratings, pooled)]
+                    lows = [(r, p) for p, r in enumerate(ratings) if pooled[p]]
+                    highs = [(-r, p) for r, p in lows]
+                    heapify(lows)
+                    heapify(highs)
+
+    final = LeaderboardState(
+        ratings=np.array(ratings, dtype=np.float64),
+        games=start.games + np.bincount(flat, minlength=n_players),
+        wins=start.wins.copy(),
+        losses=start.losses.copy(),
+        goal_diff=start.goal_diff.copy(),
+        trends=list(start.trends),
+    )
+    slot_won = np.repeat(a_won, 4).reshape(-1, 4)
+    slot_won[:, 2:] = ~slot_won[:, 2:]
+    slot_won = slot_won.ravel()
+    slot_lost = (~slot_won).astype(np.int64)
+    gd_a = ga - gb
+    slot_gd = np.stack([gd_a, gd_a, -gd_a, -gd_a], axis=1).ravel()
+    final.wins += np.bincount(flat, weights=slot_won, minlength=n_players).astype(np.int64)
+    final.losses += np.bincount(flat, weights=slot_lost, minlength=n_players).astype(np.int64)
+    final.goal_diff += np.bincount(flat, weights=slot_gd, minlength=n_players).astype(np.int64)
+    wins_earlier = running_totals(slot_won.astype(np.int64))
+    wins_before = start.wins[flat] + wins_earlier
+    losses_before = start.losses[flat] + occurrence - wins_earlier
+    goal_diff_before = start.goal_diff[flat] + running_totals(slot_gd)
+
+    # Newest results first, keeping the tail of the previous trend like the scalar path.
+    # Only each player's last TREND_LENGTH appearances are read.
+    last = np.arange(len(flat)) >= np.repeat(group_starts + group_sizes - TREND_LENGTH, group_sizes)
+    results = np.where(slot_won[by_player[last]], "W", "L").tolist()
+    end = 0
+    for player, size in zip(sorted_players[group_starts].tolist(), np.minimum(group_sizes, TREND_LENGTH).tolist()):
+        parts = results[end:end + size][::-1] + final.trends[player].split()
+        final.trends[player] = " ".join(parts[:TREND_LENGTH])
+        end += size
+
+    inverse = np.argsort(order) if dates is not None else order
+
+    def per_match(values, dtype):
+        return np.asarray(values, dtype=dtype).reshape(-1, 4)[inverse]
+
+    return ReplayResult(
+        state=final,
+        deltas=per_match(deltas, np.float64),
+        ratings_after=per_match(after, np.float64),
+        thresholds=np.array(used_thresholds, dtype=np.float64)[inverse],
+        ratings_before=per_match(before, np.float64),
+        games_before=per_match(games_before, np.int64),
+        wins_before=per_match(wins_before, np.int64),
+        losses_before=per_match(losses_before, np.int64),
+        goal_diff_before=per_match(goal_diff_before, np.int64),
+    )
+
+
+# --- Matchmaking ----------------------------------------------------------
+# The C(n - 1, 3) player combinations around a target, each with its three team
+# splits, are exactly "every partner" x "every unordered pair of opponents", so all
+# candidates are scored as a (partners x opponent pairs) matrix, built a block of
+# partners at a time.
+
+RIVAL_RATING_WINDOW = 150
+# Partners x opposing pairs scored per block by rank_matchups (2 MiB per float64 temporary).
+MATCHUP_BLOCK_CELLS = 1 << 18
+
+
+def _top_k_indices(score, k):
+    """Positions of the k highest scores, best first; equal scores keep their order."""
+    if len(score) > k:
+        kth = np.partition(score, len(score) - k)[len(score) - k]
+        candidates = np.flatnonzero(score >= kth)
+    else:
+        candidates = np.arange(len(score))
+    return candidates[np.lexsort((candidates, -score[candidates]))][:k]
+
+
+def rank_matchups(ratings, games, target, rivals, top_k=5):
+    """Returns the top_k matchups for the player at position target of the pool.
+
+    ratings, games and the boolean rivals mask are indexed by pool position. Each
+    result is (partner, opponent_1, opponent_2, win_prob, est_delta, score), with
+    positions into the pool, best score first.
+
+    Partners are scored against every opposing pair a block at a time, keeping a
+    running top_k, so memory stays quadratic in the pool size.
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    rivals = np.asarray(rivals, dtype=bool)
+    if len(ratings) < 4 or top_k < 1:
+        return []
+
+    others = np.delete(np.arange(len(ratings)), target)
+    first, second = np.triu_indices(len(others), 1)
+    opponent_1, opponent_2 = others[first], others[second]
+    r_b = ((ratings[opponent_1] + ratings[opponent_2]) / 2.0)[None, :]
+    rival_opponents = (rivals[opponent_1].astype(np.float64) + rivals[opponent_2])[None, :]
+    k_factor = get_k_factor(games[target])
+    block = max(1, MATCHUP_BLOCK_CELLS // len(opponent_1))
+
+    # Running top_k as flat indices into the partners x opposing pairs matrix.
+    best_flat = np.empty(0, dtype=np.int64)
+    best_score, best_win_prob, best_delta = (np.empty(0) for _ in range(3))
+    for start in range(0, len(others), block):
+        partner = others[start:start + block, None]
+        r_a = (ratings[target] + ratings[partner]) / 2.0
+        win_prob = 1.0 / (1.0 + 10 ** ((r_b - r_a) / 400.0))
+        # Potential gain for a standard 10-8 win (margin 2).
+        est_delta = k_factor * 1.0 * (1.0 - win_prob)
+        # Rivals are worth beating, but a rival partner gains points too.
+        rival_impact = rival_opponents - 0.5 * rivals[partner]
+
+        score = (win_prob * 10) + (est_delta * 0.5) + (rival_impact * 5)
+        valid = (partner != opponent_1) & (partner != opponent_2)
+        score = np.where(valid, score, -np.inf).ravel()
+        kept = np.sort(_top_k_indices(score, top_k))
+        best_flat = np.r_[best_flat, kept + start * len(opponent_1)]
+        best_score = np.r_[best_score, score[kept]]
+        best_win_prob = np.r_[best_win_prob, win_prob.ravel()[kept]]
+        best_delta = np.r_[best_delta, est_delta.ravel()[kept]]
+        # Candidates stay in flat order, so ties break on the flat index as in a single block.
+        keep = np.sort(_top_k_indices(best_score, top_k))
+        best_flat, best_score = best_flat[keep], best_score[keep]
+        best_win_prob, best_delta = best_win_prob[keep], best_delta[keep]
+
+    order = _top_k_indices(best_score, top_k)
+    order = order[np.isfinite(best_score[order])]
+    rows, cols = np.divmod(best_flat[order], len(opponent_1))
+    return [
+        (int(others[row]), int(opponent_1[col]), int(opponent_2[col]),
+         float(best_win_prob[i]), float(best_delta[i]), float(best_score[i]))
+        for row, col, i in zip(rows, cols, order)
+    ]
+
+
+# --- Calendar -------------------------------------------------------------
+# A schedule is a list of (a1, a2, b1, b2) pool positions. Its cost adds up squared
+# appearance counts (overall and per day), squared partner/opponent pair counts
+# (recent history included) and the squared distance of each expected score from
+# 0.5. Squared counts make every extra repeat cost more than the last, so the local
+# search spreads appearances and pairings as evenly as the pool allows.
+
+CALENDAR_WEIGHTS = {
+    "appearance": 4.0,
+    "same_day": 8.0,
+    "partner": 1.0,
+    "opponent": 0.5,
+    "balance": 20.0,
+}
+CALENDAR_ITERATIONS_PER_MATCH = 300
+
+
+def pair_counts(quads, n_players):
+    """Returns symmetric (partner, opponent) count matrices for (a1, a2, b1, b2) rows."""
+    partner = np.zeros((n_players, n_players), dtype=np.int64)
+    opponent = np.zeros((n_players, n_players), dtype=np.int64)
+    quads = np.asarray(quads, dtype=np.int64).reshape(-1, 4)
+    for i, j in ((0, 1), (2, 3)):
+        np.add.at(partner, (quads[:, i], quads[:, j]), 1)
+        np.add.at(partner, (quads[:, j], quads[:, i]), 1)
+    for i in (0, 1):
+        for j in (2, 3):
+            np.add.at(opponent, (quads[:, i], quads[:, j]), 1)
+            np.add.at(opponent, (quads[:, j], quads[:, i]), 1)
+    return partner, opponent
+
+
+class _CalendarCost:
+    """Count matrices of a schedule plus the marginal cost of adding one match."""
+
+    def __init__(self, ratings, matches_per_day, n_days, partner, opponent, weights):
+        n_players = len(ratings)
+        self.ratings = [float(r) for r in ratings]
+        self.matches_per_day = matches_per_day
+        self.weights = weights
+        self.appearances = [0] * n_players
+        self.daily = [[0] * n_players for _ in range(n_days)]
+        self.partner = partner.tolist()
+        self.opponent = opponent.tolist()
+
+    def _pairs(self, quad):
+        a1, a2, b1, b2 = quad
+        return ((a1, a2), (b1, b2)), ((a1, b1), (a1, b2), (a2, b1), (a2, b2))
+
+    def add_cost(self, slot, quad):
+        """Cost increase of adding quad at slot, given the current counts."""
+        w = self.weights
+        daily = self.daily[slot // self.matches_per_day]
+        partners, opponents = self._pairs(quad)
+        cost = 0.0
+        for p in quad:
+            cost += w["appearance"] * (2 * self.appearances[p] + 1)
+            cost += w["same_day"] * (2 * daily[p] + 1)
+        for p, q in partners:
+            cost += w["partner"] * (2 * self.partner[p][q] + 1)
+        for p, q in opponents:
+            cost += w["opponent"] * (2 * self.opponent[p][q] + 1)
+        r = self.ratings
+        e_a = expected_score((r[quad[0]] + r[quad[1]]) / 2.0, (r[quad[2]] + r[quad[3]]) / 2.0)
+        return cost + w["balance"] * (e_a - 0.5) ** 2
+
+    def apply(self, slot, quad, step):
+        daily = self.daily[slot // self.matches_per_day]
+        partners, opponents = self._pairs(quad)
+        for p in quad:
+            self.appearances[p] += step
+            daily[p] += step
+        for p, q in partners:
+            self.partner[p][q] += step
+            self.partner[q][p] += step
+        for p, q in opponents:
+            self.opponent[p][q] += step
+            self.opponent[q][p] += step
+
+
+def schedule_matches(
+    ratings,
+    n_matches,
+    matches_per_day,
+    partner_counts=None,
+    opponent_counts=None,
+    seed=None,
+    iterations=None,
+    weights=None,
+):
+    """Builds a calendar of n_matches as (a1, a2, b1, b2) positions into ratings.
+
+    partner_counts and opponent_counts (see pair_counts) carry recent history, so
+    pairings that already happened are avoided too. A greedy fill is improved by
+    hill climbing: a random slot gets a different player or a different team split,
+    and the move is kept unless it raises the cost.
+    """
+    n_players = len(ratings)
+    if n_players < 4 or n_matches < 1:
+        return []
+    if partner_counts is None or opponent_counts is None:
+        partner_counts, opponent_counts = pair_counts([], n_players)
+    rng = random.Random(seed)
+    n_days = -(-n_matches // matches_per_day)
+    state = _CalendarCost(
+        ratings, matches_per_day, n_days, partner_counts, opponent_counts, {**CALENDAR_WEIGHTS, **(weights or {})}
+    )
+
+    schedule = []
+    for slot in range(n_matches):
+        # Least scheduled players first, random among ties.
+        order = sorted(range(n_players), key=lambda p: (state.appearances[p], rng.random()))
+        a, b, c, d = order[:4]
+        quad = min(((a, b, c, d), (a, c, b, d), (a, d, b, c)), key=lambda q: state.add_cost(slot, q))
+        state.apply(slot, quad, 1)
+        schedule.append(quad)
+
+    if iterations is None:
+        iterations = CALENDAR_ITERATIONS_PER_MATCH * n_matches
+    for _ in range(iterations):
+        slot = rng.randrange(n_matches)
+        quad = schedule[slot]
+        if rng.random() < 0.75:
+            candidate = list(quad)
+            candidate[rng.randrange(4)] = rng.randrange(n_players)
+            if len(set(candidate)) < 4:
+                continue
+            candidate = tuple(candidate)
+        else:
+            a, b, c, d = quad
+            candidate = rng.choice(((a, c, b, d), (a, d, b, c)))
+        state.apply(slot, quad, -1)
+        if state.add_cost(slot, candidate) <= state.add_cost(slot, quad):
+            quad = schedule[slot] = candidate
+        state.apply(slot, quad, 1)
+    return schedule
+
+
+# --- Chart downsampling ----------------------------------------------------
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of n_out points that keep the shape of (x, y).
+
+    The first and last points are always kept; each bucket in between keeps the point
+    forming the largest triangle with the previously kept point and the next bucket's mean.
+    """
+    n = len(x)
+    if n <= n_out:
+        return np.arange(n)
+    n_out = max(n_out, 3)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    bounds = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        next_lo, next_hi = (bounds[i + 1], bounds[i + 2]) if i + 2 < len(bounds) else (n - 1, n)
+        avg_x, avg_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
@@ -0,0 +1,111 @@
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlite_fixture import SQLiteTestCase
+import scoring
+
+
+class TestScheduleMatches(unittest.TestCase):
+
+    def test_balances_appearances_and_pairings(self):
+        ratings = [1000.0 + 15 * (i % 7) for i in range(20)]
+
+        schedule = scoring.schedule_matches(ratings, 21, 3, seed=7)
+
+        self.assertEqual(len(schedule), 21)
+        for quad in schedule:
+            self.assertEqual(len(set(quad)), 4)
+        appearances = Counter(p for quad in schedule for p in quad)
+        self.assertLessEqual(max(appearances.values()) - min(appearances[p] for p in range(20)), 1)
+        partner, opponent = scoring.pair_counts(schedule, 20)
+        self.assertLessEqual(partner.max(), 1)
+        self.assertLessEqual(opponent.max(), 1)
+        for day in range(7):
+            day_players = [p for quad in schedule[day * 3:(day + 1) * 3] for p in quad]
+            self.assertEqual(len(day_players), len(set(day_players)))
+
+    def test_avoids_recent_partners(self):
+        # Everyone has recently partnered their neighbour.
+        history = [(i, i + 1, (i + 2) % 12, (i + 3) % 12) for i in range(0, 12, 2)]
+        partner, opponent = scoring.pair_counts(history, 12)
+
+        schedule = scoring.schedule_matches([1000.0] * 12, 6, 3, partner, opponent, seed=3)
+
+        repeated = sum(partner[a, b] + partner[c, d] for a, b, c, d in schedule)
+        self.assertEqual(repeated, 0)
+
+    def test_prefers_balanced_teams(self):
+        ratings = [1400.0, 1300.0, 700.0, 600.0]
+
+        (a1, a2, b1, b2), = scoring.schedule_matches(ratings, 1, 1, seed=1)
+
+        self.assertEqual({frozenset((a1, a2)), frozenset((b1, b2))}, {frozenset((0, 3)), frozenset((1, 2))})
+
+    def test_pair_counts_are_symmetric(self):
+        partner, opponent = scoring.pair_counts([(0, 1, 2, 3), (0, 2, 1, 3)], 4)
+
+        self.assertEqual(partner[0, 1], 1)
+        self.assertEqual(partner[1, 0], 1)
+        self.assertEqual(partner[0, 2], 1)
+        self.assertEqual(opponent[0, 2], 1)
+        self.assertEqual(opponent[0, 3], 2)
+        self.assertEqual(opponent[3, 0], 2)
+
+
+class TestGenerateCalendar(SQLiteTestCase):
+
+    def test_inserts_schedule_with_player_ids(self):
+        for i in range(8):
+            self.DM.add_player(f"P{i}", 1)
+        self.DM.record_match("P0", "P1", "P2", "P3", 10, 4, 1, played_at=datetime.now() - timedelta(days=1))
+        player_ids = {self.player_id(f"P{i}") for i in range(8)}
+        recent_pairs = [{self.player_id("P0"), self.player_id("P1")}, {self.player_id("P2"), self.player_id("P3")}]
+
+        read_conns = []
+
+        def connect():
+            read_conns.append(self.engine.connect())
+            return read_conns[-1]
+
+        schedule_matches = scoring.schedule_matches
+
+        def schedule_outside_transactions(*args, **kwargs):
+            # The read connections are back in the pool and the write transaction not yet open.
+            self.assertTrue(read_conns)
+            self.assertTrue(all(conn.closed for conn in read_conns))
+            begin.assert_not_called()
+            return schedule_matches(*args, **kwargs)
+
+        with patch("models.get_connection", side_effect=connect), \
+                patch.object(self.engine, "begin", wraps=self.engine.begin) as begin, \
+                patch("models.DatabaseManager._lock_leaderboards", wraps=self.DM._lock_leaderboards) as lock, \
+                patch("models.scoring.schedule_matches", side_effect=schedule_outside_transactions):
+            self.assertTrue(self.DM.generate_calendar(1, matches_per_day=2, days=3, seed=5))
+
+        inserted = self.rows("SELECT date, a1_id, a2_id, b1_id, b2_id, leaderboard_id FROM future_matches ORDER BY date, id")
+        self.assertEqual(len(inserted), 6)
+        for row in inserted:
+            self.assertEqual(len(set(row[1:5])), 4)
+            self.assertLessEqual(set(row[1:5]), player_ids)
+            self.assertEqual(row[5], 1)
+        self.assertEqual(inserted[1][0] - inserted[0][0], timedelta(minutes=30))
+        self.assertEqual(inserted[2][0] - inserted[0][0], timedelta(days=1))
+        self.assertNotIn(set(inserted[0][1:3]), recent_pairs)
+        self.assertEqual(lock.call_args[0][1], [1])
+        self.assertEqual(len(self.DM.get_future_matches(1)), 6)
+
+        # A new calendar replaces the old one whole.
+        self.assertTrue(self.DM.generate_calendar(1, matches_per_day=1, days=2, seed=6))
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM future_matches WHERE leaderboard_id = 1"), 2)
+
+    def test_needs_four_players(self):
+        for name in ("A", "B", "C"):
+            self.DM.add_player(name, 1)
+
+        self.assertFalse(self.DM.generate_calendar(1))
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM future_matches"), 0)
+
+if __name__ == "__main__":
+    unittest.main()
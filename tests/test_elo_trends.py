@@ -0,0 +1,147 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from sqlite_fixture import SQLiteTestCase, models
+import scoring
+
+
+START = datetime(2025, 1, 1, 18, 0)
+
+
+class TestLttb(unittest.TestCase):
+
+    def test_keeps_endpoints_and_spikes(self):
+        x = np.arange(1000)
+        y = np.full(1000, 1000.0)
+        y[400] = 1300.0
+        y[700] = 700.0
+
+        selected = scoring.lttb_indices(x, y, 20)
+
+        self.assertEqual(len(selected), 20)
+        self.assertEqual(selected[0], 0)
+        self.assertEqual(selected[-1], 999)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertIn(400, selected)
+        self.assertIn(700, selected)
+
+    def test_short_series_is_untouched(self):
+        np.testing.assert_array_equal(scoring.lttb_indices([1, 2, 3], [5, 6, 7], 10), [0, 1, 2])
+
+
+class TestEloTrendSeries(unittest.TestCase):
+
+    def setUp(self):
+        connection = patch("models.get_connection")
+        connection.start()
+        self.addCleanup(connection.stop)
+
+    def history(self, points_per_player, freq="h"):
+        frames = []
+        for player, n in points_per_player.items():
+            frames.append(pd.DataFrame({
+                "created_at": pd.date_range("2025-01-01", periods=n, freq=freq),
+                "player": player,
+                "rating": 1000.0 + np.sin(np.arange(n) / 10.0) * 50,
+            }))
+        df = pd.concat(frames, ignore_index=True).sort_values("created_at", kind="stable", ignore_index=True)
+        return df.assign(id=np.arange(1, len(df) + 1))
+
+    @patch("models.DatabaseManager._load_elo_history")
+    def test_auto_splits_point_budget_between_players(self, mock_load):
+        mock_load.return_value = self.history({"A": 3000, "B": 1000})
+
+        df = models.DatabaseManager.get_elo_trend_series(1, "auto", max_points=400)
+
+        counts = df["player"].value_counts()
+        self.assertEqual(counts["A"], 300)
+        self.assertEqual(counts["B"], 100)
+        self.assertTrue(df["created_at"].is_monotonic_increasing)
+        self.assertEqual(list(df.columns), ["created_at", "player", "rating"])
+
+    @patch("models.DatabaseManager._load_elo_history")
+    def test_daily_keeps_last_rating_per_day_since_date(self, mock_load):
+        mock_load.return_value = self.history({"A": 72, "B": 30}, freq="h")
+
+        df = models.DatabaseManager.get_elo_trend_series(1, "daily", since=pd.Timestamp("2025-01-02"))
+
+        self.assertEqual(list(df["player"]), ["B", "A", "A"])
+        self.assertEqual(list(df["created_at"]), [
+            pd.Timestamp("2025-01-02 05:00"), pd.Timestamp("2025-01-02 23:00"), pd.Timestamp("2025-01-03 23:00"),
+        ])
+
+    @patch("models.DatabaseManager._load_elo_history")
+    def test_full_returns_every_row(self, mock_load):
+        mock_load.return_value = self.history({"A": 3000})
+
+        df = models.DatabaseManager.get_elo_trend_series(1, "full", max_points=100)
+
+        self.assertEqual(len(df), 3000)
+
+    def test_unknown_resolution(self):
+        with self.assertRaises(ValueError):
+            models.DatabaseManager.get_elo_trend_series(1, "weekly")
+
+
+class TestIncrementalEloHistory(SQLiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        read_sql = patch("models.pd.read_sql", wraps=pd.read_sql)
+        self.read_sql = read_sql.start()
+        self.addCleanup(read_sql.stop)
+
+    def record(self, played_at, goals_b=4):
+        self.DM.record_match("A", "B", "C", "D", 10, goals_b, 1, played_at=played_at)
+        return self.scalar("SELECT MAX(id) FROM player_ratings_history")
+
+    def last_ids(self):
+        return [c[1]["params"]["last_id"] for c in self.read_sql.call_args_list]
+
+    def test_fetches_only_rows_after_last_seen_id(self):
+        first_id = self.record(START)
+        first = models.DatabaseManager._load_elo_history(1)
+        second_id = self.record(START + timedelta(hours=1))
+        second = models.DatabaseManager._load_elo_history(1)
+        third = models.DatabaseManager._load_elo_history(1)
+
+        self.assertEqual(len(first), 4)
+        self.assertEqual(list(second["id"]), [r[0] for r in self.rows("SELECT id FROM player_ratings_history ORDER BY id")])
+        self.assertIs(third, second)
+        self.assertEqual(self.last_ids(), [0, first_id, second_id])
+
+    def test_reloads_after_deletion(self):
+        self.record(START)
+        self.record(START + timedelta(hours=1))
+        models.DatabaseManager._load_elo_history(1)
+        self.DM.delete_match(self.scalar("SELECT MAX(id) FROM matches"))
+
+        reloaded = models.DatabaseManager._load_elo_history(1)
+
+        self.assertEqual(list(reloaded["id"]), [r[0] for r in self.rows("SELECT id FROM player_ratings_history ORDER BY id")])
+        self.assertEqual(len(reloaded), 4)
+        self.assertEqual(self.last_ids()[-1], 0)
+
+    def test_back_dated_rows_are_sorted_in(self):
+        first_id = self.record(START + timedelta(days=1))
+        models.DatabaseManager._load_elo_history(1)
+        self.record(START + timedelta(days=2))
+        # New rows dated before the loaded ones, as from a writer whose clock was behind.
+        with self.engine.begin() as conn:
+            conn.execute(text("UPDATE player_ratings_history SET created_at = :d WHERE id > :id"), {"d": START, "id": first_id})
+
+        frame = models.DatabaseManager._load_elo_history(1)
+
+        self.assertEqual(self.last_ids(), [0, first_id])
+        self.assertEqual(list(frame["created_at"]), [START] * 4 + [START + timedelta(days=1)] * 4)
+        self.assertEqual(list(frame["id"]), [r[0] for r in self.rows(
+            "SELECT id FROM player_ratings_history ORDER BY created_at, id"
+        )])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlite_fixture import SQLiteTestCase
+
+
+NOW = datetime(2026, 1, 10, 18, 0)
+
+
+class TestMatchHistoryPages(SQLiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        page_size = patch("models.DatabaseManager.MATCH_HISTORY_PAGE_SIZE", 2)
+        page_size.start()
+        self.addCleanup(page_size.stop)
+        # Two matches share a date, so the cursor has to break the tie by id.
+        for i, (match, played_at) in enumerate([
+            (("A1", "A2", "B1", "B2", 10, 8), NOW - timedelta(days=2)),
+            (("A1", "B1", "A2", "B2", 10, 4), NOW - timedelta(days=1)),
+            (("C1", "A2", "B1", "B2", 6, 10), NOW - timedelta(days=1)),
+            (("A1", "A2", "C1", "B2", 10, 7), NOW),
+        ]):
+            self.DM.record_match(*match, 1, played_at=played_at)
+        self.DM.record_match("A1", "A2", "B1", "B2", 10, 8, 2, played_at=NOW)
+        self.ids = [r[0] for r in self.rows("SELECT id FROM matches WHERE leaderboard_id = 1 ORDER BY id")]
+
+    def pages(self, player_id=None):
+        pages, cursor = [], None
+        while True:
+            page, cursor = self.DM.get_match_history_page(1, player_id, cursor)
+            pages.append([row[13] for row in page])
+            if cursor is None:
+                return pages
+
+    def test_full_page_returns_cursor_of_last_row(self):
+        page, cursor = self.DM.get_match_history_page(1)
+
+        self.assertEqual(page[0][:7], (NOW, "A1", "A2", "C1", "B2", 10, 7))
+        self.assertEqual(page[0][13], self.ids[3])
+        self.assertEqual(cursor, (NOW - timedelta(days=1), self.ids[2]))
+        self.assertEqual(self.pages(), [[self.ids[3], self.ids[2]], [self.ids[1], self.ids[0]], []])
+
+    def test_next_page_seeks_past_cursor(self):
+        c1 = self.player_id("C1")
+
+        page, next_cursor = self.DM.get_match_history_page(1, c1, (NOW - timedelta(days=1), self.ids[2] + 1))
+
+        self.assertEqual([row[13] for row in page], [self.ids[2]])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(self.pages(c1), [[self.ids[3], self.ids[2]], []])
+        self.assertEqual(self.pages(self.player_id("B1")), [[self.ids[2], self.ids[1]], [self.ids[0]]])
+
+
+if __name__ == "__main__":
+    unittest.main()
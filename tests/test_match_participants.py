@@ -0,0 +1,82 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlite_fixture import SQLiteTestCase, db
+
+
+START = datetime(2024, 5, 1, 18, 0)
+MATCHES = [
+    ("A1", "A2", "B1", "B2", 10, 8),
+    ("A1", "B1", "A2", "B2", 6, 10),
+    ("A1", "C1", "A2", "B1", 10, 3),
+    ("A2", "B1", "A1", "B2", 10, 8),
+    ("A1", "A2", "B1", "B2", 2, 10),
+    ("B1", "A1", "A2", "C1", 10, 5),
+    ("A1", "B2", "B1", "A2", 10, 7),
+]
+
+
+class TestMatchParticipants(SQLiteTestCase):
+
+    def test_insert_sql_covers_both_sides(self):
+        sql = " ".join(db.insert_match_participants_sql("inserted", "WHERE m.id IN :ids").split())
+
+        self.assertIn("INSERT INTO match_participants (match_id, player_id, leaderboard_id, side, date, won)", sql)
+        self.assertIn("FROM inserted m", sql)
+        self.assertIn("(m.a1_id, 'A'), (m.a2_id, 'A'), (m.b1_id, 'B'), (m.b2_id, 'B')", sql)
+        self.assertTrue(sql.endswith("WHERE m.id IN :ids"))
+
+    def record(self, matches, first=0):
+        for i, match in enumerate(matches, first):
+            self.DM.record_match(*match, 1, played_at=START + timedelta(minutes=10 * i))
+        return [r[0] for r in self.rows("SELECT id FROM matches ORDER BY date, id")]
+
+    def test_record_match_adds_participants(self):
+        match_id = self.record(MATCHES[:1])[0]
+
+        self.assertEqual(
+            self.rows("SELECT player_id, leaderboard_id, side, won FROM match_participants WHERE match_id = :mid ORDER BY 1", mid=match_id),
+            [(self.player_id("A1"), 1, "A", 1), (self.player_id("A2"), 1, "A", 1),
+             (self.player_id("B1"), 1, "B", 0), (self.player_id("B2"), 1, "B", 0)],
+        )
+        self.assertEqual(self.scalar("SELECT date FROM match_participants WHERE match_id = :mid LIMIT 1", mid=match_id), START)
+
+    def test_player_history_uses_participants_index(self):
+        self.record(MATCHES)
+        self.DM.record_match("A1", "A2", "B1", "B2", 10, 8, 2, played_at=START)
+
+        history = self.DM.get_match_history(20, player_id=self.player_id("C1"), leaderboard_id=1)
+
+        expected = [MATCHES[2], MATCHES[5]]
+        self.assertEqual([tuple(row[1:7]) for row in history], expected[::-1])
+        self.assertEqual([row[0] for row in history], sorted((row[0] for row in history), reverse=True))
+        self.assertEqual(len(self.DM.get_match_history(3, player_id=self.player_id("B2"), leaderboard_id=1)), 3)
+
+    def test_trends_read_last_five_participations(self):
+        ids = self.record(MATCHES[:-1])
+        trend = self.scalar("SELECT trend FROM player_stats WHERE player_id = :pid AND leaderboard_id = 1", pid=self.player_id("A1"))
+        ids = self.record(MATCHES[-1:], first=len(MATCHES) - 1)
+
+        with self.engine.connect() as conn:
+            trends = self.DM._get_trends(conn, [self.player_id("A1"), self.player_id("B2")], 1, exclude_match_ids=[ids[-1]])
+            latest = self.DM._get_trends(conn, [self.player_id("A1")], 1)
+
+        self.assertEqual(trend, "W L L W L")
+        self.assertEqual(trends[self.player_id("A1")], trend)
+        self.assertEqual(trends[self.player_id("B2")], "W L W L")
+        self.assertEqual(latest, {self.player_id("A1"): "W W L L W"})
+
+    def test_head_to_head(self):
+        self.record(MATCHES)
+
+        result = self.DM.get_head_to_head(self.player_id("A1"), self.player_id("A2"), 1)
+
+        self.assertEqual(result, {"together": 2, "together_wins": 1, "against": 5, "against_wins": 3})
+        self.assertEqual(
+            self.DM.get_head_to_head(self.player_id("A1"), self.player_id("A2"), 2),
+            {"together": 0, "together_wins": 0, "against": 0, "against_wins": 0},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import text
+
+from sqlite_fixture import SQLiteTestCase, models
+
+
+class TestRatingBounds(SQLiteTestCase):
+
+    def bounds(self, leaderboard_id):
+        with self.engine.connect() as conn:
+            return models.DatabaseManager._get_rating_bounds(conn, leaderboard_id)
+
+    def rate(self, ratings):
+        for name in ratings:
+            self.DM.add_player(name, 1)
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE player_stats SET rating = :r
+                WHERE leaderboard_id = 1 AND player_id = (SELECT id FROM players WHERE name = :name)
+            """), [{"r": rating, "name": name} for name, rating in ratings.items()])
+
+    @patch("db.RATING_BOUNDS_ACTIVE_ONLY", False)
+    def test_reads_all_players_by_default(self):
+        self.rate({"A": 1100.0, "B": 950.0, "C": 1020.0})
+        self.DM.toggle_player_status(self.player_id("A"), False)
+
+        self.assertEqual(self.bounds(1), (1100.0, 950.0))
+
+    @patch("db.RATING_BOUNDS_ACTIVE_ONLY", True)
+    def test_active_only_walks_both_ends_of_the_rating_index(self):
+        self.rate({"A": 1100.0, "B": 950.0, "C": 1080.0, "D": 990.0})
+        self.DM.toggle_player_status(self.player_id("A"), False)
+        self.DM.toggle_player_status(self.player_id("B"), False)
+
+        self.assertEqual(self.bounds(1), (1080.0, 990.0))
+
+    @patch("db.RATING_BOUNDS_ACTIVE_ONLY", True)
+    def test_no_rated_players_defaults_to_flat_spread(self):
+        self.rate({"A": 1100.0})
+        self.DM.toggle_player_status(self.player_id("A"), False)
+
+        self.assertEqual(self.bounds(1), (1000, 1000))
+        self.assertEqual(self.bounds(2), (1000, 1000))
+
+    @patch("db.RATING_BOUNDS_ACTIVE_ONLY", True)
+    @patch("db.SERVER_SIDE_ELO", True)
+    @patch("models.engine")
+    def test_server_side_mode_passes_the_option(self, mock_engine):
+        conn = MagicMock()
+        mock_engine.begin.return_value.__enter__.return_value = conn
+        conn.execute.return_value.scalar.return_value = 42
+
+        models.DatabaseManager.record_match("A", "B", "C", "D", 10, 6, 1)
+
+        self.assertTrue(conn.execute.call_args[0][1]["active_only"])
+
+
+if __name__ == "__main__":
+    unittest.main()
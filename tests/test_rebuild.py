@@ -0,0 +1,95 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import text
+
+from sqlite_fixture import SQLiteTestCase
+import scoring
+from models import DatabaseManager
+
+
+START = datetime(2026, 1, 1, 18, 0)
+MATCHES = [
+    # date, a1, a2, b1, b2, goals_a, goals_b
+    (START, "P10", "P11", "P12", "P13", 10, 8),
+    (START + timedelta(minutes=30), "P10", "P12", "P11", "P13", 4, 10),
+    (START + timedelta(minutes=60), "P10", "P13", "P11", "P12", 10, 2),
+]
+STATS_SQL = "SELECT player_id, rating, games, wins, losses, goal_diff, trend FROM player_stats WHERE leaderboard_id = 1 ORDER BY 1"
+
+
+def expected_replay(ids):
+    players = {pid: [pid, name, 1000.0, 0, 0, 0, 0, ""] for name, pid in ids.items()}
+    deltas = []
+    for _, *names, goals_a, goals_b in MATCHES:
+        a1, a2, b1, b2 = (ids[name] for name in names)
+        ratings = [p[2] for p in players.values() if p[3] or p[0] in (a1, a2, b1, b2)]
+        updated, match_deltas = scoring.calculate_match_updates(
+            [players[pid] for pid in (a1, a2, b1, b2)], goals_a, goals_b,
+            (max(ratings) - min(ratings)) * 0.5,
+        )
+        deltas.append(match_deltas)
+        for player in updated:
+            players[player[0]] = player
+    return players, deltas
+
+
+class TestLeaderboardRebuild(SQLiteTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for played_at, *match in MATCHES:
+            self.DM.record_match(*match, 1, played_at=played_at)
+        self.ids = {name: self.player_id(name) for name in ("P10", "P11", "P12", "P13")}
+        self.match_ids = [r[0] for r in self.rows("SELECT id FROM matches ORDER BY date, id")]
+        # Two chunks of matches, so the replay carries its state across a chunk boundary.
+        chunk_size = patch("models.DatabaseManager.REPLAY_CHUNK_SIZE", 2)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+    def execute(self, sql, params=None):
+        with self.engine.begin() as conn:
+            conn.execute(text(sql), params or {})
+
+    def test_audit_reports_drift_without_writing(self):
+        self.execute("UPDATE player_stats SET rating = rating + 5 WHERE player_id = :pid", {"pid": self.ids["P12"]})
+        tables = ("player_stats", "matches", "player_ratings_history", "leaderboards")
+        before = [self.rows(f"SELECT * FROM {table} ORDER BY 1") for table in tables]
+
+        report = DatabaseManager.rebuild_leaderboard(1, audit=True)
+
+        self.assertEqual(report["matches"], 3)
+        self.assertEqual(report["mismatched_matches"], 0)
+        self.assertEqual([d["player_id"] for d in report["drift"]], [self.ids["P12"]])
+        self.assertAlmostEqual(report["drift"][0]["rating_drift"], 5.0)
+        self.assertEqual([self.rows(f"SELECT * FROM {table} ORDER BY 1") for table in tables], before)
+
+    def test_rebuild_rewrites_stats_history_and_stale_deltas(self):
+        players, deltas = expected_replay(self.ids)
+        self.execute("UPDATE player_stats SET rating = 1000, games = 0, wins = 0, losses = 0, goal_diff = 0, trend = ''")
+        self.execute(
+            "UPDATE matches SET delta_a1 = 0, delta_a2 = 0, delta_b1 = 0, delta_b2 = 0 WHERE id = :mid",
+            {"mid": self.match_ids[1]},
+        )
+        self.execute("DELETE FROM player_ratings_history WHERE match_id = :mid", {"mid": self.match_ids[2]})
+
+        report = DatabaseManager.rebuild_leaderboard(1)
+
+        self.assertEqual(report["mismatched_matches"], 1)
+        self.assertEqual(len(report["drift"]), 4)
+        self.assertEqual(
+            self.rows("SELECT delta_a1, delta_a2, delta_b1, delta_b2 FROM matches WHERE id = :mid", mid=self.match_ids[1]),
+            [deltas[1]],
+        )
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM player_ratings_history"), 12)
+        for pid, rating, games, wins, losses, goal_diff, trend in self.rows(STATS_SQL):
+            with self.subTest(player=pid):
+                self.assertAlmostEqual(rating, players[pid][2], places=3)
+                self.assertEqual((games, wins, losses, goal_diff, trend), tuple(players[pid][3:]))
+        report = DatabaseManager.rebuild_leaderboard(1, audit=True)
+        self.assertEqual((report["mismatched_matches"], report["drift"]), (0, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
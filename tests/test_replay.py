@@ -0,0 +1,172 @@
+import random
+import unittest
+
+import numpy as np
+
+import scoring
+
+
+def random_match_log(n_players, n_matches, seed):
+    rng = random.Random(seed)
+    player_idx = []
+    goals_a = []
+    goals_b = []
+    for _ in range(n_matches):
+        player_idx.append(rng.sample(range(n_players), 4))
+        loser_goals = rng.randint(0, 8)
+        if rng.random() < 0.5:
+            goals_a.append(10)
+            goals_b.append(loser_goals)
+        else:
+            goals_a.append(loser_goals)
+            goals_b.append(10)
+    return player_idx, goals_a, goals_b
+
+
+def scalar_replay(player_idx, goals_a, goals_b, n_players, rating_storage="float64", eligible=None):
+    """Chains calculate_match_updates exactly like successive record_match calls."""
+    players = [[i, str(i), 1000.0, 0, 0, 0, 0, ""] for i in range(n_players)]
+    registered = set()
+    deltas = []
+    for quad, ga, gb in zip(player_idx, goals_a, goals_b):
+        registered.update(p for p in quad if eligible is None or p in eligible)
+        ratings = [players[p][2] for p in registered] or [1000.0]
+        threshold = (max(ratings) - min(ratings)) * 0.5
+        updated, match_deltas = scoring.calculate_match_updates(
+            [players[p] for p in quad], ga, gb, threshold
+        )
+        deltas.append(match_deltas)
+        for p, player in zip(quad, updated):
+            if rating_storage == "float32":
+                # REAL column read back through the text protocol.
+                player[2] = float(str(np.float32(player[2])))
+            players[p] = player
+    return players, deltas
+
+
+class TestBatchReplay(unittest.TestCase):
+
+    def assertStateMatches(self, state, players):
+        for p, player in enumerate(players):
+            with self.subTest(player=p):
+                self.assertEqual(state.ratings[p], player[2])
+                self.assertEqual(state.games[p], player[3])
+                self.assertEqual(state.wins[p], player[4])
+                self.assertEqual(state.losses[p], player[5])
+                self.assertEqual(state.goal_diff[p], player[6])
+                self.assertEqual(state.trends[p], player[7])
+
+    def test_replay_is_bit_identical_to_scalar_path(self):
+        """Verifies deltas and final stats against chained calculate_match_updates calls."""
+        player_idx, goals_a, goals_b = random_match_log(12, 1500, seed=20260618)
+
+        for storage in scoring.RATING_STORAGES:
+            with self.subTest(storage=storage):
+                players, deltas = scalar_replay(player_idx, goals_a, goals_b, 12, storage)
+                result = scoring.replay_matches(player_idx, goals_a, goals_b, rating_storage=storage)
+
+                self.assertEqual([tuple(d) for d in result.deltas.tolist()], deltas)
+                self.assertStateMatches(result.state, players)
+
+    def test_ineligible_players_stay_out_of_the_spread(self):
+        """Verifies eligible= against record_match with inactive players left out of the bounds."""
+        player_idx, goals_a, goals_b = random_match_log(12, 800, seed=18)
+        eligible = set(range(12)) - {0, 5, 9}
+
+        for storage in scoring.RATING_STORAGES:
+            with self.subTest(storage=storage):
+                players, deltas = scalar_replay(player_idx, goals_a, goals_b, 12, storage, eligible=eligible)
+                result = scoring.replay_matches(
+                    player_idx, goals_a, goals_b, rating_storage=storage,
+                    eligible=[p in eligible for p in range(12)],
+                )
+
+                self.assertEqual([tuple(d) for d in result.deltas.tolist()], deltas)
+                self.assertStateMatches(result.state, players)
+                full = scoring.replay_matches(player_idx, goals_a, goals_b, rating_storage=storage)
+                self.assertFalse(np.array_equal(full.thresholds, result.thresholds))
+
+    def test_fixed_threshold_matches_scalar_path(self):
+        """Verifies a scalar rating_diff_threshold is applied to every match."""
+        player_idx, goals_a, goals_b = random_match_log(6, 200, seed=7)
+        result = scoring.replay_matches(player_idx, goals_a, goals_b, rating_diff_threshold=25.0)
+
+        players = [[i, str(i), 1000.0, 0, 0, 0, 0, ""] for i in range(6)]
+        for row, (quad, ga, gb) in enumerate(zip(player_idx, goals_a, goals_b)):
+            updated, match_deltas = scoring.calculate_match_updates(
+                [players[p] for p in quad], ga, gb, 25.0
+            )
+            self.assertEqual(tuple(result.deltas[row]), match_deltas)
+            self.assertEqual(list(result.ratings_after[row]), [p[2] for p in updated])
+            for p, player in zip(quad, updated):
+                players[p] = player
+
+        self.assertStateMatches(result.state, players)
+        self.assertTrue((result.thresholds == 25.0).all())
+
+    def test_chunked_replay_continues_from_state(self):
+        """Replaying in chunks from the previous state equals a single replay."""
+        player_idx, goals_a, goals_b = random_match_log(8, 600, seed=3)
+        full = scoring.replay_matches(player_idx, goals_a, goals_b, n_players=8)
+
+        state = None
+        registered = np.zeros(8, dtype=bool)
+        deltas = []
+        for start in range(0, 600, 250):
+            chunk = slice(start, start + 250)
+            part = scoring.replay_matches(
+                player_idx[chunk], goals_a[chunk], goals_b[chunk],
+                state=state, n_players=8, registered=registered,
+            )
+            registered[np.unique(player_idx[chunk])] = True
+            state = part.state
+            deltas.append(part.deltas)
+
+        np.testing.assert_array_equal(np.vstack(deltas), full.deltas)
+        np.testing.assert_array_equal(state.ratings, full.state.ratings)
+        self.assertEqual(state.trends, full.state.trends)
+
+    def test_before_arrays_restart_a_suffix_replay(self):
+        """The stats going into a match are enough to replay everything from it onwards."""
+        player_idx, goals_a, goals_b = random_match_log(8, 300, seed=4)
+        full = scoring.replay_matches(player_idx, goals_a, goals_b, n_players=8)
+        cut = 180
+
+        prefix = scoring.replay_matches(player_idx[:cut], goals_a[:cut], goals_b[:cut], n_players=8)
+        for row, quad in enumerate(player_idx[cut:], start=cut):
+            for slot, p in enumerate(quad):
+                with self.subTest(row=row, slot=slot):
+                    if p not in [q for prev in player_idx[cut:row] for q in prev]:
+                        self.assertEqual(full.ratings_before[row, slot], prefix.state.ratings[p])
+                        self.assertEqual(full.games_before[row, slot], prefix.state.games[p])
+
+        registered = np.zeros(8, dtype=bool)
+        registered[np.unique(player_idx[:cut])] = True
+        suffix = scoring.replay_matches(
+            player_idx[cut:], goals_a[cut:], goals_b[cut:],
+            state=prefix.state, n_players=8, registered=registered,
+        )
+        np.testing.assert_array_equal(suffix.deltas, full.deltas[cut:])
+        np.testing.assert_array_equal(suffix.state.ratings, full.state.ratings)
+
+    def test_dates_define_replay_order(self):
+        """Outputs stay aligned with input rows when dates reorder the replay."""
+        player_idx, goals_a, goals_b = random_match_log(6, 50, seed=11)
+        dates = np.arange(50)[::-1]
+        reversed_result = scoring.replay_matches(
+            player_idx[::-1], goals_a[::-1], goals_b[::-1], dates=dates[::-1]
+        )
+        dated_result = scoring.replay_matches(player_idx, goals_a, goals_b, dates=dates)
+
+        np.testing.assert_array_equal(dated_result.deltas[::-1], reversed_result.deltas)
+        np.testing.assert_array_equal(dated_result.state.ratings, reversed_result.state.ratings)
+
+    def test_rejects_invalid_match_rows(self):
+        with self.assertRaises(ValueError):
+            scoring.replay_matches([[0, 1, 1, 2]], [10], [8])
+        with self.assertRaises(ValueError):
+            scoring.replay_matches([[0, 1, 2, 3]], [10], [8], n_players=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
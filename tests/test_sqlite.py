@@ -0,0 +1,269 @@
+import io
+import random
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import text
+
+from sqlite_fixture import SQLiteTestCase, db
+import scoring
+
+
+START = datetime(2024, 3, 1, 18, 0)
+MATCHES = [
+    ("Anna", "Bruno", "Carla", "Dario", 10, 6),
+    ("Anna", "Carla", "Bruno", "Dario", 3, 10),
+    ("Elio", "Anna", "Dario", "Bruno", 10, 2),
+    ("Carla", "Elio", "Anna", "Dario", 8, 10),
+    ("Bruno", "Elio", "Carla", "Anna", 10, 7),
+    ("Dario", "Carla", "Elio", "Bruno", 10, 0),
+]
+
+
+class TestSQLiteBackend(SQLiteTestCase):
+    """Runs the real queries of DatabaseManager against an in-memory SQLite database."""
+
+    def setUp(self):
+        super().setUp()
+        for i, match in enumerate(MATCHES):
+            self.DM.record_match(*match, 1, played_at=START + timedelta(minutes=10 * i))
+
+    def match_ids(self):
+        with self.engine.connect() as conn:
+            return [r[0] for r in conn.execute(text("SELECT id FROM matches ORDER BY date, id"))]
+
+    def stored_values(self):
+        with self.engine.connect() as conn:
+            return [conn.execute(text(sql)).fetchall() for sql in (
+                "SELECT player_id, rating, games, wins, losses, goal_diff, trend FROM player_stats WHERE leaderboard_id = 1 ORDER BY 1",
+                "SELECT id, delta_a1, delta_a2, delta_b1, delta_b2 FROM matches ORDER BY 1",
+                """SELECT match_id, player_id, rating, pre_rating, pre_games, pre_wins, pre_losses, pre_goal_diff
+                   FROM player_ratings_history ORDER BY 1, 2""",
+            )]
+
+    def assert_consistent(self):
+        report = self.DM.rebuild_leaderboard(1, audit=True)
+        self.assertEqual(report["drift"], [])
+        self.assertEqual(report["mismatched_matches"], 0)
+        self.assertEqual(
+            self.scalar("SELECT COUNT(*) FROM match_participants"), 4 * self.scalar("SELECT COUNT(*) FROM matches")
+        )
+        # The audit tolerates rounding; a rebuild must rewrite exactly what the writes stored.
+        stored = self.stored_values()
+        self.DM.rebuild_leaderboard(1)
+        for table, before, after in zip(("player_stats", "matches", "player_ratings_history"), stored, self.stored_values()):
+            with self.subTest(table=table):
+                self.assertEqual(after, before)
+
+    def assert_ranks_match_full_refresh(self):
+        """Writes only re-rank the players who moved and redo the snapshots after their matches; a full refresh must agree."""
+        ranks_sql = "SELECT player_id, rank FROM leaderboard_ranks ORDER BY rank"
+        snapshots_sql = "SELECT leaderboard_id, taken_at, player_id, rating FROM leaderboard_rating_snapshots ORDER BY 1, 2, 3"
+        with self.engine.begin() as conn:
+            rows, snapshots = conn.execute(text(ranks_sql)).fetchall(), conn.execute(text(snapshots_sql)).fetchall()
+            self.DM._refresh_leaderboard_ranks(conn, [1])
+            self.assertEqual(conn.execute(text(ranks_sql)).fetchall(), rows)
+            self.DM._refresh_leaderboard_ranks(conn, [1], since=datetime.min)
+            self.assertEqual(conn.execute(text(snapshots_sql)).fetchall(), snapshots)
+
+    def test_schema_is_created_at_the_current_version(self):
+        db.init_db()
+
+        self.assertEqual(self.scalar("SELECT MAX(version) FROM schema_version"), db.SCHEMA_VERSION)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM leaderboards"), 2)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM roles WHERE name LIKE 'Leader Manager %'"), 2)
+        with self.engine.connect() as conn:
+            row = conn.execute(text("SELECT a1_id, a2_id, b1_id, b2_id, goals_a, goals_b, fingerprint FROM matches")).first()
+        self.assertEqual(row[6], scoring.match_fingerprint(*row[:6]))
+
+    def test_recorded_matches_replay_to_the_stored_stats(self):
+        self.assert_consistent()
+        leaderboard = self.DM.get_leaderboard(1)
+        self.assertEqual(sum(row[2] for row in leaderboard), 4 * len(MATCHES))
+        self.assertEqual(dict((row[0], row[6]) for row in leaderboard)["Dario"], "W W L W L")
+
+    def test_long_live_sequences_store_the_replayed_values(self):
+        names = [f"P{i}" for i in range(10)]
+        rng = random.Random(3)
+        for i in range(80):
+            quad = rng.sample(names, 4)
+            goals = (10, rng.randint(0, 8)) if rng.random() < 0.5 else (rng.randint(0, 8), 10)
+            if i % 10 == 9:
+                self.DM.record_matches(1, [(*quad, *goals)])
+            else:
+                self.DM.record_match(*quad, *goals, 1, played_at=START + timedelta(hours=1, minutes=i))
+        self.DM.delete_match(self.match_ids()[-1])
+
+        self.assert_consistent()
+
+    def test_live_duplicates_are_rejected(self):
+        self.DM.record_match("Anna", "Bruno", "Carla", "Dario", 10, 4, 1)
+        with self.assertRaisesRegex(ValueError, "saved a few seconds ago"):
+            self.DM.record_match("Bruno", "Anna", "Dario", "Carla", 10, 4, 1)
+
+        ids = self.DM.record_matches(1, [
+            ("Elio", "Anna", "Carla", "Dario", 10, 3),
+            ("Anna", "Elio", "Dario", "Carla", 10, 3),
+            ("Nuovo", "Bruno", "Carla", "Elio", 2, 10),
+        ])
+        self.assertIsNone(ids[1])
+        self.assertEqual(ids[0] + 1, ids[2])
+        self.assert_consistent()
+
+    @patch("models.datetime", wraps=datetime)
+    def test_duplicates_across_the_window_boundary_are_rejected(self, mock_datetime):
+        boundary = datetime(2026, 6, 18, 12, 0, 15)
+        mock_datetime.now.return_value = boundary - timedelta(milliseconds=100)
+        self.DM.record_match("Anna", "Bruno", "Carla", "Dario", 10, 4, 1)
+        self.DM.record_matches(1, [("Elio", "Anna", "Carla", "Dario", 10, 3)])
+
+        mock_datetime.now.return_value = boundary + timedelta(milliseconds=100)
+        with self.assertRaisesRegex(ValueError, "saved a few seconds ago"):
+            self.DM.record_match("Elio", "Anna", "Dario", "Carla", 10, 3, 1)
+        self.assertEqual(self.DM.record_matches(1, [("Bruno", "Anna", "Dario", "Carla", 10, 4)]), [None])
+
+        mock_datetime.now.return_value = boundary + timedelta(seconds=scoring.RECENT_DUPLICATE_MATCH_WINDOW_SECONDS)
+        self.DM.record_match("Anna", "Bruno", "Carla", "Dario", 10, 4, 1)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM matches"), len(MATCHES) + 3)
+        self.assert_consistent()
+
+    def test_deletes_and_back_dated_matches_replay_the_suffix(self):
+        ids = self.match_ids()
+        self.DM.delete_match(ids[-1])
+        self.DM.delete_match(ids[1])
+        self.assertEqual(self.DM.delete_matches([ids[2], ids[4]]), 2)
+        self.DM.record_match("Carla", "Dario", "Anna", "Elio", 10, 8, 1, played_at=START + timedelta(minutes=5))
+
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM matches"), len(MATCHES) - 3)
+        self.assert_consistent()
+
+    def test_replays_register_every_player_stats_row(self):
+        """Like the MIN/MAX of record_match, the replayed spread includes players who have not played."""
+        self.DM.add_player("Zeno", 1)
+        with patch("models.scoring.replay_matches", wraps=scoring.replay_matches) as replay:
+            self.DM.rebuild_leaderboard(1)
+            self.DM.delete_match(self.match_ids()[2])
+
+        self.assertEqual(replay.call_count, 2)
+        for call in replay.call_args_list:
+            self.assertEqual(call.kwargs["n_players"], 6)
+            self.assertTrue(call.kwargs["registered"].all())
+        self.assert_consistent()
+
+    def test_import_creates_players_and_replays_once(self):
+        csv_data = "date,a1,a2,b1,b2,goals_a,goals_b\n" + "".join(
+            f"{(START + timedelta(minutes=10 * i + 5)).isoformat()},Anna,Bruno,Ivo{i},Carla,10,{i}\n" for i in range(3)
+        )
+
+        self.assertEqual(self.DM.import_matches(io.StringIO(csv_data), 1), 3)
+        self.assertEqual(self.scalar("SELECT COUNT(*) FROM players WHERE name LIKE 'Ivo%'"), 3)
+        self.assert_consistent()
+
+    def test_reads_return_datetimes(self):
+        page, cursor = self.DM.get_match_history_page(1, player_id=self.scalar("SELECT id FROM players WHERE name = 'Anna'"))
+        self.assertEqual(cursor, None)
+        self.assertEqual(page[0][0], START + timedelta(minutes=40))
+
+        history = self.DM.get_elo_history(1)
+        self.assertEqual(len(history), 4 * len(MATCHES))
+        self.assertEqual(history["created_at"].iloc[0], START)
+        self.assertEqual(self.DM.get_head_to_head(1, 2, 1), {"together": 1, "together_wins": 1, "against": 3, "against_wins": 1})
+
+    def test_player_status_and_calendar(self):
+        self.DM.toggle_player_status(self.scalar("SELECT id FROM players WHERE name = 'Elio'"), False)
+        self.assertNotIn("Elio", [row[0] for row in self.DM.get_leaderboard(1)])
+        self.assertTrue(self.DM.generate_calendar(1, matches_per_day=2, days=2, seed=0))
+        self.assertEqual(len(self.DM.get_future_matches(1)), 4)
+
+    def test_writes_refresh_ranks_and_rank_changes(self):
+        before = {row[0]: row[7] for row in self.DM.get_leaderboard(1)}
+        self.assertEqual(sorted(before.values()), list(range(1, len(before) + 1)))
+        bottom, top = sorted(before, key=before.get)[-2:], sorted(before, key=before.get)[:2]
+        self.DM.record_match(*bottom, *top, 10, 0, 1)
+        self.DM.record_matches(1, [(*bottom, "Ugo", top[0], 10, 8)])
+
+        leaderboard = self.DM.get_leaderboard(1)
+        self.assertEqual([row[7] for row in leaderboard], list(range(1, len(leaderboard) + 1)))
+        self.assertEqual([row[1] for row in leaderboard], sorted((row[1] for row in leaderboard), reverse=True))
+        ranks, changes = {row[0]: row[7] for row in leaderboard}, {row[0]: row[8:] for row in leaderboard}
+        self.assertEqual(changes.pop("Ugo"), (None, None))
+        # The other matches are older than a week, so both changes compare with the standings before.
+        self.assertEqual(changes, {name: (rank - ranks[name],) * 2 for name, rank in before.items()})
+        self.assertGreater(changes[bottom[0]][0], 0)
+
+        self.assert_ranks_match_full_refresh()
+        self.DM.delete_match(self.match_ids()[-1])
+        self.assert_ranks_match_full_refresh()
+        self.DM.record_match(*top, *bottom, 10, 8, 1, played_at=datetime.now() - timedelta(days=3))
+        self.assert_ranks_match_full_refresh()
+        self.DM.delete_match(self.match_ids()[-2])
+        self.assert_ranks_match_full_refresh()
+
+        self.DM.add_player("Zeno", 1)
+        with_zeno = self.DM.get_leaderboard(1)
+        self.assertEqual([row[7] for row in with_zeno], list(range(1, len(leaderboard) + 2)))
+        self.assertEqual(next(row[8:] for row in with_zeno if row[0] == "Zeno"), (None, None))
+        elio = self.scalar("SELECT id FROM players WHERE name = 'Elio'")
+        self.assertEqual(self.DM.get_player_rank(elio, 1), (ranks["Elio"], *changes["Elio"]))
+        self.DM.toggle_player_status(elio, False)
+        self.assertIsNone(self.DM.get_player_rank(elio, 1))
+        self.assertEqual([row[7] for row in self.DM.get_leaderboard(1)], list(range(1, len(leaderboard) + 1)))
+
+    def test_quiet_players_show_no_rank_change(self):
+        names = [f"Q{i}" for i in range(30)]
+        rng = random.Random(4)
+        month_ago = datetime.now() - timedelta(days=30)
+        for i in range(150):
+            goals = (10, rng.randint(0, 8)) if rng.random() < 0.5 else (rng.randint(0, 8), 10)
+            self.DM.record_match(*rng.sample(names, 4), *goals, 2, played_at=month_ago + timedelta(minutes=i))
+        with self.engine.begin() as conn:
+            self.DM._refresh_leaderboard_ranks(conn, [2])
+
+        leaderboard = self.DM.get_leaderboard(2)
+        # The history keeps truncated ratings: players sharing an integer part must keep their order.
+        integer_parts = [int(row[1]) for row in leaderboard]
+        self.assertLess(len(set(integer_parts)), len(integer_parts))
+        self.assertEqual({row[8:] for row in leaderboard}, {(0, 0)})
+
+    @patch("models.datetime", wraps=datetime)
+    def test_rank_changes_move_with_the_clock_on_read_only_reads(self, mock_datetime):
+        before = {row[0]: row[7] for row in self.DM.get_leaderboard(1)}
+        bottom, top = sorted(before, key=before.get)[-2:], sorted(before, key=before.get)[:2]
+        played_at = datetime(2026, 6, 18, 12, 40)
+        mock_datetime.now.return_value = played_at
+        self.DM.record_match(*bottom, *top, 10, 0, 1)
+        moved = {row[0]: row[8] for row in self.DM.get_leaderboard(1)}
+        self.assertGreater(moved[bottom[0]], 0)
+        self.assertEqual(moved, {row[0]: row[9] for row in self.DM.get_leaderboard(1)})
+
+        # Two quiet days later the match is out of the 24h window but still within 7 days,
+        # and past 8 days it is out of both; the reads neither write nor lock.
+        version = self.scalar("SELECT version FROM leaderboards WHERE id = 1")
+        elio = self.scalar("SELECT id FROM players WHERE name = 'Elio'")
+        with patch("models.engine") as mock_engine:
+            mock_datetime.now.return_value = played_at + timedelta(days=2)
+            leaderboard = self.DM.get_leaderboard(1)
+            self.assertEqual({row[8] for row in leaderboard}, {0})
+            self.assertEqual({row[0]: row[9] for row in leaderboard}, moved)
+            self.assertEqual(self.DM.get_player_rank(elio, 1)[1:], (0, moved["Elio"]))
+            # Within the hour of the 7 days the cutoff still falls before the match.
+            mock_datetime.now.return_value = played_at + timedelta(days=7, minutes=10)
+            self.assertEqual({row[0]: row[9] for row in self.DM.get_leaderboard(1)}, moved)
+            mock_datetime.now.return_value = played_at + timedelta(days=8)
+            self.assertEqual({row[8:] for row in self.DM.get_leaderboard(1)}, {(0, 0)})
+        mock_engine.begin.assert_not_called()
+        self.assertEqual(self.scalar("SELECT version FROM leaderboards WHERE id = 1"), version)
+
+    def test_server_side_elo_and_old_schemas_are_refused(self):
+        with patch("db.SERVER_SIDE_ELO", True):
+            with self.assertRaisesRegex(RuntimeError, "PostgreSQL"):
+                db.init_db()
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM schema_version WHERE version = :version"), {"version": db.SCHEMA_VERSION})
+        with self.assertRaisesRegex(RuntimeError, "delete it to recreate it"):
+            db.init_db()
+
+
+if __name__ == "__main__":
+    unittest.main()